@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Set
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+# Запущенные вызовы держим здесь, пока результат не доставлен в GUI-поток,
+# иначе Python может собрать объект с сигналами раньше времени.
+_PENDING: Set["AsyncCall"] = set()
+
+
+class _Signals(QObject):
+    finished = Signal(object)
+    failed = Signal(str)
+    progress = Signal(object, object)  # done, total (байты могут не влезть в int32)
+
+
+class AsyncCall(QRunnable):
+    """
+    fn(*args) в QThreadPool.globalInstance(); результат приходит сигналом
+    finished(result) (или failed(error)) уже в GUI-потоке.
+
+        AsyncCall(self.client.backup_list).on_done(self._on_list).start()
+    """
+
+    def __init__(self, fn: Callable[..., Any], *args: Any):
+        super().__init__()
+        # временем жизни управляем сами (_PENDING), не C++ стороной
+        self.setAutoDelete(False)
+        self.fn = fn
+        self.args = args
+        self.signals = _Signals()
+        self.finished = self.signals.finished
+        self.failed = self.signals.failed
+
+    def on_done(self, slot: Callable[[Any], None], on_error: Callable[[str], None] | None = None) -> "AsyncCall":
+        self.finished.connect(slot)
+        if on_error is not None:
+            self.failed.connect(on_error)
+        return self
+
+    def run(self) -> None:
+        try:
+            res = self.fn(*self.args)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(res)
+
+    def _release(self, *_: Any) -> None:
+        _PENDING.discard(self)
+
+    def start(self) -> "AsyncCall":
+        # подключаем последним — пользовательские слоты отработают раньше
+        self.finished.connect(self._release)
+        self.failed.connect(self._release)
+        _PENDING.add(self)
+        QThreadPool.globalInstance().start(self)
+        return self
+
+
+class FileOpWorker(AsyncCall):
+    """
+    AsyncCall для передачи файлов: fn получает progress=callback(done, total),
+    вызовы которого приходят сигналом progress в GUI-поток.
+    """
+
+    def __init__(self, fn: Callable[..., Any], *args: Any):
+        super().__init__(fn, *args)
+        self.progress = self.signals.progress
+
+    def on_progress(self, slot: Callable[[Any, Any], None]) -> "FileOpWorker":
+        self.progress.connect(slot)
+        return self
+
+    def run(self) -> None:
+        try:
+            res = self.fn(*self.args, progress=self.signals.progress.emit)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(res)
@@ -16,6 +16,7 @@ from PySide6.QtWidgets import (
     QWidget,
 )
 
+from app.async_call import AsyncCall
 from app.socket_client import SocketClient
 
 
@@ -24,6 +25,7 @@ class BackupsDialog(QDialog):
         super().__init__(parent)
         self.client = client
         self.setWindowTitle("Backups (admin)")
+        self._restoring = ""
 
         # ===== backups list =====
         self.list = QListWidget()
@@ -84,7 +86,7 @@ class BackupsDialog(QDialog):
         self.load_sched_btn.clicked.connect(self.load_schedule)
         self.save_sched_btn.clicked.connect(self.save_schedule)
 
-        # initial load
+        # initial load (оба запроса уходят в пул потоков, UI не ждёт)
         self.reload()
         self.load_schedule()
 
@@ -101,24 +103,37 @@ class BackupsDialog(QDialog):
         h.addStretch(1)
         return w
 
+    def _on_call_error(self, err: str):
+        QMessageBox.critical(self, "Error", err)
+
     # ===== backups =====
 
     def reload(self):
-        resp = self.client.backup_list()
-        if not resp.get("ok"):
-            QMessageBox.critical(self, "Error", resp.get("error", "backup_list failed"))
+        AsyncCall(self.client.backup_list).on_done(self._on_backup_list, self._on_call_error).start()
+
+    def _on_backup_list(self, resp):
+        if not resp.ok:
+            QMessageBox.critical(self, "Error", resp.error or "backup_list failed")
             return
 
         self.list.clear()
-        for name in resp["data"]["backups"]:
+        for name in resp.data["backups"]:
             self.list.addItem(name)
 
     def create_backup(self):
-        resp = self.client.backup_create()
-        if not resp.get("ok"):
-            QMessageBox.critical(self, "Error", resp.get("error", "backup_create failed"))
+        self.create_btn.setEnabled(False)
+        AsyncCall(self.client.backup_create).on_done(self._on_backup_created, self._on_create_error).start()
+
+    def _on_create_error(self, err: str):
+        self.create_btn.setEnabled(True)
+        self._on_call_error(err)
+
+    def _on_backup_created(self, resp):
+        self.create_btn.setEnabled(True)
+        if not resp.ok:
+            QMessageBox.critical(self, "Error", resp.error or "backup_create failed")
             return
-        QMessageBox.information(self, "OK", f'Created: {resp["data"]["name"]}')
+        QMessageBox.information(self, "OK", f'Created: {resp.data["name"]}')
         self.reload()
 
     def restore_backup(self):
@@ -135,23 +150,34 @@ class BackupsDialog(QDialog):
         ) != QMessageBox.Yes:
             return
 
-        resp = self.client.backup_restore(name)
-        if not resp.get("ok"):
-            QMessageBox.critical(self, "Error", resp.get("error", "backup_restore failed"))
+        self._restoring = name
+        self.restore_btn.setEnabled(False)
+        AsyncCall(self.client.backup_restore, name).on_done(self._on_backup_restored, self._on_restore_error).start()
+
+    def _on_restore_error(self, err: str):
+        self.restore_btn.setEnabled(True)
+        self._on_call_error(err)
+
+    def _on_backup_restored(self, resp):
+        self.restore_btn.setEnabled(True)
+        if not resp.ok:
+            QMessageBox.critical(self, "Error", resp.error or "backup_restore failed")
             return
 
-        QMessageBox.information(self, "OK", f"Restored: {name}\nRestart UI if needed.")
+        QMessageBox.information(self, "OK", f"Restored: {self._restoring}\nRestart UI if needed.")
         self.reload()
 
     # ===== schedule =====
 
     def load_schedule(self):
-        resp = self.client.backup_schedule_get()
-        if not resp.get("ok"):
-            QMessageBox.critical(self, "Error", resp.get("error", "backup_schedule_get failed"))
+        AsyncCall(self.client.backup_schedule_get).on_done(self._on_schedule_loaded, self._on_call_error).start()
+
+    def _on_schedule_loaded(self, resp):
+        if not resp.ok:
+            QMessageBox.critical(self, "Error", resp.error or "backup_schedule_get failed")
             return
 
-        s = resp.get("schedule", {})
+        s = resp.schedule or {}
         self.auto_enabled.setChecked(bool(s.get("enabled", True)))
         self.hour.setValue(int(s.get("hour", 2)))
         self.minute.setValue(int(s.get("minute", 0)))
@@ -169,11 +195,15 @@ class BackupsDialog(QDialog):
         minute = int(self.minute.value())
         timezone = self.tz.currentText()
 
-        resp = self.client.backup_schedule_set(enabled, hour, minute, timezone)
-        if not resp.get("ok"):
-            QMessageBox.critical(self, "Error", resp.get("error", "backup_schedule_set failed"))
+        AsyncCall(self.client.backup_schedule_set, enabled, hour, minute, timezone).on_done(
+            self._on_schedule_saved, self._on_call_error
+        ).start()
+
+    def _on_schedule_saved(self, resp):
+        if not resp.ok:
+            QMessageBox.critical(self, "Error", resp.error or "backup_schedule_set failed")
             return
 
-        s = resp.get("schedule", {})
+        s = resp.schedule or {}
         self.next_run.setText(s.get("next_run_time") or "-")
         QMessageBox.information(self, "Saved", "Backup schedule saved and applied.")
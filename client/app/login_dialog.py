@@ -2,6 +2,7 @@ from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QFormLayout, QLineEdit, QPushButton, QMessageBox
 )
 
+from app.async_call import AsyncCall
 from app.socket_client import SocketClient
 
 
@@ -28,8 +29,18 @@ class LoginDialog(QDialog):
         self.setLayout(layout)
 
     def _do_login(self):
-        resp = self.client.login(self.login.text().strip(), self.password.text())
-        if not resp.get("ok"):
-            QMessageBox.critical(self, "Login failed", resp.get("error", "error"))
+        self.btn.setEnabled(False)
+        AsyncCall(self.client.login, self.login.text().strip(), self.password.text()).on_done(
+            self._on_login, self._on_login_error
+        ).start()
+
+    def _on_login_error(self, err: str):
+        self.btn.setEnabled(True)
+        QMessageBox.critical(self, "Login failed", err)
+
+    def _on_login(self, resp):
+        self.btn.setEnabled(True)
+        if not resp.ok:
+            QMessageBox.critical(self, "Login failed", resp.error or "error")
             return
         self.accept()
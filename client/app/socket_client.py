@@ -1,26 +1,79 @@
 import socket
 import os
 import struct
-from typing import Any, Dict, Optional, List
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Optional, List, Tuple
 
 from app.protocol import send_msg, recv_msg
-from app.crypto_ctx import init_crypto, pub_to_json, pub_from_json
-from app.secure_protocol import send_encrypted, recv_encrypted, send_encrypted_bin, recv_encrypted_bin
-
-
-def _pack_multi_files(blobs: List[bytes]) -> bytes:
+from app.crypto_ctx import CryptoCtx, init_crypto, pub_to_json
+from app.secure_protocol import (
+    STREAM_CHUNK,
+    Response,
+    encode_msg,
+    recv_session_key,
+    send_session_encoded,
+    recv_session,
+    recv_session_typed,
+    iter_stream_body,
+    recv_session_bin,
+    send_encrypted_stream,
+)
+
+_U32 = struct.Struct(">I")
+_NO_TOKEN_TYPES = frozenset(("login", "ping"))
+# запросы без побочных эффектов: их можно повторить, даже если сервер успел
+# получить запрос (обрыв во время чтения ответа). Остальные — только если
+# обрыв случился ещё при отправке по старому (простаивавшему) соединению
+_RETRY_SAFE_TYPES = frozenset((
+    "ping", "login", "list_tables", "table_meta", "tables_meta", "select", "search",
+    "fk_options", "backup_list", "backup_schedule_get", "file_get", "file_get_stream",
+))
+# запросы без параметров: их msgpack-байты зависят только от (type, token)
+_STATIC_TYPES = frozenset(("ping", "list_tables", "backup_list", "backup_schedule_get"))
+# столько таблиц сервер принимает в одном tables_meta
+TABLES_META_MAX = 1000
+RECV_BUFFER = 128 * 1024
+SOCK_BUF = 1 << 20  # SO_SNDBUF для upload, SO_RCVBUF для file_get
+
+
+def _iter_file(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _iter_progress(chunks: Iterator[bytes], total: int, progress: Callable[[int, int], None]) -> Iterator[bytes]:
+    done = 0
+    for chunk in chunks:
+        yield chunk
+        done += len(chunk)
+        progress(done, total)
+
+
+def _pack_multi_files(paths: List[str]) -> Iterator[Any]:
     """
-    Custom framing for multiple files:
+    Custom framing for multiple files (streamed from disk):
       [count:4]
       repeat:
         [len:4][bytes]
+    Длины не шлются отдельными кадрами: они идут gather-списком вместе
+    с первым куском следующего файла (без склейки в один bytes).
     """
-    out = bytearray()
-    out += struct.pack(">I", len(blobs))
-    for b in blobs:
-        out += struct.pack(">I", len(b))
-        out += b
-    return bytes(out)
+    head = [_U32.pack(len(paths))]
+    for p in paths:
+        head.append(_U32.pack(os.stat(p).st_size))
+        for chunk in _iter_file(p):
+            if head:
+                head.append(chunk)
+                yield head
+                head = []
+            else:
+                yield chunk
+    if head:
+        yield head
 
 
 class SocketClient:
@@ -29,82 +82,266 @@ class SocketClient:
         self.port = port
         self.timeout = timeout
         self.token: str | None = None
-        self.crypto = init_crypto()
-
-    def call(self, msg: Dict[str, Any]) -> Dict[str, Any]:
-        if self.token and "token" not in msg and msg.get("type") not in ("login", "ping"):
-            msg["token"] = self.token
-
-        with socket.create_connection((self.host, self.port), timeout=self.timeout) as s:
-            send_msg(s, {"type": "hello", "pub": pub_to_json(self.crypto.pub)})
-            hello_ack = recv_msg(s)
+        self._crypto: CryptoCtx | None = None
+        self._pub_json: Dict[str, Any] | None = None
+
+        # persistent session (port 9090): одно соединение + AES ключ на все вызовы
+        self._sock: socket.socket | None = None
+        self._rf: BinaryIO | None = None  # буферизованное чтение из _sock
+        self._session_key: bytes | None = None
+        self._lock = threading.Lock()
+        self._req_cache: Dict[tuple, bytes] = {}
+        # getaddrinfo по порту — резолвим один раз, а не на каждое соединение
+        self._addrinfos: Dict[int, list] = {}
+
+    @property
+    def crypto(self) -> CryptoCtx:
+        # ключи нужны только к первому запросу, не к созданию клиента
+        if self._crypto is None:
+            self._crypto = init_crypto()
+        return self._crypto
+
+    @property
+    def pub_json(self) -> Dict[str, Any]:
+        # str(pub.n) для большого int не бесплатный, а результат всегда один и тот же
+        if self._pub_json is None:
+            self._pub_json = pub_to_json(self.crypto.pub)
+        return self._pub_json
+
+    def _connect(self, port: int | None = None, sndbuf: int = 0, rcvbuf: int = 0) -> socket.socket:
+        port = port or self.port
+        infos = self._addrinfos.get(port)
+        if infos is None:
+            infos = self._addrinfos[port] = socket.getaddrinfo(self.host, port, type=socket.SOCK_STREAM)
+
+        err: OSError | None = None
+        for family, type_, proto, _, sa in infos:
+            s = socket.socket(family, type_, proto)
+            try:
+                s.settimeout(self.timeout)
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                # буферы до connect(), чтобы учлись при выборе TCP window scale
+                if sndbuf:
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+                if rcvbuf:
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+                s.connect(sa)
+                return s
+            except OSError as e:
+                s.close()
+                err = e
+
+        # адрес мог смениться — в следующий раз резолвим заново
+        self._addrinfos.pop(port, None)
+        raise err or OSError(f"cannot resolve {self.host}:{port}")
+
+    def _open_secure_channel(self, port: int | None = None, **sockopts: int) -> Tuple[socket.socket, BinaryIO, bytes]:
+        """
+        connect -> hello (наш pub) -> hello_ack -> сессионный AES ключ.
+        Общий handshake для основного порта и upload. RuntimeError, если сервер отказал.
+        """
+        s = self._connect(port, **sockopts)
+        rf = s.makefile("rb", buffering=RECV_BUFFER)
+        try:
+            send_msg(s, {"type": "hello", "pub": self.pub_json})
+            hello_ack = recv_msg(rf)
             if not hello_ack.get("ok"):
-                return hello_ack
-            server_pub = pub_from_json(hello_ack["pub"])
+                raise RuntimeError(hello_ack.get("error", "hello failed"))
+            session_key = recv_session_key(rf, self.crypto.priv, mode=self.crypto.mode)
+        except Exception:
+            rf.close()
+            s.close()
+            raise
+        return s, rf, session_key
+
+    def _ensure_session(self) -> None:
+        if self._sock is not None:
+            return
+        self._sock, self._rf, self._session_key = self._open_secure_channel(rcvbuf=SOCK_BUF)
+
+    def _reset_session(self) -> None:
+        if self._rf is not None:
+            try:
+                self._rf.close()
+            except OSError:
+                pass
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._rf = None
+        self._session_key = None
+
+    def _encode_request(self, msg: Dict[str, Any]) -> bytes:
+        t = msg.get("type")
+        if t not in _STATIC_TYPES or len(msg) > 2 or (len(msg) == 2 and "token" not in msg):
+            return encode_msg(msg)
+
+        cache_key = (t, msg.get("token"))
+        plain = self._req_cache.get(cache_key)
+        if plain is None:
+            # токен меняется только при login — старые записи не нужны
+            if len(self._req_cache) > 32:
+                self._req_cache.clear()
+            plain = self._req_cache[cache_key] = encode_msg(msg)
+        return plain
+
+    def _exchange(self, msg: Dict[str, Any], bin_reply: bool = False) -> Any:
+        """
+        Один запрос/ответ по persistent-сессии.
+        Если сервер закрыл соединение — переподключаемся один раз (см. _exchange_locked).
+        """
+        plain = self._encode_request(msg)
+        recv = recv_session_bin if bin_reply else recv_session_typed
+        with self._lock:
+            return self._exchange_locked(plain, recv, msg.get("type") in _RETRY_SAFE_TYPES)
+
+    def _exchange_locked(self, plain: bytes, recv: Callable[[BinaryIO, bytes], Any], retry_safe: bool) -> Any:
+        # вызывается под self._lock
+        for attempt in range(2):
+            reused = self._sock is not None
+            self._ensure_session()
+            sent = False
+            try:
+                send_session_encoded(self._sock, plain, self._session_key)
+                sent = True
+                return recv(self._rf, self._session_key)
+            except ConnectionError:
+                self._reset_session()
+                # повтор — только по старому соединению (сервер мог закрыть простаивавшее)
+                # и только если запрос точно не выполнен или его повтор безвреден:
+                # insert/delete/backup_create дважды выполнять нельзя
+                if attempt or not reused or (sent and not retry_safe):
+                    raise
+            except Exception:
+                # поток мог рассинхронизироваться — соединение больше не используем
+                self._reset_session()
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._reset_session()
+
+    def call(self, msg: Dict[str, Any]) -> Response:
+        if self.token and msg.get("type") not in _NO_TOKEN_TYPES and "token" not in msg:
+            msg["token"] = self.token
 
-            send_encrypted(s, msg, server_pub, mode=self.crypto.mode)
-            return recv_encrypted(s, self.crypto.priv, mode=self.crypto.mode)
+        return self._exchange(msg)
 
     # --- sugar ---
-    def list_tables(self) -> Dict[str, Any]:
+    def list_tables(self) -> Response:
         return self.call({"type": "list_tables"})
 
-    def table_meta(self, table: str) -> Dict[str, Any]:
+    def table_meta(self, table: str) -> Response:
         return self.call({"type": "table_meta", "table": table})
 
-    def select(self, table: str, limit: int = 200, offset: int = 0) -> Dict[str, Any]:
+    def tables_meta(self, tables: List[str]) -> Response:
+        # resp.meta: {table: meta}; большой список — несколькими запросами
+        if len(tables) <= TABLES_META_MAX:
+            return self.call({"type": "tables_meta", "tables": tables})
+        meta: Dict[str, Any] = {}
+        for i in range(0, len(tables), TABLES_META_MAX):
+            resp = self.call({"type": "tables_meta", "tables": tables[i:i + TABLES_META_MAX]})
+            if not resp.ok:
+                return resp
+            meta.update(resp.meta or {})
+        resp.meta = meta
+        return resp
+
+    def select(self, table: str, limit: int = 200, offset: int = 0) -> Response:
         return self.call({"type": "select", "table": table, "limit": limit, "offset": offset})
 
-    def search(self, table: str, query: str, column: Optional[str] = None, limit: int = 200, offset: int = 0) -> Dict[str, Any]:
+    def search(self, table: str, query: str, column: Optional[str] = None, limit: int = 200, offset: int = 0) -> Response:
         msg: Dict[str, Any] = {"type": "search", "table": table, "query": query, "limit": limit, "offset": offset}
         if column:
             msg["column"] = column
         return self.call(msg)
 
-    def insert(self, table: str, values: Dict[str, Any]) -> Dict[str, Any]:
+    def insert(self, table: str, values: Dict[str, Any]) -> Response:
         return self.call({"type": "insert", "table": table, "values": values})
 
-    def update(self, table: str, pk: Dict[str, Any], values: Dict[str, Any]) -> Dict[str, Any]:
+    def update(self, table: str, pk: Dict[str, Any], values: Dict[str, Any]) -> Response:
         return self.call({"type": "update", "table": table, "pk": pk, "values": values})
 
-    def delete(self, table: str, pk: Dict[str, Any]) -> Dict[str, Any]:
+    def delete(self, table: str, pk: Dict[str, Any]) -> Response:
         return self.call({"type": "delete", "table": table, "pk": pk})
 
-    def fk_options(self, ref_table: str, id_column: str = "id", label_column: Optional[str] = None, limit: int = 200, offset: int = 0) -> Dict[str, Any]:
+    def fk_options(self, ref_table: str, id_column: str = "id", label_column: Optional[str] = None, limit: int = 200, offset: int = 0) -> Response:
         msg: Dict[str, Any] = {"type": "fk_options", "ref_table": ref_table, "id_column": id_column, "limit": limit, "offset": offset}
         if label_column:
             msg["label_column"] = label_column
         return self.call(msg)
 
-    def create_table(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+    def create_table(self, payload: Dict[str, Any]) -> Response:
         return self.call({"type": "create_table", "payload": payload})
 
     # --- files (INLINE MODEL) ---
 
-    def file_delete(self, table: str, pk: Dict[str, Any], base: str) -> Dict[str, Any]:
+    def file_delete(self, table: str, pk: Dict[str, Any], base: str) -> Response:
         return self.call({"type": "file_delete", "table": table, "pk": pk, "base": base})
 
-    def file_get(self, table: str, pk: Dict[str, Any], base: str) -> tuple[Dict[str, Any], bytes]:
-        with socket.create_connection((self.host, self.port), timeout=self.timeout) as s:
-            send_msg(s, {"type": "hello", "pub": pub_to_json(self.crypto.pub)})
-            hello_ack = recv_msg(s)
-            if not hello_ack.get("ok"):
-                raise RuntimeError(hello_ack.get("error", "hello failed"))
-            server_pub = pub_from_json(hello_ack["pub"])
+    def file_get(self, table: str, pk: Dict[str, Any], base: str) -> tuple[Dict[str, Any], memoryview]:
+        req = {"type": "file_get", "table": table, "pk": pk, "base": base}
+        if self.token:
+            req["token"] = self.token
 
-            req = {"type": "file_get", "table": table, "pk": pk, "base": base}
-            if self.token:
-                req["token"] = self.token
-            send_encrypted(s, req, server_pub, mode=self.crypto.mode)
+        header, data = self._exchange(req, bin_reply=True)
+        if not header.get("ok"):
+            raise RuntimeError(header.get("error", "file_get failed"))
+        return header["meta"], data
 
-            header, data = recv_encrypted_bin(s, self.crypto.priv, mode=self.crypto.mode)
+    def file_get_stream(self, table: str, pk: Dict[str, Any], base: str) -> Iterator[Any]:
+        """
+        Первым элементом отдаёт meta (с полем size), дальше — куски файла
+        по мере прихода кадров (по STREAM_CHUNK). Пока поток не дочитан,
+        сессия занята.
+        """
+        req = {"type": "file_get_stream", "table": table, "pk": pk, "base": base}
+        if self.token:
+            req["token"] = self.token
+
+        with self._lock:
+            header = self._exchange_locked(encode_msg(req), recv_session, True)
             if not header.get("ok"):
                 raise RuntimeError(header.get("error", "file_get failed"))
-            return header["meta"], data
 
-    def file_attach(self, table: str, pk: Dict[str, Any], base: str, path: str, mime_type: Optional[str] = None) -> Dict[str, Any]:
+            size = int(header["size"])
+            done = False
+            try:
+                yield {**header["meta"], "size": size}
+                yield from iter_stream_body(self._rf, self._session_key, size)
+                done = True
+            finally:
+                if not done:
+                    # поток бросили на середине — остаток кадров в сокете, соединение не переиспользуем
+                    self._reset_session()
+
+    def _upload(self, header: Dict[str, Any], chunks: Iterator[bytes]) -> Response:
         upload_port = 9091
-        data = open(path, "rb").read()
+        if self.token:
+            header["token"] = self.token
+
+        try:
+            s, rf, session_key = self._open_secure_channel(upload_port, sndbuf=SOCK_BUF)
+        except RuntimeError as e:
+            return Response(ok=False, error=str(e))
+
+        with s, rf:
+            send_encrypted_stream(s, header, chunks, session_key)
+            return recv_session_typed(rf, session_key)
+
+    def file_attach(
+        self,
+        table: str,
+        pk: Dict[str, Any],
+        base: str,
+        path: str,
+        mime_type: Optional[str] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Response:
+        size = os.stat(path).st_size
         header: Dict[str, Any] = {
             "type": "file_attach",
             "table": table,
@@ -112,36 +349,36 @@ class SocketClient:
             "base": base,
             "original_name": os.path.basename(path),
             "mime_type": mime_type,
+            "size": size,
         }
-        if self.token:
-            header["token"] = self.token
-
-        with socket.create_connection((self.host, upload_port), timeout=self.timeout) as s:
-            send_msg(s, {"type": "hello", "pub": pub_to_json(self.crypto.pub)})
-            hello_ack = recv_msg(s)
-            if not hello_ack.get("ok"):
-                return hello_ack
-            server_pub = pub_from_json(hello_ack["pub"])
-
-            send_encrypted_bin(s, header, data, server_pub, mode=self.crypto.mode)
-            return recv_encrypted(s, self.crypto.priv, mode=self.crypto.mode)
+        chunks = _iter_file(path)
+        if progress is not None:
+            chunks = _iter_progress(chunks, size, progress)
+        return self._upload(header, chunks)
 
     # --- NEW: insert with required files in one operation (bin) ---
 
-    def insert_with_files(self, table: str, values: Dict[str, Any], files: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def insert_with_files(self, table: str, values: Dict[str, Any], files: List[Dict[str, Any]]) -> Response:
         """
         files: list of
           { "base": str, "path": str, "mime_type": Optional[str] }
         Server will store inline and insert row with *_name/*_data filled.
         """
-        upload_port = 9091
+        return self._upload_with_files({"type": "insert_with_files", "table": table, "values": values}, files)
+
+    def update_with_files(self, table: str, pk: Dict[str, Any], values: Dict[str, Any], files: List[Dict[str, Any]]) -> Response:
+        """
+        Обновление полей строки и замена файлов одним запросом (один UPDATE на сервере).
+        files — как в insert_with_files; values может быть пустым.
+        """
+        return self._upload_with_files({"type": "update_with_files", "table": table, "pk": pk, "values": values}, files)
 
+    def _upload_with_files(self, header: Dict[str, Any], files: List[Dict[str, Any]]) -> Response:
+        paths: List[str] = []
         descs: List[Dict[str, Any]] = []
-        blobs: List[bytes] = []
         for f in files:
             p = f["path"]
-            b = open(p, "rb").read()
-            blobs.append(b)
+            paths.append(p)
             descs.append(
                 {
                     "base": f["base"],
@@ -150,50 +387,34 @@ class SocketClient:
                 }
             )
 
-        header: Dict[str, Any] = {
-            "type": "insert_with_files",
-            "table": table,
-            "values": values,
-            "files": descs,
-        }
-        if self.token:
-            header["token"] = self.token
-
-        packed = _pack_multi_files(blobs)
-
-        with socket.create_connection((self.host, upload_port), timeout=self.timeout) as s:
-            send_msg(s, {"type": "hello", "pub": pub_to_json(self.crypto.pub)})
-            hello_ack = recv_msg(s)
-            if not hello_ack.get("ok"):
-                return hello_ack
-            server_pub = pub_from_json(hello_ack["pub"])
-
-            send_encrypted_bin(s, header, packed, server_pub, mode=self.crypto.mode)
-            return recv_encrypted(s, self.crypto.priv, mode=self.crypto.mode)
+        header["files"] = descs
+        # [count:4] + [len:4][bytes] на каждый файл
+        header["size"] = 4 + sum(4 + os.stat(p).st_size for p in paths)
+        return self._upload(header, _pack_multi_files(paths))
 
     # --- auth / admin ---
-    def login(self, login: str, password: str) -> Dict[str, Any]:
+    def login(self, login: str, password: str) -> Response:
         resp = self.call({"type": "login", "login": login, "password": password})
-        if resp.get("ok") and resp.get("token"):
-            self.token = resp["token"]
+        if resp.ok and resp.token:
+            self.token = resp.token
         return resp
 
-    def user_create(self, login: str, password: str, full_name: str, role: str = "user") -> Dict[str, Any]:
+    def user_create(self, login: str, password: str, full_name: str, role: str = "user") -> Response:
         return self.call({"type": "user_create", "login": login, "password": password, "full_name": full_name, "role": role})
 
-    def backup_list(self) -> Dict[str, Any]:
+    def backup_list(self) -> Response:
         return self.call({"type": "backup_list"})
 
-    def backup_create(self) -> Dict[str, Any]:
+    def backup_create(self) -> Response:
         return self.call({"type": "backup_create"})
 
-    def backup_restore(self, name: str) -> Dict[str, Any]:
+    def backup_restore(self, name: str) -> Response:
         return self.call({"type": "backup_restore", "name": name})
 
-    def backup_schedule_get(self):
+    def backup_schedule_get(self) -> Response:
         return self.call({"type": "backup_schedule_get"})
 
-    def backup_schedule_set(self, enabled: bool, hour: int, minute: int, timezone: str = "UTC"):
+    def backup_schedule_set(self, enabled: bool, hour: int, minute: int, timezone: str = "UTC") -> Response:
         return self.call({
             "type": "backup_schedule_set",
             "enabled": enabled,
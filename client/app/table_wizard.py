@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import functools
+import re
 from typing import Any, Dict, List
 
+from PySide6.QtCore import QTimer
 from PySide6.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, QLineEdit, QPushButton,
     QComboBox, QCheckBox, QListWidget, QLabel, QMessageBox, QSpinBox
@@ -12,6 +15,15 @@ from PySide6.QtWidgets import QAbstractItemView
 ALLOWED_TYPES = ["integer", "bigint", "varchar", "text", "bool", "timestamp", "date", "bytea"]
 FILE_STORAGE_MODES = ["base64", "blob", "fs"]
 
+# то же, что name.replace("_", "").isalnum(): \w == isalnum() + "_",
+# и хотя бы один символ не "_"
+_IDENT_RE = re.compile(r"\A(?=\w*[^\W_])\w+\Z")
+
+
+@functools.lru_cache(maxsize=256)
+def _is_valid_ident(name: str) -> bool:
+    return _IDENT_RE.match(name) is not None
+
 
 class TableWizard(QDialog):
     """
@@ -27,9 +39,15 @@ class TableWizard(QDialog):
         self.setWindowTitle("Create table")
 
         self.tables = tables
-        self.columns: List[Dict[str, Any]] = []
+        self.columns: List[Dict[str, Any]] = []  # сразу в виде для DDL payload
+        self._pk_flags: List[bool] = []  # параллельно self.columns
         self.fks: List[Dict[str, Any]] = []
         self.uniques: List[List[str]] = []
+        self._rendered_cols: List[str] = []  # что уже показано в cols_list/unique_cols/fk_col
+        # индексы по self.columns (обновляются только в _register_column)
+        self._col_by_name: Dict[str, Dict[str, Any]] = {}
+        self._file_col_names: set[str] = set()
+        self._refresh_pending = False
 
         self.table_name = QLineEdit()
         self.table_name.setPlaceholderText("new_table_name")
@@ -190,40 +208,66 @@ class TableWizard(QDialog):
             self.col_type.setEnabled(True)
             self.col_is_pk.setEnabled(True)
 
-    def _refresh_lists(self):
-        self.cols_list.clear()
-        self.pk_list.clear()
-        self.unique_cols.clear()
-        self.fk_col.clear()
-
-        pk_cols = [c["name"] for c in self.columns if c.get("_is_pk")]
-
-        for c in self.columns:
-            extra = []
-            if not c["nullable"]:
-                extra.append("NOT NULL")
-            if c.get("unique"):
-                extra.append("UNIQUE")
-            if c["type"] == "varchar":
-                extra.append(f'len={c["length"]}')
-            if c.get("_is_pk"):
-                extra.append("PK")
-            if c.get("file"):
-                extra.append(f'FILE[{c["file"]["storage_mode"]}]')
-                if c["file"].get("required"):
-                    extra.append("REQUIRED")
-
-            self.cols_list.addItem(f'{c["name"]}: {c["type"]}' + ((" " + " ".join(extra)) if extra else ""))
-
-            # для UNIQUE выбора
-            self.unique_cols.addItem(c["name"])
-
-            # для FK выбора
-            self.fk_col.addItem(c["name"])
-
-        # PK display
-        for pkc in pk_cols:
-            self.pk_list.addItem(pkc)
+    @staticmethod
+    def _column_label(c: Dict[str, Any], is_pk: bool) -> str:
+        extra = []
+        if not c["nullable"]:
+            extra.append("NOT NULL")
+        if c.get("unique"):
+            extra.append("UNIQUE")
+        if c["type"] == "varchar":
+            extra.append(f'len={c["length"]}')
+        if is_pk:
+            extra.append("PK")
+        if c.get("file"):
+            extra.append(f'FILE[{c["file"]["storage_mode"]}]')
+            if c["file"].get("required"):
+                extra.append("REQUIRED")
+
+        return f'{c["name"]}: {c["type"]}' + ((" " + " ".join(extra)) if extra else "")
+
+    def _schedule_refresh(self):
+        # несколько _add_column подряд (импорт схемы) -> одна перерисовка
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            QTimer.singleShot(0, self._do_refresh)
+
+    def _do_refresh(self):
+        self._refresh_pending = False
+        # колонки обычно только дописываются — рисуем лишь новые;
+        # полная перестройка, только если уже показанный префикс изменился
+        names = [c["name"] for c in self.columns]
+        start = len(self._rendered_cols)
+        if names[:start] != self._rendered_cols:
+            self.cols_list.clear()
+            self.pk_list.clear()
+            self.unique_cols.clear()
+            self.fk_col.clear()
+            start = 0
+
+        if start == len(self.columns):
+            return
+
+        self.cols_list.setUpdatesEnabled(False)
+        self.fk_col.blockSignals(True)
+        try:
+            for c, is_pk in zip(self.columns[start:], self._pk_flags[start:]):
+                self.cols_list.addItem(self._column_label(c, is_pk))
+
+                # для UNIQUE выбора
+                self.unique_cols.addItem(c["name"])
+
+                # для FK выбора
+                self.fk_col.addItem(c["name"])
+
+                # PK display
+                if is_pk:
+                    self.pk_list.addItem(c["name"])
+        finally:
+            self.fk_col.blockSignals(False)
+            self.cols_list.setUpdatesEnabled(True)
+
+        self._rendered_cols = names
 
         # не оставлять авто-выделения
         self.unique_cols.clearSelection()
@@ -236,11 +280,11 @@ class TableWizard(QDialog):
             return
 
         # простая проверка идентификатора
-        if not name.replace("_", "").isalnum():
+        if not _is_valid_ident(name):
             QMessageBox.warning(self, "Column", "Bad column name (use letters/digits/underscore)")
             return
 
-        if any(x["name"] == name for x in self.columns):
+        if name in self._col_by_name:
             QMessageBox.warning(self, "Column", "Column name must be unique")
             return
 
@@ -279,16 +323,22 @@ class TableWizard(QDialog):
             # (если хочешь жёстко запретить — скажи)
 
         if is_pk:
-            col["_is_pk"] = True
             col["nullable"] = False  # PK должен быть NOT NULL
 
-        self.columns.append(col)
+        self._register_column(col, is_pk)
 
         # reset UI inputs
         self.col_name.clear()
         self.col_is_pk.setChecked(False)
 
-        self._refresh_lists()
+        self._schedule_refresh()
+
+    def _register_column(self, col: Dict[str, Any], is_pk: bool):
+        self.columns.append(col)
+        self._pk_flags.append(is_pk)
+        self._col_by_name[col["name"]] = col
+        if col.get("file"):
+            self._file_col_names.add(col["name"])
 
     def _add_fk(self):
         col = self.fk_col.currentText()
@@ -299,7 +349,7 @@ class TableWizard(QDialog):
         # Нельзя добавлять FK для file-column вручную
         # (она логически должна ссылаться на files(id), но это лучше делать как обычный FK на files)
         # Если очень надо — можно разрешить, но по UX лучше запретить.
-        src_col = next((c for c in self.columns if c["name"] == col), None)
+        src_col = self._col_by_name.get(col)
         if src_col and src_col.get("file"):
             QMessageBox.warning(self, "FK", "Do not add FK for file-column manually (it should point to files.id)")
             return
@@ -324,8 +374,7 @@ class TableWizard(QDialog):
             return
 
         # запрещаем UNIQUE-constraint, если в нём есть file-column (чтобы не ломать модель)
-        file_cols = {c["name"] for c in self.columns if c.get("file")}
-        if any(c in file_cols for c in selected):
+        if not self._file_col_names.isdisjoint(selected):
             QMessageBox.warning(self, "UNIQUE", "Do not add UNIQUE constraint on file columns")
             return
 
@@ -339,7 +388,7 @@ class TableWizard(QDialog):
             QMessageBox.warning(self, "Create", "Table name required")
             return
 
-        if not tname.replace("_", "").isalnum():
+        if not _is_valid_ident(tname):
             QMessageBox.warning(self, "Create", "Bad table name (use letters/digits/underscore)")
             return
 
@@ -348,7 +397,7 @@ class TableWizard(QDialog):
             return
 
         # PK only from checkbox per-column
-        pk = [c["name"] for c in self.columns if c.get("_is_pk")]
+        pk = [c["name"] for c, is_pk in zip(self.columns, self._pk_flags) if is_pk]
         if not pk:
             QMessageBox.warning(self, "Create", "At least one primary key column required (use checkbox)")
             return
@@ -358,16 +407,10 @@ class TableWizard(QDialog):
 
     def payload(self) -> Dict[str, Any]:
         pk = getattr(self, "_pk", [])
-        # очистим внутренний флаг _is_pk, чтобы не мешал серверу (он не нужен DDL)
-        cols = []
-        for c in self.columns:
-            c2 = dict(c)
-            c2.pop("_is_pk", None)
-            cols.append(c2)
-
+        # self.columns уже в виде для DDL (PK-флаги лежат отдельно) — без копий
         return {
             "table": self.table_name.text().strip(),
-            "columns": cols,
+            "columns": self.columns,
             "primary_key": pk,
             "uniques": self.uniques,
             "foreign_keys": self.fks,
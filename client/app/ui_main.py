@@ -2,17 +2,21 @@
 from __future__ import annotations
 
 import os
+import shutil
 import tempfile
-from typing import Any, Dict, Optional, List
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, List, Set, Tuple
 
-from PySide6.QtCore import Qt, QUrl
+from PySide6.QtCore import Qt, QUrl, QThreadPool, QTimer, QAbstractTableModel, QModelIndex
 from PySide6.QtGui import QDesktopServices
 from PySide6.QtWidgets import (
     QMainWindow,
     QWidget,
     QListWidget,
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
+    QAbstractItemView,
+    QHeaderView,
     QVBoxLayout,
     QHBoxLayout,
     QPushButton,
@@ -24,14 +28,137 @@ from PySide6.QtWidgets import (
     QDialogButtonBox,
     QComboBox,
     QFileDialog,
+    QProgressDialog,
 )
 
+from app.async_call import AsyncCall, FileOpWorker
 from app.socket_client import SocketClient
+from app.secure_protocol import STREAM_CHUNK
+from app.crypto_ctx import init_crypto
 from app.table_wizard import TableWizard
 from app.login_dialog import LoginDialog
 from app.user_create_dialog import UserCreateDialog
 from app.backups_dialog import BackupsDialog
 
+# fk_options справочников меняются редко — держим в кэше MainWindow
+FK_CACHE_TTL = 60.0
+SEARCH_DEBOUNCE_MS = 350
+# ширину колонок считаем только по первым строкам, а не по всей выборке
+RESIZE_SAMPLE_ROWS = 50
+# select/search грузятся страницами по мере прокрутки
+PAGE_SIZE = 80
+# DBUI_NATIVE_DIALOG=0 — диалог Qt вместо системного (медленный портал на части KDE)
+NATIVE_FILE_DIALOG = os.getenv("DBUI_NATIVE_DIALOG", "1") != "0"
+
+
+def pick_file(parent: QWidget, caption: str) -> str:
+    """
+    Выбор одного существующего файла. Без кастомных иконок и резолва симлинков:
+    иначе на сетевых дисках Qt делает stat каждой записи каталога.
+    """
+    dlg = QFileDialog(parent, caption)
+    # опции — до показа диалога
+    opts = QFileDialog.DontUseCustomDirectoryIcons | QFileDialog.DontResolveSymlinks
+    if not NATIVE_FILE_DIALOG:
+        opts |= QFileDialog.DontUseNativeDialog
+    dlg.setOptions(opts)
+    dlg.setFileMode(QFileDialog.ExistingFile)
+    if dlg.exec() != QDialog.Accepted:
+        return ""
+    files = dlg.selectedFiles()
+    return files[0] if files else ""
+
+
+def index_meta(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Производные карты table_meta (тип колонки, FK по колонке, скрытые файловые
+    колонки) — считаются один раз на meta, а не на каждый RowDialog/values().
+    """
+    if "_type_map" in meta:
+        return meta
+    meta["_fk_map"] = {fk["column"]: fk for fk in meta.get("foreign_keys", [])}
+    # inline file physical columns to hide: <base>_name and <base>_data
+    meta["_file_cols_hidden"] = {
+        col
+        for fc in meta.get("file_columns", []) or []
+        for col in (fc.get("name_column"), fc.get("data_column"))
+        if col
+    }
+    # _type_map последним: по нему проверяем, что meta уже разобрана
+    meta["_type_map"] = {c["name"]: (c.get("type") or "").lower() for c in meta.get("columns", [])}
+    return meta
+
+
+class RowsModel(QAbstractTableModel):
+    """
+    Read-only модель результата select/search: строки хранятся как есть,
+    текст ячейки строится только для видимых (QTableView спрашивает сам).
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._cols: List[str] = []
+        self._col_index: Dict[str, int] = {}
+        self._rows: List[List[Any]] = []
+
+    def reset(self, columns: List[str], rows: List[List[Any]]):
+        self.beginResetModel()
+        self._cols = list(columns)
+        # имя -> номер колонки, один раз на выборку (не list.index на каждый клик)
+        self._col_index = {c: i for i, c in enumerate(self._cols)}
+        self._rows = rows
+        self.endResetModel()
+
+    def append_rows(self, rows: List[List[Any]]):
+        if not rows:
+            return
+        start = len(self._rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+
+    @property
+    def columns(self) -> List[str]:
+        return self._cols
+
+    def column_index(self, name: str) -> Optional[int]:
+        return self._col_index.get(name)
+
+    def value(self, row: int, col: int) -> Any:
+        # значение как пришло с сервера (int/str/None), без строкового round-trip
+        return self._rows[row][col]
+
+    def row_dict(self, row: int) -> Dict[str, Any]:
+        return dict(zip(self._cols, self._rows[row]))
+
+    def cell_text(self, row: int, col: int) -> str:
+        v = self._rows[row][col]
+        return "" if v is None else str(v)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._cols)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.cell_text(index.row(), index.column())
+        return None
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self._cols[section] if section < len(self._cols) else None
+        return str(section + 1)
+
+    _CELL_FLAGS = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def flags(self, index: QModelIndex):
+        # ячейки не редактируются (правка — через RowDialog); флаги одни на всю модель
+        return self._CELL_FLAGS if index.isValid() else Qt.NoItemFlags
+
 
 class RowDialog(QDialog):
     """
@@ -44,16 +171,16 @@ class RowDialog(QDialog):
 
     def __init__(
         self,
-        client: SocketClient,
+        fk_options: Callable[[str], List[Dict[str, Any]]],
         table: str,
         meta: Dict[str, Any],
         initial: Optional[Dict[str, Any]] = None,
         parent=None,
     ):
         super().__init__(parent)
-        self.client = client
+        self.fk_options = fk_options
         self.table = table
-        self.meta = meta
+        self.meta = index_meta(meta)
         self.initial = initial or {}
         self.widgets: Dict[str, QWidget] = {}
 
@@ -63,15 +190,8 @@ class RowDialog(QDialog):
         self.setWindowTitle(f"{'Edit' if initial else 'Add'}: {table}")
 
         form = QFormLayout()
-        fk_map = {fk["column"]: fk for fk in meta.get("foreign_keys", [])}
-
-        # inline file physical columns to hide: <base>_name and <base>_data
-        file_cols = set()
-        for fc in meta.get("file_columns", []) or []:
-            if fc.get("name_column"):
-                file_cols.add(fc["name_column"])
-            if fc.get("data_column"):
-                file_cols.add(fc["data_column"])
+        fk_map = meta["_fk_map"]
+        file_cols = meta["_file_cols_hidden"]
 
         for col in meta.get("columns", []):
             name = col["name"]
@@ -87,10 +207,7 @@ class RowDialog(QDialog):
             if name in fk_map:
                 fk = fk_map[name]
                 combo = QComboBox()
-                resp = self.client.fk_options(fk["ref_table"])
-                if not resp.get("ok"):
-                    raise RuntimeError(resp.get("error", "fk_options error"))
-                items = resp["data"]["items"]
+                items = self.fk_options(fk["ref_table"])
                 combo.addItem("—", None)
                 for it in items:
                     combo.addItem(f'{it["id"]} — {it["label"]}', it["id"])
@@ -149,7 +266,7 @@ class RowDialog(QDialog):
 
             def make_pick(b: str, label: QLabel):
                 def _pick():
-                    path, _ = QFileDialog.getOpenFileName(self, f"Select file for {b}")
+                    path = pick_file(self, f"Select file for {b}")
                     if not path:
                         return
                     self.file_paths_by_base[b] = path
@@ -174,7 +291,7 @@ class RowDialog(QDialog):
         self.setLayout(layout)
 
     def values(self) -> Dict[str, Any]:
-        type_map = {c["name"]: (c.get("type") or "").lower() for c in self.meta.get("columns", [])}
+        type_map = self.meta["_type_map"]
 
         def parse_value(col: str, raw: Optional[str]) -> Any:
             if raw is None:
@@ -232,9 +349,16 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("DB UI (Sockets)")
 
         self.client = SocketClient("127.0.0.1", 9090, timeout=120.0)
+        # скачанные для просмотра файлы — в одном каталоге на сессию, удаляется при закрытии
+        self._tmp_dir = tempfile.mkdtemp(prefix="dbui_")
 
         self.tables = QListWidget()
-        self.table = QTableWidget()
+        self.rows_model = RowsModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.rows_model)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        # редакторов нет — view не пытается их открывать по двойному клику/клавише
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
 
         self.search_edit = QLineEdit()
         self.search_edit.setPlaceholderText("Search… (по текстовым полям)")
@@ -258,6 +382,13 @@ class MainWindow(QMainWindow):
 
         self.current_table: Optional[str] = None
         self.current_meta: Optional[Dict[str, Any]] = None
+        # ref_table -> (время загрузки, items)
+        self._fk_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        # table -> meta; заполняется фоновым prefetch после load_tables
+        self._meta_cache: Dict[str, Dict[str, Any]] = {}
+        # результаты prefetch, начатого до нового load_tables / сброса fk, устарели
+        self._prefetch_gen = 0
+        self._fk_gen = 0
 
         left = QVBoxLayout()
         left.addWidget(QLabel("Tables"))
@@ -298,6 +429,21 @@ class MainWindow(QMainWindow):
         self.tables.currentTextChanged.connect(self.on_table_selected)
         self.refresh_btn.clicked.connect(self.refresh)
         self.search_btn.clicked.connect(self.search)
+
+        # search-as-you-type: запрос уходит через SEARCH_DEBOUNCE_MS после последней правки
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.timeout.connect(self.search)
+        self.search_edit.textChanged.connect(lambda _: self._search_timer.start(SEARCH_DEBOUNCE_MS))
+        # ответы устаревших поисков (пользователь уже печатает дальше) отбрасываем
+        self._search_gen = 0
+
+        # текущая выборка для подгрузки страниц: (table, query или None для select)
+        self._listing: Optional[Tuple[str, Optional[str]]] = None
+        self._offset = 0
+        self._exhausted = True
+        self._loading = False
+        self.table.verticalScrollBar().valueChanged.connect(self._on_scroll)
         self.reset_btn.clicked.connect(self.refresh)
 
         self.add_btn.clicked.connect(self.add_row)
@@ -313,12 +459,19 @@ class MainWindow(QMainWindow):
         self.create_user_btn.clicked.connect(self.create_user)
         self.backups_btn.clicked.connect(self.open_backups)
 
+        # RSA ключи грузим/генерируем в фоне, пока пользователь вводит логин
+        QThreadPool.globalInstance().start(init_crypto)
+
         dlg = LoginDialog(self.client, parent=self)
         if dlg.exec() != QDialog.Accepted:
             raise SystemExit(0)
 
         self.load_tables()
 
+    def closeEvent(self, e):
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        super().closeEvent(e)
+
     def show_err(self, title: str, msg: str):
         QMessageBox.critical(self, title, msg)
 
@@ -326,64 +479,213 @@ class MainWindow(QMainWindow):
         dlg = BackupsDialog(self.client, parent=self)
         dlg.exec()
 
+    def _fk_options(self, ref_table: str) -> List[Dict[str, Any]]:
+        hit = self._fk_cache.get(ref_table)
+        if hit is not None and time.monotonic() - hit[0] < FK_CACHE_TTL:
+            return hit[1]
+
+        resp = self.client.fk_options(ref_table)
+        if not resp.ok:
+            raise RuntimeError(resp.error or "fk_options error")
+        items = resp.data["items"]
+        self._fk_cache[ref_table] = (time.monotonic(), items)
+        return items
+
+    def _invalidate_fk(self, table: Optional[str]):
+        # строки table изменились — её fk_options (как справочника) устарели
+        if table:
+            self._fk_cache.pop(table, None)
+            self._fk_gen += 1
+
     def load_tables(self):
         resp = self.client.list_tables()
-        if not resp.get("ok"):
-            self.show_err("Error", resp.get("error", "list_tables failed"))
+        if not resp.ok:
+            self.show_err("Error", resp.error or "list_tables failed")
             return
         self.tables.clear()
-        for t in resp["tables"]:
+        for t in resp.tables:
             self.tables.addItem(t)
 
+        # meta + fk_options всех таблиц тянем заранее в фоне,
+        # чтобы переключение таблиц и открытие RowDialog не ждали сеть
+        self._meta_cache.clear()
+        self._prefetch_gen += 1
+        gen, fk_gen = self._prefetch_gen, self._fk_gen
+        now = time.monotonic()
+        fresh_fk = {t for t, (ts, _) in self._fk_cache.items() if now - ts < FK_CACHE_TTL}
+        AsyncCall(self._prefetch, list(resp.tables), fresh_fk).on_done(
+            lambda res: self._on_prefetched(gen, fk_gen, res)
+        ).start()
+
+    def _prefetch(
+        self, tables: List[str], fresh_fk: Set[str]
+    ) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+        # выполняется в пуле потоков: только сеть, кэши обновляет _on_prefetched в GUI-потоке
+        if not tables:
+            return {}, {}
+        # meta всех таблиц — одним запросом, а не table_meta на каждую
+        resp = self.client.tables_meta(tables)
+        if not resp.ok:
+            return {}, {}
+        metas = {t: index_meta(meta) for t, meta in resp.meta.items()}
+        fk_items: Dict[str, List[Dict[str, Any]]] = {}
+        for meta in resp.meta.values():
+            for fk in meta.get("foreign_keys", []):
+                ref = fk["ref_table"]
+                if ref in fresh_fk or ref in fk_items:
+                    continue
+                try:
+                    r = self.client.fk_options(ref)
+                except Exception:
+                    continue
+                if r.ok:
+                    fk_items[ref] = r.data["items"]
+        return metas, fk_items
+
+    def _on_prefetched(self, gen: int, fk_gen: int, res: Tuple[Dict[str, Any], Dict[str, Any]]):
+        if gen != self._prefetch_gen:
+            return
+        metas, fk_items = res
+        for t, meta in metas.items():
+            # уже загруженное синхронно (on_table_selected) не перетираем
+            self._meta_cache.setdefault(t, meta)
+        if fk_gen != self._fk_gen:
+            return
+        now = time.monotonic()
+        for ref, items in fk_items.items():
+            if ref not in self._fk_cache:
+                self._fk_cache[ref] = (now, items)
+
     def on_table_selected(self, table_name: str):
         if not table_name:
             return
         self.current_table = table_name
-        meta_resp = self.client.table_meta(table_name)
-        if not meta_resp.get("ok"):
-            self.show_err("Error", meta_resp.get("error", "table_meta failed"))
-            return
-        self.current_meta = meta_resp["meta"]
+        meta = self._meta_cache.get(table_name)
+        if meta is None:
+            meta_resp = self.client.table_meta(table_name)
+            if not meta_resp.ok:
+                self.show_err("Error", meta_resp.error or "table_meta failed")
+                return
+            meta = self._meta_cache[table_name] = index_meta(meta_resp.meta)
+        self.current_meta = meta
         self.refresh()
 
     def refresh(self):
         if not self.current_table:
             return
-        resp = self.client.select(self.current_table, limit=200, offset=0)
-        if not resp.get("ok"):
-            self.show_err("Error", resp.get("error", "select failed"))
+        self._search_gen += 1
+        table = self.current_table
+        resp = self.client.select(table, limit=PAGE_SIZE, offset=0)
+        if not resp.ok:
+            self.show_err("Error", resp.error or "select failed")
             return
-        self.fill_table(resp["data"]["columns"], resp["data"]["rows"])
+        self._start_listing(table, None, resp.data)
 
     def search(self):
+        self._search_timer.stop()
         if not self.current_table:
             return
         q = self.search_edit.text().strip()
         if not q:
             self.refresh()
             return
-        resp = self.client.search(self.current_table, q, limit=200, offset=0)
-        if not resp.get("ok"):
-            self.show_err("Error", resp.get("error", "search failed"))
-            return
-        self.fill_table(resp["data"]["columns"], resp["data"]["rows"])
-
-    def fill_table(self, columns, rows):
-        self.table.clear()
-        self.table.setColumnCount(len(columns))
-        self.table.setRowCount(len(rows))
-        self.table.setHorizontalHeaderLabels(columns)
 
-        for r_i, row in enumerate(rows):
-            for c_i, val in enumerate(row):
-                item = QTableWidgetItem("" if val is None else str(val))
-                item.setFlags(item.flags() ^ Qt.ItemIsEditable)
-                self.table.setItem(r_i, c_i, item)
+        self._search_gen += 1
+        gen = self._search_gen
+        table = self.current_table
+        AsyncCall(self.client.search, table, q, None, PAGE_SIZE, 0).on_done(
+            lambda resp: self._on_search(gen, table, q, resp),
+            lambda err: self._on_search_error(gen, err),
+        ).start()
 
-        self.table.resizeColumnsToContents()
+    def _on_search(self, gen: int, table: str, q: str, resp):
+        if gen != self._search_gen:
+            return
+        if not resp.ok:
+            self.show_err("Error", resp.error or "search failed")
+            return
+        self._start_listing(table, q, resp.data)
+
+    def _on_search_error(self, gen: int, err: str):
+        if gen == self._search_gen:
+            self.show_err("Error", err)
+
+    # ===== paging =====
+
+    def _start_listing(self, table: str, q: Optional[str], data: Dict[str, Any]):
+        rows = data["rows"]
+        self._listing = (table, q)
+        self._offset = len(rows)
+        self._exhausted = len(rows) < PAGE_SIZE
+        self._loading = False
+        self.fill_table(data["columns"], rows)
+        self._maybe_load_more()
+
+    def _on_scroll(self, value: int):
+        sb = self.table.verticalScrollBar()
+        if value >= sb.maximum() - PAGE_SIZE // 2:
+            self._load_more()
+
+    def _maybe_load_more(self):
+        # первая страница не заполнила окно — скролла нет, догружаем сами
+        if self.table.verticalScrollBar().maximum() == 0:
+            self._load_more()
+
+    def _load_more(self):
+        if self._loading or self._exhausted or not self._listing:
+            return
+        self._loading = True
+        gen = self._search_gen
+        table, q = self._listing
+        if q is None:
+            call = AsyncCall(self.client.select, table, PAGE_SIZE, self._offset)
+        else:
+            call = AsyncCall(self.client.search, table, q, None, PAGE_SIZE, self._offset)
+        call.on_done(
+            lambda resp: self._on_page(gen, resp),
+            lambda err: self._on_page_error(gen, err),
+        ).start()
+
+    def _on_page(self, gen: int, resp):
+        if gen != self._search_gen:
+            return
+        self._loading = False
+        if not resp.ok:
+            self._exhausted = True
+            self.show_err("Error", resp.error or "load failed")
+            return
+        rows = resp.data["rows"]
+        self._offset += len(rows)
+        self._exhausted = len(rows) < PAGE_SIZE
+        self.rows_model.append_rows(rows)
+        self._maybe_load_more()
+
+    def _on_page_error(self, gen: int, err: str):
+        if gen != self._search_gen:
+            return
+        self._loading = False
+        self._exhausted = True
+        self.show_err("Error", err)
 
-    def _get_headers(self) -> list[str]:
-        return [self.table.horizontalHeaderItem(i).text() for i in range(self.table.columnCount())]
+    def fill_table(self, columns, rows):
+        self.rows_model.reset(columns, rows)
+        self._resize_columns()
+
+    def _resize_columns(self):
+        # resizeColumnsToContents() обошёл бы все строки; меряем только первые
+        m = self.rows_model
+        fm = self.table.fontMetrics()
+        sample = min(m.rowCount(), RESIZE_SAMPLE_ROWS)
+        header = self.table.horizontalHeader()
+        for c, name in enumerate(m.columns):
+            w = fm.horizontalAdvance(name)
+            for r in range(sample):
+                w = max(w, fm.horizontalAdvance(m.cell_text(r, c)))
+            header.resizeSection(c, min(w + 16, 400))
+
+    def _current_row(self) -> int:
+        idx = self.table.currentIndex()
+        return idx.row() if idx.isValid() else -1
 
     def _get_selected_pk(self) -> Optional[Dict[str, Any]]:
         if not self.current_meta:
@@ -392,30 +694,26 @@ class MainWindow(QMainWindow):
         if not pk_cols:
             return None
 
-        row = self.table.currentRow()
+        row = self._current_row()
         if row < 0:
             return None
 
-        headers = self._get_headers()
         pk: Dict[str, Any] = {}
         for pkc in pk_cols:
-            if pkc not in headers:
+            idx = self.rows_model.column_index(pkc)
+            if idx is None:
                 return None
-            idx = headers.index(pkc)
-            pk_val = self.table.item(row, idx).text()
-            pk[pkc] = int(pk_val) if pk_val.isdigit() else pk_val
+            pk[pkc] = self.rows_model.value(row, idx)
         return pk
 
     def _row_has_file(self, fc: Dict[str, Any]) -> bool:
-        row = self.table.currentRow()
+        row = self._current_row()
         if row < 0:
             return False
-        headers = self._get_headers()
-        data_col = fc.get("data_column")
-        if not data_col or data_col not in headers:
+        idx = self.rows_model.column_index(fc.get("data_column") or "")
+        if idx is None:
             return False
-        idx = headers.index(data_col)
-        txt = self.table.item(row, idx).text().strip()
+        txt = self.rows_model.cell_text(row, idx).strip()
         return bool(txt)
 
     def _current_file_columns(self) -> list[Dict[str, Any]]:
@@ -452,7 +750,7 @@ class MainWindow(QMainWindow):
         if not (self.current_table and self.current_meta):
             return
 
-        dlg = RowDialog(self.client, self.current_table, self.current_meta, initial=None, parent=self)
+        dlg = RowDialog(self._fk_options, self.current_table, self.current_meta, initial=None, parent=self)
         if dlg.exec() != QDialog.Accepted:
             return
 
@@ -473,10 +771,11 @@ class MainWindow(QMainWindow):
         else:
             resp = self.client.insert(self.current_table, values)
 
-        if not resp.get("ok"):
-            self.show_err("Insert error", resp.get("error", "insert failed"))
+        if not resp.ok:
+            self.show_err("Insert error", resp.error or "insert failed")
             return
 
+        self._invalidate_fk(self.current_table)
         self.refresh()
 
     def edit_row(self):
@@ -488,13 +787,10 @@ class MainWindow(QMainWindow):
             return
 
         # we don't allow editing file columns in RowDialog as text (use file pickers/buttons)
-        initial = {}
-        headers = self._get_headers()
-        row = self.table.currentRow()
-        for i, h in enumerate(headers):
-            initial[h] = self.table.item(row, i).text()
+        # типизированная строка из ответа сервера, а не текст ячеек
+        initial = self.rows_model.row_dict(self._current_row())
 
-        dlg = RowDialog(self.client, self.current_table, self.current_meta, initial=initial, parent=self)
+        dlg = RowDialog(self._fk_options, self.current_table, self.current_meta, initial=initial, parent=self)
         if dlg.exec() != QDialog.Accepted:
             return
 
@@ -506,20 +802,16 @@ class MainWindow(QMainWindow):
             self.show_err("Edit", "Nothing to update.")
             return
 
-        # 1) Обновляем обычные поля ТОЛЬКО если они есть
-        if values:
+        # поля и выбранные файлы уходят одним запросом — без частично применённой правки
+        if chosen:
+            resp = self.client.update_with_files(self.current_table, pk, values, chosen)
+        else:
             resp = self.client.update(self.current_table, pk, values)
-            if not resp.get("ok"):
-                self.show_err("Update error", resp.get("error", "update failed"))
-                return
-
-        # 2) Заменяем файлы (если выбраны)
-        for f in chosen:
-            fr = self.client.file_attach(self.current_table, pk, f["base"], f["path"], mime_type=None)
-            if not fr.get("ok"):
-                self.show_err("Replace file error", fr.get("error", "file_attach failed"))
-                self.refresh()
-                return
+        if not resp.ok:
+            self.show_err("Update error", resp.error or "update failed")
+            return
+        if values:
+            self._invalidate_fk(self.current_table)
 
         self.refresh()
 
@@ -534,28 +826,29 @@ class MainWindow(QMainWindow):
         if QMessageBox.question(self, "Delete", f"Delete row {pk}?") != QMessageBox.Yes:
             return
         resp = self.client.delete(self.current_table, pk)
-        if not resp.get("ok"):
-            self.show_err("Delete error", resp.get("error", "delete failed"))
+        if not resp.ok:
+            self.show_err("Delete error", resp.error or "delete failed")
             return
+        self._invalidate_fk(self.current_table)
         self.refresh()
 
     def create_table(self):
         resp = self.client.list_tables()
-        if not resp.get("ok"):
-            self.show_err("Error", resp.get("error", "list_tables failed"))
+        if not resp.ok:
+            self.show_err("Error", resp.error or "list_tables failed")
             return
 
-        wiz = TableWizard(resp["tables"], parent=self)
+        wiz = TableWizard(resp.tables, parent=self)
         if wiz.exec() != QDialog.Accepted:
             return
 
         payload = wiz.payload()
         cr = self.client.create_table(payload)
-        if not cr.get("ok"):
-            self.show_err("Create table error", cr.get("error", "create_table failed"))
+        if not cr.ok:
+            self.show_err("Create table error", cr.error or "create_table failed")
             return
 
-        QMessageBox.information(self, "Created", "Table created!\n\nSQL:\n" + cr["data"]["sql"])
+        QMessageBox.information(self, "Created", "Table created!\n\nSQL:\n" + cr.data["sql"])
         self.load_tables()
 
     # ===== Files actions (existing rows) =====
@@ -574,18 +867,72 @@ class MainWindow(QMainWindow):
             self.show_err("File", "This table has no file column configured.")
             return
 
-        path, _ = QFileDialog.getOpenFileName(self, "Select file")
+        path = pick_file(self, "Select file")
         if not path:
             return
 
-        resp = self.client.file_attach(self.current_table, pk, fc["base"], path, mime_type=None)
-        if not resp.get("ok"):
-            self.show_err("Upload", resp.get("error", "upload failed"))
+        self._run_file_op(
+            "Upload",
+            f"Uploading {os.path.basename(path)}…",
+            lambda resp: self._on_attached("Upload", "Attached", resp),
+            self.client.file_attach,
+            self.current_table, pk, fc["base"], path, None,
+        )
+
+    def _on_attached(self, title: str, done_text: str, resp):
+        if not resp.ok:
+            self.show_err(title, resp.error or "upload failed")
             return
 
-        QMessageBox.information(self, "Upload", "Attached")
+        QMessageBox.information(self, title, done_text)
         self.refresh()
 
+    def _run_file_op(self, title: str, label: str, on_done: Callable[[Any], None], fn: Callable[..., Any], *args: Any):
+        """
+        Передача файла в QThreadPool; окно не замирает, прогресс — в QProgressDialog.
+        fn должна принимать progress=callback(done, total).
+        """
+        dlg = QProgressDialog(label, None, 0, 0, self)
+        dlg.setWindowTitle(title)
+        dlg.setWindowModality(Qt.WindowModal)
+        dlg.setMinimumDuration(300)
+        dlg.setAutoReset(False)
+
+        def on_progress(done: int, total: int):
+            # QProgressDialog считает в int — показываем КиБ
+            dlg.setMaximum(max(1, total >> 10))
+            dlg.setValue(done >> 10)
+
+        def finish(res: Any):
+            dlg.close()
+            on_done(res)
+
+        def fail(err: str):
+            dlg.close()
+            self.show_err(title, err)
+
+        FileOpWorker(fn, *args).on_progress(on_progress).on_done(finish, fail).start()
+
+    def _download_to_temp(self, table: str, pk: Dict[str, Any], fc: Dict[str, Any], progress: Callable[[int, int], None]) -> str:
+        stream = self.client.file_get_stream(table, pk, fc["base"])
+        try:
+            meta = next(stream)
+            name = meta.get("original_name") or f'{fc.get("base")}.bin'
+            # префикс — чтобы одноимённые файлы разных строк не перетирали друг друга
+            out_path = os.path.join(self._tmp_dir, f"{uuid.uuid4().hex[:8]}_{os.path.basename(name)}")
+            total = meta["size"]
+            done = 0
+            # в памяти держим один кадр, а не весь файл
+            with open(out_path, "wb", buffering=STREAM_CHUNK) as f:
+                for chunk in stream:
+                    f.write(chunk)
+                    done += len(chunk)
+                    progress(done, total)
+        finally:
+            # отпускаем сессию сразу, не дожидаясь сборщика
+            stream.close()
+        return out_path
+
     def open_file(self):
         if not (self.current_table and self.current_meta):
             return
@@ -604,19 +951,13 @@ class MainWindow(QMainWindow):
             self.show_err("File", "No file in this row.")
             return
 
-        try:
-            meta, data = self.client.file_get(self.current_table, pk, fc["base"])
-        except Exception as e:
-            self.show_err("Open", str(e))
-            return
-
-        name = meta.get("original_name") or f'{fc.get("base")}.bin'
-        tmp_dir = tempfile.mkdtemp(prefix="dbui_")
-        out_path = os.path.join(tmp_dir, name)
-        with open(out_path, "wb") as f:
-            f.write(data)
-
-        QDesktopServices.openUrl(QUrl.fromLocalFile(out_path))
+        self._run_file_op(
+            "Open",
+            "Downloading…",
+            lambda out_path: QDesktopServices.openUrl(QUrl.fromLocalFile(out_path)),
+            self._download_to_temp,
+            self.current_table, pk, fc,
+        )
 
     def delete_file(self):
         if not (self.current_table and self.current_meta):
@@ -644,8 +985,8 @@ class MainWindow(QMainWindow):
             return
 
         dr = self.client.file_delete(self.current_table, pk, fc["base"])
-        if not dr.get("ok"):
-            self.show_err("File", dr.get("error", "file_delete failed"))
+        if not dr.ok:
+            self.show_err("File", dr.error or "file_delete failed")
             return
 
         QMessageBox.information(self, "Delete file", "Deleted")
@@ -665,7 +1006,7 @@ class MainWindow(QMainWindow):
             self.show_err("File", "This table has no file column configured.")
             return
 
-        path, _ = QFileDialog.getOpenFileName(self, "Select new file")
+        path = pick_file(self, "Select new file")
         if not path:
             return
 
@@ -673,13 +1014,13 @@ class MainWindow(QMainWindow):
             if QMessageBox.question(self, "Replace", f"Replace file '{fc['base']}' in this row?") != QMessageBox.Yes:
                 return
 
-        resp = self.client.file_attach(self.current_table, pk, fc["base"], path, mime_type=None)
-        if not resp.get("ok"):
-            self.show_err("Replace", resp.get("error", "upload failed"))
-            return
-
-        QMessageBox.information(self, "Replace", "Replaced")
-        self.refresh()
+        self._run_file_op(
+            "Replace",
+            f"Uploading {os.path.basename(path)}…",
+            lambda resp: self._on_attached("Replace", "Replaced", resp),
+            self.client.file_attach,
+            self.current_table, pk, fc["base"], path, None,
+        )
 
     # ===== admin =====
     def create_user(self):
@@ -41,8 +41,8 @@ class UserCreateDialog(QDialog):
         role = self.role.currentText()
 
         resp = self.client.user_create(login, password, full_name, role)
-        if not resp.get("ok"):
-            QMessageBox.critical(self, "Error", resp.get("error", "user_create failed"))
+        if not resp.ok:
+            QMessageBox.critical(self, "Error", resp.error or "user_create failed")
             return
 
         QMessageBox.information(
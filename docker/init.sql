@@ -71,10 +71,26 @@ CREATE TABLE IF NOT EXISTS orders (
 
 CREATE INDEX IF NOT EXISTS idx_orders_customer_id ON orders(customer_id);
 
--- Метаданные file-column храним в COMMENT (не в отдельной таблице)
+-- Метаданные file-column храним в COMMENT; app_file_columns — их разобранная копия
 COMMENT ON COLUMN public.orders.document_data IS
   '{"file":true,"base":"document","name_col":"document_name","mode":"fs","required":true}';
 
+-- === File columns (разобранные COMMENT, читает table_meta) ===
+CREATE TABLE IF NOT EXISTS app_file_columns (
+  schema_name  TEXT    NOT NULL,
+  table_name   TEXT    NOT NULL,
+  base         TEXT    NOT NULL,
+  name_column  TEXT    NOT NULL,
+  data_column  TEXT    NOT NULL,
+  storage_mode TEXT    NOT NULL,
+  required     BOOLEAN NOT NULL DEFAULT FALSE,
+  PRIMARY KEY (schema_name, table_name, data_column)
+);
+
+INSERT INTO app_file_columns (schema_name, table_name, base, name_column, data_column, storage_mode, required)
+VALUES ('public', 'orders', 'document', 'document_name', 'document_data', 'fs', TRUE)
+ON CONFLICT DO NOTHING;
+
 -- === App settings (key-value) ===
 CREATE TABLE IF NOT EXISTS app_settings (
   key TEXT PRIMARY KEY,
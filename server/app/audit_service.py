@@ -1,11 +1,20 @@
 from __future__ import annotations
 
-import json
+import atexit
+import queue
+import sys
+import threading
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Dict, Optional
 
-from app.db import get_conn
+import orjson
+import psycopg2
+from psycopg2.extras import execute_values
+
+from app.config import AUDIT_SAMPLE
+from app.db import get_conn, hold_conn, release_conn
 
 LOG_DIR = Path(__file__).resolve().parent / "logs"
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -13,21 +22,90 @@ AUDIT_FILE = LOG_DIR / "audit.log"
 
 SENSITIVE_KEYS = {"password", "password_hash", "pass", "pwd", "token"}
 
+# Запись аудита идёт не в потоке запроса: события копятся в очереди,
+# фоновый поток пишет их пачками — в файл (один flush) и в БД (один commit)
+AUDIT_BATCH_MAX = 500
+AUDIT_BATCH_WAIT = 0.1  # сек, сколько добираем пачку после первой строки
+
+# элемент очереди: (строка для файла, строка для INSERT или None)
+_AUDIT_Q: "queue.Queue[tuple]" = queue.Queue(maxsize=10000)
+
+# файл держим открытым, пишем буферизованно (orjson отдаёт готовые UTF-8 bytes)
+_AUDIT_FH = AUDIT_FILE.open("ab", buffering=1 << 16)
+_JSON_OPTS = orjson.OPT_NON_STR_KEYS
+_file_lock = threading.Lock()
+
+
+# В БД всегда идут изменения и вход; INFO-чтения (select, list_tables, file_get, ...)
+# — только в файл, либо каждое AUDIT_SAMPLE-е. WARNING/ERROR — всегда в оба приёмника.
+DB_ACTIONS = frozenset((
+    "login",
+    "user_create",
+    "user_create_bulk",
+    "insert",
+    "insert_with_files",
+    "update",
+    "update_with_files",
+    "delete",
+    "create_table",
+    "file_attach",
+    "file_delete",
+    "backup_create",
+    "backup_restore",
+    "backup_schedule_set",
+))
+_sample_counts: Dict[str, int] = {}
+
+
+def _to_db(level: str, action: str) -> bool:
+    if level != "INFO" or action in DB_ACTIONS:
+        return True
+    if AUDIT_SAMPLE <= 0:
+        return False
+    # гонка между потоками тут безвредна — это выборка, не учёт
+    n = _sample_counts.get(action, 0)
+    _sample_counts[action] = n + 1
+    return n % AUDIT_SAMPLE == 0
+
+
+_SENSITIVE = frozenset(SENSITIVE_KEYS)
+_OMIT = frozenset(("content_base64", "content_blob", "bytes"))
+
 
 def _redact(obj: Any) -> Any:
+    # Копируем только узлы, в которых что-то заменили (и путь до них);
+    # без чувствительных ключей возвращается тот же объект без аллокаций.
     if isinstance(obj, dict):
-        out = {}
+        out = None
         for k, v in obj.items():
-            lk = str(k).lower()
-            if lk in SENSITIVE_KEYS:
-                out[k] = "***"
-            elif lk in ("content_base64", "content_blob", "bytes"):
-                out[k] = "<omitted>"
+            lk = k.lower() if isinstance(k, str) else str(k).lower()
+            if lk in _SENSITIVE:
+                nv = "***"
+            elif lk in _OMIT:
+                nv = "<omitted>"
+            elif isinstance(v, (dict, list)):
+                nv = _redact(v)
+                if nv is v:
+                    continue
             else:
-                out[k] = _redact(v)
-        return out
+                continue
+            if out is None:
+                out = dict(obj)
+            out[k] = nv
+        return obj if out is None else out
+
     if isinstance(obj, list):
-        return [_redact(x) for x in obj]
+        out_list = None
+        for i, v in enumerate(obj):
+            if not isinstance(v, (dict, list)):
+                continue
+            nv = _redact(v)
+            if nv is not v:
+                if out_list is None:
+                    out_list = list(obj)
+                out_list[i] = nv
+        return obj if out_list is None else out_list
+
     return obj
 
 
@@ -44,6 +122,9 @@ def audit_log(
         level = "INFO"
 
     safe_details = _redact(details or {})
+    # details сериализуем один раз: для файла (через Fragment) и для БД
+    # default=str: Decimal из строк insert/update (orjson сам его не умеет)
+    details_json = orjson.dumps(safe_details, default=str, option=_JSON_OPTS)
     ts_iso = datetime.now(timezone.utc).isoformat()
 
     # 1) write to file (append)
@@ -54,25 +135,143 @@ def audit_log(
         "user_role": user_role,
         "action": action,
         "table": table_name,
-        "details": safe_details,
+        "details": orjson.Fragment(details_json),
     }
-    with AUDIT_FILE.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    file_line = orjson.dumps(line)
 
-    # 2) write to DB
-    sql = """
-        INSERT INTO audit_log (level, user_login, user_role, action, table_name, details)
-        VALUES (%s, %s, %s, %s, %s, %s::jsonb);
-    """
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            sql,
-            (
-                level,
-                user_login,
-                user_role,
-                action,
-                table_name,
-                json.dumps(safe_details, ensure_ascii=False),
-            ),
+    # 2) write to DB (None — событие только для файла)
+    row = None
+    if _to_db(level, action):
+        row = (
+            level,
+            user_login,
+            user_role,
+            action,
+            table_name,
+            details_json.decode(),
         )
+    # оба приёмника пишет _drain
+    try:
+        _AUDIT_Q.put_nowait((file_line, row))
+    except queue.Full:
+        # писатель не успевает — пишем сами, но событие не теряем
+        _write_batch([(file_line, row)])
+
+
+def reopen_audit_file() -> None:
+    """
+    Переоткрыть audit.log после подмены каталога logs (restore): открытый
+    дескриптор указывает на уже удалённый inode — строки уходили бы в никуда.
+    """
+    global _AUDIT_FH
+    with _file_lock:
+        try:
+            _AUDIT_FH.close()  # с flush: хвост пишется в старый (удалённый) файл
+        except OSError:
+            pass
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        _AUDIT_FH = AUDIT_FILE.open("ab", buffering=1 << 16)
+
+
+def _close_audit_file() -> None:
+    with _file_lock:
+        _AUDIT_FH.close()
+
+
+def _write_file(lines: list) -> None:
+    with _file_lock:
+        _AUDIT_FH.write(b"\n".join(lines) + b"\n")
+        _AUDIT_FH.flush()
+
+
+_INSERT_SQL = """
+    INSERT INTO audit_log (level, user_login, user_role, action, table_name, details)
+    VALUES %s;
+"""
+_INSERT_TEMPLATE = "(%s, %s, %s, %s, %s, %s::jsonb)"
+
+# соединение писателя: берётся из пула один раз и живёт, пока не оборвётся
+_writer_conn = None
+
+
+def _insert_rows(conn, rows: list) -> None:
+    with conn.cursor() as cur:
+        execute_values(cur, _INSERT_SQL, rows, template=_INSERT_TEMPLATE, page_size=AUDIT_BATCH_MAX)
+
+
+def _write_rows(rows: list) -> None:
+    # вызывается не из писателя (очередь переполнена) — обычное соединение из пула;
+    # own: аудит не должен откатиться вместе с транзакцией запроса
+    with get_conn(own=True) as conn:
+        _insert_rows(conn, rows)
+
+
+def _writer_write_rows(rows: list) -> None:
+    """Пачка строк через постоянное соединение audit-writer; один переподключ при обрыве."""
+    global _writer_conn
+    for attempt in range(2):
+        if _writer_conn is None:
+            _writer_conn = hold_conn()
+        conn = _writer_conn
+        try:
+            _insert_rows(conn, rows)
+            conn.commit()
+            return
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # соединение мёртвое — закрываем и отдаём пулу, берём новое
+            _writer_conn = None
+            release_conn(conn, close=True)
+            if attempt:
+                raise
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def _take_batch() -> list:
+    rows = [_AUDIT_Q.get()]
+    deadline = time.monotonic() + AUDIT_BATCH_WAIT
+    while len(rows) < AUDIT_BATCH_MAX:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            rows.append(_AUDIT_Q.get(timeout=timeout))
+        except queue.Empty:
+            break
+    return rows
+
+
+def _write_batch(batch: list) -> None:
+    _write_file([line for line, _ in batch])
+    rows = [row for _, row in batch if row is not None]
+    if rows:
+        _write_rows(rows)
+
+
+def _drain() -> None:
+    while True:
+        batch = _take_batch()
+        try:
+            _write_file([line for line, _ in batch])
+            rows = [row for _, row in batch if row is not None]
+            if rows:
+                _writer_write_rows(rows)
+        except Exception as e:
+            # ошибка записи не должна убить писателя
+            print(f"audit_log: failed to write {len(batch)} event(s): {e}", file=sys.stderr)
+        finally:
+            for _ in batch:
+                _AUDIT_Q.task_done()
+
+
+def flush_audit(timeout: float = 5.0) -> None:
+    """Дождаться, пока фоновый писатель допишет очередь (при остановке сервера)."""
+    deadline = time.monotonic() + timeout
+    while _AUDIT_Q.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+threading.Thread(target=_drain, name="audit-writer", daemon=True).start()
+atexit.register(_close_audit_file)
+atexit.register(flush_audit)  # atexit — LIFO: сначала дописываем очередь, потом закрываем файл
@@ -1,16 +1,62 @@
 # server/app/auth_service.py
 from __future__ import annotations
 
+import base64
+import binascii
+import hashlib
+import hmac
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import bcrypt
-import jwt
+import orjson
+from psycopg2.extras import execute_values
 
-from app.config import JWT_SECRET, JWT_TTL_MIN
+from app.config import BCRYPT_COST, JWT_SECRET, JWT_TTL_MIN
 from app.db import get_conn
 
+# bcrypt отпускает GIL, но это сотни мс CPU: одновременно хэшируем не больше,
+# чем ядер, остальные логины ждут в очереди, а не делят ядра между собой
+_BCRYPT_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="bcrypt")
+# массовое заведение — в своём пуле на половине ядер: пачка не встаёт в
+# очередь перед логинами; размер пачки ограничен USERS_BULK_MAX
+_BCRYPT_BULK_POOL = ThreadPoolExecutor(
+    max_workers=max(1, (os.cpu_count() or 1) // 2), thread_name_prefix="bcrypt-bulk"
+)
+USERS_BULK_MAX = 500
+
+
+# JWT HS256 без PyJWT: заголовок у всех токенов один — кодируем его один раз
+def _b64(b: bytes) -> bytes:
+    return base64.urlsafe_b64encode(b).rstrip(b"=")
+
+
+def _b64_decode(s: bytes) -> bytes:
+    return base64.urlsafe_b64decode(s + b"=" * (-len(s) % 4))
+
+
+_HEADER_B64 = _b64(b'{"alg":"HS256","typ":"JWT"}')
+# ключ подготовлен один раз (ipad/opad уже посчитаны) — на токен только copy().
+# Если есть, берём HMAC-объект OpenSSL напрямую: у hmac.HMAC copy() —
+# питоновская обёртка вокруг него же
+try:
+    from _hashlib import hmac_new as _openssl_hmac_new
+
+    _JWT_HMAC = _openssl_hmac_new(JWT_SECRET.encode("utf-8"), digestmod="sha256")
+except (ImportError, ValueError):
+    _JWT_HMAC = hmac.new(JWT_SECRET.encode("utf-8"), digestmod=hashlib.sha256)
+
+
+def _sign(signing_input: bytes) -> bytes:
+    h = _JWT_HMAC.copy()
+    h.update(signing_input)
+    return h.digest()
+
 
 @dataclass
 class AuthUser:
@@ -23,14 +69,32 @@ class AuthUser:
 def hash_password(password: str) -> str:
     if not password or len(password) < 4:
         raise ValueError("Password too short")
-    salt = bcrypt.gensalt()
-    h = bcrypt.hashpw(password.encode("utf-8"), salt)
+    salt = bcrypt.gensalt(rounds=BCRYPT_COST)
+    h = _BCRYPT_POOL.submit(bcrypt.hashpw, password.encode("utf-8"), salt).result()
     return h.decode("utf-8")
 
 
+def hash_passwords_bulk(passwords: List[str]) -> List[str]:
+    """
+    Хэши для пачки паролей (импорт/массовое заведение пользователей):
+    все сразу в _BCRYPT_BULK_POOL — bcrypt отпускает GIL, пачка идёт параллельно,
+    а _BCRYPT_POOL остаётся логинам.
+    """
+    if len(passwords) > USERS_BULK_MAX:
+        raise ValueError(f"too many users (max {USERS_BULK_MAX})")
+    for p in passwords:
+        if not p or len(p) < 4:
+            raise ValueError("Password too short")
+    futs = [
+        _BCRYPT_BULK_POOL.submit(bcrypt.hashpw, p.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_COST))
+        for p in passwords
+    ]
+    return [f.result().decode("utf-8") for f in futs]
+
+
 def verify_password(password: str, password_hash: str) -> bool:
     try:
-        return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+        return _BCRYPT_POOL.submit(bcrypt.checkpw, password.encode("utf-8"), password_hash.encode("utf-8")).result()
     except Exception:
         return False
 
@@ -69,6 +133,50 @@ def create_user(login: str, password: str, full_name: str, role: str = "user") -
     }
 
 
+def create_users_bulk(users: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """users: [{login, password, full_name, role}] — один INSERT на всю пачку."""
+    if len(users) > USERS_BULK_MAX:
+        raise ValueError(f"too many users (max {USERS_BULK_MAX})")
+    rows = []
+    for u in users:
+        role = u.get("role", "user")
+        if role not in ("admin", "user"):
+            raise ValueError("role must be admin or user")
+        login = str(u.get("login") or "").strip()
+        full_name = str(u.get("full_name") or "").strip()
+        if not login or not full_name:
+            raise ValueError("login and full_name required")
+        rows.append([login, full_name, role])
+
+    hashes = hash_passwords_bulk([str(u.get("password") or "") for u in users])
+
+    sql = """
+        INSERT INTO users (login, password_hash, full_name, role)
+        VALUES %s
+        RETURNING id, login, full_name, role, created_at;
+    """
+    with get_conn() as conn, conn.cursor() as cur:
+        out = execute_values(
+            cur,
+            sql,
+            [(login, ph, full_name, role) for (login, full_name, role), ph in zip(rows, hashes)],
+            fetch=True,
+        )
+
+    return {
+        "users": [
+            {
+                "id": r[0],
+                "login": r[1],
+                "full_name": r[2],
+                "role": r[3],
+                "created_at": r[4].isoformat() if hasattr(r[4], "isoformat") else r[4],
+            }
+            for r in out
+        ]
+    }
+
+
 def authenticate(login: str, password: str) -> Optional[AuthUser]:
     sql = """
         SELECT id, login, password_hash, full_name, role
@@ -91,32 +199,74 @@ def authenticate(login: str, password: str) -> Optional[AuthUser]:
 
 
 def issue_token(u: AuthUser) -> str:
-    now = datetime.now(timezone.utc)
-    exp = now + timedelta(minutes=JWT_TTL_MIN)
+    now = int(time.time())
     payload = {
         "sub": str(u.id),
         "login": u.login,
         "role": u.role,
         "full_name": u.full_name,
-        "iat": int(now.timestamp()),
-        "exp": int(exp.timestamp()),
+        "iat": now,
+        "exp": now + JWT_TTL_MIN * 60,
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+    signing_input = _HEADER_B64 + b"." + _b64(orjson.dumps(payload))
+    return (signing_input + b"." + _b64(_sign(signing_input))).decode("ascii")
 
 
-def verify_token(token: str) -> AuthUser:
+def _verify_token_uncached(token: str) -> Tuple[AuthUser, float]:
+    """Полная проверка подписи и срока; вместе с пользователем — exp токена."""
     if not token:
         raise ValueError("token required")
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-    except jwt.ExpiredSignatureError:
-        raise ValueError("token expired")
-    except jwt.InvalidTokenError:
+        raw = token.encode("ascii")
+        signing_input, _, sig_b64 = raw.rpartition(b".")
+        header_b64, _, payload_b64 = signing_input.partition(b".")
+        if not header_b64 or not payload_b64:
+            raise ValueError
+        # сравниваем закодированную подпись побайтно — без нестрогого base64-декода
+        if not hmac.compare_digest(_b64(_sign(signing_input)), sig_b64):
+            raise ValueError
+        # свой заголовок совпадает побайтно; чужой (напр. от PyJWT) — разбираем
+        if header_b64 != _HEADER_B64 and orjson.loads(_b64_decode(header_b64)).get("alg") != "HS256":
+            raise ValueError
+        payload = orjson.loads(_b64_decode(payload_b64))
+        if not isinstance(payload, dict) or not isinstance(payload.get("exp"), int):
+            raise ValueError
+    except (ValueError, UnicodeError, binascii.Error):
         raise ValueError("invalid token")
+    if payload["exp"] <= time.time():
+        raise ValueError("token expired")
 
     return AuthUser(
         id=int(payload["sub"]),
         login=str(payload.get("login", "")),
         full_name=str(payload.get("full_name", "")),
         role=str(payload.get("role", "user")),
-    )
+    ), float(payload["exp"])
+
+
+# Проверенные токены: token -> (AuthUser, годен до). Клиент шлёт один и тот же
+# токен в каждом запросе; TTL ограничивает окно, пока кэш верит старому ответу.
+TOKEN_CACHE_TTL = 10.0
+TOKEN_CACHE_MAX = 10_000
+_token_cache: Dict[str, Tuple[AuthUser, float]] = {}
+_token_lock = threading.Lock()
+
+
+def verify_token(token: str) -> AuthUser:
+    now = time.time()
+    with _token_lock:
+        hit = _token_cache.get(token) if isinstance(token, str) else None
+    if hit is not None and hit[1] > now:
+        return hit[0]
+
+    u, exp = _verify_token_uncached(token)
+
+    # не дольше TTL и не дольше срока самого токена
+    with _token_lock:
+        if len(_token_cache) >= TOKEN_CACHE_MAX:
+            # самые старые записи — первые в dict
+            for k in list(itertools.islice(_token_cache, max(1, TOKEN_CACHE_MAX // 10))):
+                del _token_cache[k]
+        _token_cache[token] = (u, min(now + TOKEN_CACHE_TTL, exp))
+    return u
+
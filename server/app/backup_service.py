@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+import os
+import shutil
 import subprocess
 import tarfile
-from datetime import datetime
+import time
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
 from app.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
-from app.audit_service import audit_log
+from app.audit_service import audit_log, reopen_audit_file
+from app.schema_introspect import ensure_file_columns_table
 
 BASE = Path(__file__).resolve().parent
 BACKUP_DIR = BASE / "backups"
@@ -16,14 +19,82 @@ LOGS_DIR = BASE / "logs"
 BACKUP_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def _run(cmd: List[str], env: dict) -> None:
-    p = subprocess.run(cmd, env=env, capture_output=True, text=True)
-    if p.returncode != 0:
-        raise RuntimeError(p.stderr.strip() or "backup command failed")
+def _start(cmd: List[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+
+def _wait(p: subprocess.Popen, ok: Tuple[int, ...] = (0,)) -> None:
+    _, err = p.communicate()
+    if p.returncode not in ok:
+        raise RuntimeError((err or "").strip() or "backup command failed")
+
+
+def _run(cmd: List[str], env: dict, ok: Tuple[int, ...] = (0,)) -> None:
+    # stdout не нужен (psql печатает теги команд) — собираем только stderr для ошибки
+    _wait(_start(cmd, env), ok)
+
+
+def _gzip_flag() -> str:
+    # pigz жмёт на всех ядрах, формат тот же gzip
+    return "--use-compress-program=pigz" if shutil.which("pigz") else "-z"
+
+
+def _pack_files_logs(tar_path: Path, env: dict) -> None:
+    """files_fs + logs в tar.gz; пустые/отсутствующие папки пропускаем."""
+    members = []
+    if FILES_DIR.exists():
+        members += ["-C", str(FILES_DIR.parent), FILES_DIR.name]
+    if LOGS_DIR.exists():
+        members += ["-C", str(LOGS_DIR.parent), LOGS_DIR.name]
+    if not members:
+        return
+
+    if shutil.which("tar"):
+        # GNU tar: 1 — "file changed as we read it"; logs/audit.log дописывается
+        # почти каждым запросом, архив при этом цел (в нём снимок на момент чтения)
+        _run(["tar", _gzip_flag(), "-cf", str(tar_path), *members], env, ok=(0, 1))
+        return
+
+    with tarfile.open(tar_path, "w:gz") as tar:
+        if FILES_DIR.exists():
+            tar.add(FILES_DIR, arcname="files_fs")
+        if LOGS_DIR.exists():
+            tar.add(LOGS_DIR, arcname="logs")
+
+
+def _extract_files_logs(tar_path: Path, env: dict) -> Path:
+    """
+    Распаковка во временную папку рядом с данными (та же ФС): подмена
+    каталогов потом — переименованием, без второго прохода copytree.
+    """
+    import tempfile
+
+    tmp = Path(tempfile.mkdtemp(prefix="restore_", dir=BASE))
+    try:
+        if shutil.which("tar"):
+            _run(["tar", _gzip_flag(), "-xf", str(tar_path), "-C", str(tmp)], env)
+        else:
+            with tarfile.open(tar_path, "r:gz") as tar:
+                tar.extractall(tmp)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return tmp
+
+
+def _swap_files_logs(tmp: Path) -> None:
+    # tmp/files_fs -> FILES_DIR, tmp/logs -> LOGS_DIR
+    for src, dst in ((tmp / "files_fs", FILES_DIR), (tmp / "logs", LOGS_DIR)):
+        if not src.exists():
+            continue
+        if dst.exists():
+            shutil.rmtree(dst, ignore_errors=True)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(src, dst)
 
 
 def create_backup(user_login: str, user_role: str) -> Dict[str, Any]:
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    ts = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
     name = f"backup_{ts}"
     out_dir = BACKUP_DIR / name
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -31,8 +102,8 @@ def create_backup(user_login: str, user_role: str) -> Dict[str, Any]:
     dump_path = out_dir / "db.dump"
     env = dict(**{**subprocess.os.environ, "PGPASSWORD": DB_PASS})
 
-    # pg_dump custom format
-    _run([
+    # pg_dump custom format (уже сжат) — в фоне, параллельно с упаковкой файлов
+    dump = _start([
         "pg_dump",
         "-h", DB_HOST,
         "-p", str(DB_PORT),
@@ -44,11 +115,12 @@ def create_backup(user_login: str, user_role: str) -> Dict[str, Any]:
 
     # tar files + logs (если папок нет — ок)
     tar_path = out_dir / "files_logs.tar.gz"
-    with tarfile.open(tar_path, "w:gz") as tar:
-        if FILES_DIR.exists():
-            tar.add(FILES_DIR, arcname="files_fs")
-        if LOGS_DIR.exists():
-            tar.add(LOGS_DIR, arcname="logs")
+    try:
+        _pack_files_logs(tar_path, env)
+    except Exception:
+        dump.communicate()
+        raise
+    _wait(dump)
 
     audit_log("INFO", "backup_create", user_login, user_role, None, {"backup": name})
     return {"name": name, "path": str(out_dir)}
@@ -85,8 +157,8 @@ def restore_backup(name: str, user_login: str, user_role: str) -> Dict[str, Any]
         "-c", "DROP SCHEMA public CASCADE; CREATE SCHEMA public;"
     ], env)
 
-    # 2) restore db
-    _run([
+    # 2) restore db — в фоне, параллельно с распаковкой файлов (они независимы)
+    restore = _start([
         "pg_restore",
         "-h", DB_HOST,
         "-p", str(DB_PORT),
@@ -95,27 +167,28 @@ def restore_backup(name: str, user_login: str, user_role: str) -> Dict[str, Any]
         str(dump_path),
     ], env)
 
-
-    # 3) restore files + logs
-    if tar_path.exists():
-        # распакуем в temp, потом подменим
-        import tempfile
-        import shutil
-
-        tmp = Path(tempfile.mkdtemp(prefix="restore_"))
-        with tarfile.open(tar_path, "r:gz") as tar:
-            tar.extractall(tmp)
-
-        # tmp/files_fs -> FILES_DIR
-        if (tmp / "files_fs").exists():
-            if FILES_DIR.exists():
-                shutil.rmtree(FILES_DIR, ignore_errors=True)
-            shutil.copytree(tmp / "files_fs", FILES_DIR)
-
-        if (tmp / "logs").exists():
-            if LOGS_DIR.exists():
-                shutil.rmtree(LOGS_DIR, ignore_errors=True)
-            shutil.copytree(tmp / "logs", LOGS_DIR)
+    # 3) files + logs распаковываем, пока идёт pg_restore; каталоги подменяем
+    # только после успешного restore — иначе files_fs разойдётся с базой
+    tmp: Optional[Path] = None
+    try:
+        if tar_path.exists():
+            tmp = _extract_files_logs(tar_path, env)
+    except Exception:
+        restore.communicate()
+        raise
+    try:
+        _wait(restore)
+        # DROP SCHEMA снёс и app_file_columns, а в дампе до её появления её нет.
+        # Строки заново не переносим: file-колонки из COMMENT-ов материализует
+        # ленивое заполнение при первом table_meta (_fill_file_columns)
+        ensure_file_columns_table()
+        if tmp is not None:
+            _swap_files_logs(tmp)
+            # каталог logs подменён — дескриптор audit.log смотрит на удалённый файл
+            reopen_audit_file()
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
 
     audit_log("WARNING", "backup_restore", user_login, user_role, None, {"backup": name})
     return {"restored": True, "name": name}
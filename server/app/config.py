@@ -8,6 +8,23 @@ DB_PORT = int(os.getenv("DB_PORT", "5432"))
 DB_NAME = os.getenv("DB_NAME", "ui_db")
 DB_USER = os.getenv("DB_USER", "ui_user")
 DB_PASS = os.getenv("DB_PASS", "ui_pass")
+# соединения открываются заранее (DB_POOL_MIN) — горячий путь не ждёт connect+auth
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "8"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "32"))
+# сколько запрос ждёт свободное соединение, когда заняты все DB_POOL_MAX (сек)
+DB_POOL_WAIT = float(os.getenv("DB_POOL_WAIT", "30"))
+# TCP keepalive для соединений пула: простаивающее соединение не рвёт NAT/firewall,
+# мёртвое обнаруживается за idle + interval*count секунд
+DB_KEEPALIVES_IDLE = int(os.getenv("DB_KEEPALIVES_IDLE", "30"))
+# PREPARE/EXECUTE на соединении пула; за pgbouncer в transaction pooling сессия
+# не закреплена за клиентом — там выключить (DB_PREPARE=0)
+DB_PREPARE = os.getenv("DB_PREPARE", "1") != "0"
+# предел тела одного upload (байт); больше — отказ до чтения тела
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(512 * 1024 * 1024)))
 JWT_SECRET = os.getenv("JWT_SECRET", "change_me_super_secret")
 JWT_TTL_MIN = int(os.getenv("JWT_TTL_MIN", "120"))
 
+# INFO-события чтения пишутся в audit_log (БД) только каждое N-е по action; 0 — только в файл
+AUDIT_SAMPLE = int(os.getenv("AUDIT_SAMPLE", "0"))
+# стоимость bcrypt для новых хэшей (существующие проверяются со своей)
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "12"))
@@ -1,12 +1,18 @@
 # server/app/crud_dynamic.py
 from __future__ import annotations
 
+import itertools
+import threading
+import uuid
+from functools import lru_cache
 from typing import Any, Dict, Optional, Tuple, List
 
-from app.db import get_conn
-from datetime import date, datetime
-from decimal import Decimal
+from app.db import execute_prepared as _execute_prepared, get_conn
+from datetime import datetime
 
+# имена таблиц/колонок повторяются из запроса в запрос — проверка становится
+# поиском в словаре (ошибки не кэшируются, плохое имя проверяется каждый раз)
+@lru_cache(maxsize=4096)
 def _validate_ident(name: str) -> str:
     # Разрешаем только буквы/цифры/underscore, без кавычек/пробелов/точек.
     if not name or not name.replace("_", "").isalnum():
@@ -21,32 +27,103 @@ def _validate_table(schema: str, table: str) -> Tuple[str, str]:
 
 
 
+# select_rows с limit больше этого читает через server-side курсор пачками такого размера
+STREAM_ROWS = 1000
+
+def _placeholders(start: int, n: int) -> List[str]:
+    return [f"${i}" for i in range(start, start + n)]
+
+
 def _jsonify(v: Any) -> Any:
-    # делаем значения JSON-safe
-    if isinstance(v, memoryview):
-        v = v.tobytes()
-    if isinstance(v, (bytes, bytearray)):
+    # date, naive datetime, time, Decimal, UUID msgspec кодирует сам — той же
+    # строкой, что isoformat()/str(); здесь только то, что он сделал бы иначе
+    if isinstance(v, (bytes, bytearray, memoryview)):
         # чтобы не слать большие бинарные данные в UI
         return f"<BLOB {len(v)} bytes>"
-    if isinstance(v, (datetime, date)):
+    if isinstance(v, datetime) and v.tzinfo is not None:
+        # aware datetime msgspec пишет msgpack-timestamp'ом (UTC) — оставляем ISO со смещением
         return v.isoformat()
-    if isinstance(v, Decimal):
-        # чтобы не терять точность, лучше строкой (или float если хочешь)
-        return str(v)
     return v
 
 
-def _jsonify_rows(rows: list[list[Any]]) -> list[list[Any]]:
-    return [[_jsonify(x) for x in row] for row in rows]
-
-
 def _jsonify_dict(d: Dict[str, Any]) -> Dict[str, Any]:
     return {k: _jsonify(v) for k, v in d.items()}
 
 
-def _fetch_all(cur) -> tuple[list[str], list[list[Any]]]:
-    cols = [d.name for d in cur.description] if cur.description else []
-    rows = [list(r) for r in cur.fetchall()] if cols else []
+def _blob_tag(v: Any) -> str:
+    return f"<BLOB {len(v)} bytes>"
+
+
+def _iso(v: Any) -> str:
+    return v.isoformat()
+
+
+# Конвертер по OID колонки (cur.description[i].type_code), выбирается один раз
+# на выборку. None — значение кодирует сам msgspec; OID не из таблицы — общий _jsonify.
+_OID_CONVERTERS: Dict[int, Any] = {
+    16: None,      # bool
+    20: None,      # int8
+    21: None,      # int2
+    23: None,      # int4
+    25: None,      # text
+    26: None,      # oid
+    700: None,     # float4
+    701: None,     # float8
+    1042: None,    # bpchar
+    1043: None,    # varchar
+    114: None,     # json
+    3802: None,    # jsonb
+    1082: None,    # date      -> "YYYY-MM-DD"
+    1114: None,    # timestamp -> ISO без смещения
+    1700: None,    # numeric   -> Decimal строкой
+    17: _blob_tag,   # bytea (memoryview)
+    1184: _iso,      # timestamptz
+}
+
+
+def _row_converters(description) -> list:
+    convs = [(i, _OID_CONVERTERS.get(d.type_code, _jsonify)) for i, d in enumerate(description)]
+    return [(i, f) for i, f in convs if f is not None]
+
+
+def _convert_rows(raw: list, convs: list) -> list:
+    if not convs:
+        # всё уже JSON-safe — tuple из fetchall уходят как есть, без копии в list
+        return raw
+    rows = [list(r) for r in raw]
+    for row in rows:
+        for i, f in convs:
+            v = row[i]
+            if v is not None:
+                row[i] = f(v)
+    return rows
+
+
+def _fetch_all(cur) -> tuple[list[str], list]:
+    """Колонки и уже JSON-safe строки: конвертируем только колонки, где это нужно."""
+    if not cur.description:
+        return [], []
+    cols = [d.name for d in cur.description]
+    return cols, _convert_rows(cur.fetchall(), _row_converters(cur.description))
+
+
+def _fetch_all_chunked(cur, size: int) -> tuple[list[str], list]:
+    """
+    То же для server-side курсора: строки приходят пачками по size и сразу
+    конвертируются, сырые tuple всей выборки в памяти одновременно не лежат.
+    """
+    chunk = cur.fetchmany(size)
+    # у named cursor description появляется только после первого fetch
+    if not cur.description:
+        return [], []
+    cols = [d.name for d in cur.description]
+    convs = _row_converters(cur.description)
+    rows: list = []
+    while chunk:
+        rows += _convert_rows(chunk, convs)
+        if len(chunk) < size:
+            break
+        chunk = cur.fetchmany(size)
     return cols, rows
 
 
@@ -63,14 +140,24 @@ def select_rows(table: str, schema: str = "public", limit: int = 200, offset: in
     limit = int(limit)
     offset = int(offset)
 
-    sql = f'SELECT * FROM "{schema}"."{table}" ORDER BY 1 LIMIT %s OFFSET %s'
+    if limit > STREAM_ROWS:
+        # большая выборка — server-side курсор (DECLARE не принимает EXECUTE, поэтому без PREPARE)
+        sql = f'SELECT * FROM "{schema}"."{table}" ORDER BY 1 LIMIT %s OFFSET %s'
+        with get_conn() as conn:
+            with conn.cursor(name=f"sel_{uuid.uuid4().hex}") as cur:
+                cur.itersize = STREAM_ROWS
+                cur.execute(sql, (limit, offset))
+                cols, rows = _fetch_all_chunked(cur, STREAM_ROWS)
+        return {"columns": cols, "rows": rows, "limit": limit, "offset": offset}
+
+    sql = f'SELECT * FROM "{schema}"."{table}" ORDER BY 1 LIMIT $1 OFFSET $2'
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, (limit, offset))
+            _execute_prepared(conn, cur, sql, [limit, offset])
             cols, rows = _fetch_all(cur)
 
-    return {"columns": cols, "rows": _jsonify_rows(rows), "limit": limit, "offset": offset}
+    return {"columns": cols, "rows": rows, "limit": limit, "offset": offset}
 
 
 def insert_row(table: str, values: Dict[str, Any], schema: str = "public") -> Dict[str, Any]:
@@ -80,14 +167,14 @@ def insert_row(table: str, values: Dict[str, Any], schema: str = "public") -> Di
 
     cols = [_validate_ident(c) for c in values.keys()]
     col_sql = ", ".join([f'"{c}"' for c in cols])
-    placeholders = ", ".join(["%s"] * len(cols))
+    placeholders = ", ".join(_placeholders(1, len(cols)))
     params = [values[c] for c in cols]
 
     sql = f'INSERT INTO "{schema}"."{table}" ({col_sql}) VALUES ({placeholders}) RETURNING *'
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, params)
+            _execute_prepared(conn, cur, sql, params)
             row = _fetch_one_mapping(cur)
 
     return {"row": _jsonify_dict(row) if row else None}
@@ -108,8 +195,9 @@ def update_row_by_pk(
     set_cols = [_validate_ident(c) for c in values.keys()]
     where_cols = [_validate_ident(c) for c in pk.keys()]
 
-    set_sql = ", ".join([f'"{c}" = %s' for c in set_cols])
-    where_sql = " AND ".join([f'"{c}" = %s' for c in where_cols])
+    set_sql = ", ".join([f'"{c}" = {p}' for c, p in zip(set_cols, _placeholders(1, len(set_cols)))])
+    where_ph = _placeholders(len(set_cols) + 1, len(where_cols))
+    where_sql = " AND ".join([f'"{c}" = {p}' for c, p in zip(where_cols, where_ph)])
 
     params: list[Any] = [values[c] for c in set_cols] + [pk[c] for c in where_cols]
 
@@ -117,7 +205,7 @@ def update_row_by_pk(
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, params)
+            _execute_prepared(conn, cur, sql, params)
             row = _fetch_one_mapping(cur)
 
     return {"row": _jsonify_dict(row) if row else None}
@@ -129,14 +217,14 @@ def delete_row_by_pk(table: str, pk: Dict[str, Any], schema: str = "public") ->
         raise ValueError("pk is empty")
 
     where_cols = [_validate_ident(c) for c in pk.keys()]
-    where_sql = " AND ".join([f'"{c}" = %s' for c in where_cols])
+    where_sql = " AND ".join([f'"{c}" = {p}' for c, p in zip(where_cols, _placeholders(1, len(where_cols)))])
     params = [pk[c] for c in where_cols]
 
     sql = f'DELETE FROM "{schema}"."{table}" WHERE {where_sql} RETURNING *'
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, params)
+            _execute_prepared(conn, cur, sql, params)
             row = _fetch_one_mapping(cur)
 
     return {"row": _jsonify_dict(row) if row else None}
@@ -156,19 +244,19 @@ def search_rows(
     limit = int(limit)
     offset = int(offset)
 
+    # текстовые колонки — сразу массивом из одной строки, фильтр по типу в SQL
     cols_sql = """
-        SELECT column_name, data_type
+        SELECT coalesce(array_agg(column_name::text ORDER BY ordinal_position), '{}')
         FROM information_schema.columns
         WHERE table_schema = %s AND table_name = %s
-        ORDER BY ordinal_position;
+          AND data_type IN ('character varying', 'text', 'character');
     """
 
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(cols_sql, (schema, table))
-            cols_rows = cur.fetchall()
+            text_cols = cur.fetchone()[0]
 
-    text_cols = [r[0] for r in cols_rows if r[1] in ("character varying", "text", "character")]
     if not text_cols:
         return {"columns": [], "rows": [], "limit": limit, "offset": offset}
 
@@ -178,9 +266,17 @@ def search_rows(
             raise ValueError(f"column {column} is not a text column of {table}")
         where_sql = f'"{column}" ILIKE %s'
         where_params = [f"%{query}%"]
-    else:
+    elif len(text_cols) == 1 or any(ch in query for ch in "\x01%_\\"):
+        # шаблонные символы могли бы совпасть через границу колонок — по-старому
         where_sql = " OR ".join([f'"{c}" ILIKE %s' for c in text_cols])
         where_params = [f"%{query}%"] * len(text_cols)
+    else:
+        # один ILIKE по склейке колонок вместо N: разделитель \x01 не даёт
+        # совпадению перейти через границу колонок, NULL concat_ws пропускает.
+        # (concat_ws не IMMUTABLE: для trigram-индекса нужна immutable-обёртка)
+        cols = ", ".join(f'"{c}"' for c in text_cols)
+        where_sql = f"concat_ws(chr(1), {cols}) ILIKE %s"
+        where_params = [f"%{query}%"]
 
     sql = f'SELECT * FROM "{schema}"."{table}" WHERE ({where_sql}) ORDER BY 1 LIMIT %s OFFSET %s'
     params = where_params + [limit, offset]
@@ -192,13 +288,28 @@ def search_rows(
 
     return {
         "columns": columns,
-        "rows": _jsonify_rows(rows),
+        "rows": rows,
         "limit": limit,
         "offset": offset,
         "searched_columns": text_cols,
     }
 
 
+# (schema, ref_table) -> угаданная колонка-подпись или None: выпадающие списки
+# открываются на каждой форме, а колонки таблицы меняются только через restore.
+# Кэшируются только существующие таблицы (имя приходит от клиента), и не больше
+# LABEL_CACHE_MAX записей; create_table и restore сбрасывают кэш.
+LABEL_CACHE_MAX = 1024
+_LABEL_GUESS_CACHE: Dict[Tuple[str, str], Optional[str]] = {}
+_label_lock = threading.Lock()
+_MISS = object()
+
+
+def invalidate_label_cache() -> None:
+    with _label_lock:
+        _LABEL_GUESS_CACHE.clear()
+
+
 def fk_options(
     ref_table: str,
     id_column: str = "id",
@@ -212,38 +323,57 @@ def fk_options(
     if label_column:
         label_column = _validate_ident(label_column)
 
+    # (есть ли таблица, угаданная колонка или NULL)
     guess_sql = """
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_schema = %s AND table_name = %s
-          AND column_name IN ('full_name', 'title', 'email', 'name', 'status')
-        ORDER BY CASE column_name
-          WHEN 'full_name' THEN 1
-          WHEN 'title' THEN 2
-          WHEN 'email' THEN 3
-          WHEN 'name' THEN 4
-          WHEN 'status' THEN 5
-          ELSE 100
-        END
-        LIMIT 1;
+        SELECT
+          EXISTS (
+            SELECT 1 FROM information_schema.tables
+            WHERE table_schema = %(schema)s AND table_name = %(table)s
+          ),
+          (
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_schema = %(schema)s AND table_name = %(table)s
+              AND column_name IN ('full_name', 'title', 'email', 'name', 'status')
+            ORDER BY CASE column_name
+              WHEN 'full_name' THEN 1
+              WHEN 'title' THEN 2
+              WHEN 'email' THEN 3
+              WHEN 'name' THEN 4
+              WHEN 'status' THEN 5
+              ELSE 100
+            END
+            LIMIT 1
+          );
     """
 
     if label_column is None:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(guess_sql, (schema, ref_table))
-                r = cur.fetchone()
-        label_column = r[0] if r else id_column
+        key = (schema, ref_table)
+        with _label_lock:
+            guessed = _LABEL_GUESS_CACHE.get(key, _MISS)
+        if guessed is _MISS:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(guess_sql, {"schema": schema, "table": ref_table})
+                    exists, guessed = cur.fetchone()
+            if exists:
+                with _label_lock:
+                    if len(_LABEL_GUESS_CACHE) >= LABEL_CACHE_MAX:
+                        # самые старые записи — первые в dict
+                        for k in list(itertools.islice(_LABEL_GUESS_CACHE, LABEL_CACHE_MAX // 10)):
+                            del _LABEL_GUESS_CACHE[k]
+                    _LABEL_GUESS_CACHE[key] = guessed
+        label_column = guessed or id_column
 
     sql = (
         f'SELECT "{id_column}" as id, "{label_column}" as label '
         f'FROM "{schema}"."{ref_table}" '
-        f'ORDER BY 1 LIMIT %s OFFSET %s'
+        f'ORDER BY 1 LIMIT $1 OFFSET $2'
     )
 
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, (limit, offset))
+            _execute_prepared(conn, cur, sql, [int(limit), int(offset)])
             cols = [d.name for d in cur.description]
             items = [dict(zip(cols, row)) for row in cur.fetchall()]
 
@@ -1,24 +1,74 @@
 from __future__ import annotations
 
+import functools
 import os
+import threading
 from dataclasses import dataclass
+from pathlib import Path
+from typing import Tuple
+
+import msgspec
 
 from app.rsa_block import PublicKey, PrivateKey, generate_keypair
 
+# Ключи кэшируются на диске, чтобы не генерировать RSA на каждом старте
+KEY_CACHE_DIR = Path(os.getenv("RSA_KEY_CACHE_DIR", str(Path.home() / ".cache" / "sedms")))
+KEY_CACHE_PREFIX = "server_rsa"
+
+_lock = threading.Lock()
+
 @dataclass
 class CryptoCtx:
     pub: PublicKey
     priv: PrivateKey
     mode: str
 
+def _load_or_generate_keypair(bits: int) -> Tuple[PublicKey, PrivateKey]:
+    path = KEY_CACHE_DIR / f"{KEY_CACHE_PREFIX}_{bits}.msgpack"
+    try:
+        d = msgspec.msgpack.decode(path.read_bytes())
+        n = int(d["n"])
+        # p/q нет в кэшах, записанных до CRT — тогда ключ работает без него
+        return PublicKey(n=n, e=int(d["e"])), PrivateKey(
+            n=n, d=int(d["d"]), p=int(d.get("p", 0)), q=int(d.get("q", 0))
+        )
+    except (OSError, KeyError, ValueError, TypeError, msgspec.DecodeError):
+        pass
+
+    pub, priv = generate_keypair(bits=bits)
+    try:
+        KEY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            # msgpack не умеет int > 64 бит — храним строками
+            f.write(msgspec.msgpack.encode({
+                "n": str(pub.n), "e": pub.e, "d": str(priv.d), "p": str(priv.p), "q": str(priv.q),
+            }))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return pub, priv
+
+@functools.lru_cache(maxsize=1)
+def _get_ctx(bits: int, mode: str) -> CryptoCtx:
+    pub, priv = _load_or_generate_keypair(bits)
+    return CryptoCtx(pub=pub, priv=priv, mode=mode)
+
 def init_crypto() -> CryptoCtx:
     bits = int(os.getenv("RSA_BITS", "512"))   # для скорости 512, можно 768/1024
     mode = os.getenv("RSA_MODE", "rand_len")   # один из: raw_fixed/raw_len/rand_fixed/rand_len
-    pub, priv = generate_keypair(bits=bits)
-    return CryptoCtx(pub=pub, priv=priv, mode=mode)
+    with _lock:
+        return _get_ctx(bits, mode)
 
 def pub_to_json(pub: PublicKey) -> dict:
     return {"n": str(pub.n), "e": pub.e}
 
+@functools.lru_cache(maxsize=4096)
+def _pub_from_ne(n: str | int, e: str | int) -> PublicKey:
+    return PublicKey(n=int(n), e=int(e))
+
 def pub_from_json(d: dict) -> PublicKey:
-    return PublicKey(n=int(d["n"]), e=int(d["e"]))
+    # клиенты переподключаются с тем же ключом: повторный hello получает уже
+    # разобранный PublicKey вместе с его cached_property (size, powmod_args)
+    return _pub_from_ne(d["n"], d["e"])
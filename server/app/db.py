@@ -1,39 +1,280 @@
 # server/app/db.py
+import contextvars
+import hashlib
+import re
+import threading
+import weakref
+from functools import lru_cache
+from typing import Any, Callable
+
 import psycopg2
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2 import errorcodes
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from psycopg2.pool import ThreadedConnectionPool
 from contextlib import contextmanager
 
-from app.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS
+from app.config import (
+    DB_HOST,
+    DB_PORT,
+    DB_NAME,
+    DB_USER,
+    DB_PASS,
+    DB_POOL_MIN,
+    DB_POOL_MAX,
+    DB_POOL_WAIT,
+    DB_KEEPALIVES_IDLE,
+    DB_PREPARE,
+)
+
+# сервер обслуживает каждое соединение в своём потоке — пул должен быть потокобезопасным
+_pool: ThreadedConnectionPool | None = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool сверх maxconn сразу бросает PoolError; воркеров (запросы
+# + upload) больше, чем соединений — лишние ждут свободный слот до DB_POOL_WAIT
+_slots: threading.BoundedSemaphore | None = None
 
-_pool: SimpleConnectionPool | None = None
+# соединение текущего запроса (request_scope); у каждого потока свой контекст
+_scope_conn: contextvars.ContextVar = contextvars.ContextVar("db_scope_conn", default=None)
 
 
 def init_db_pool():
-    global _pool
+    global _pool, _slots
     if _pool is None:
-        _pool = SimpleConnectionPool(
-            minconn=1,
-            maxconn=10,
-            host=DB_HOST,
-            port=DB_PORT,
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASS,
-        )
+        with _pool_lock:
+            if _pool is None:
+                maxconn = max(DB_POOL_MAX, DB_POOL_MIN)
+                _slots = threading.BoundedSemaphore(maxconn)
+                # minconn соединений открываются сразу, в конструкторе
+                _pool = ThreadedConnectionPool(
+                    minconn=DB_POOL_MIN,
+                    maxconn=maxconn,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASS,
+                    connect_timeout=2,
+                    keepalives=1,
+                    keepalives_idle=DB_KEEPALIVES_IDLE,
+                    keepalives_interval=10,
+                    keepalives_count=3,
+                )
     return _pool
 
 
+def _getconn():
+    if not _slots.acquire(timeout=DB_POOL_WAIT):
+        raise RuntimeError("db pool exhausted")
+    try:
+        return _pool.getconn()
+    except Exception:
+        _slots.release()
+        raise
+
+
+def _putconn(conn, close: bool = False) -> None:
+    try:
+        # упавшее соединение (conn.closed) пул сам выбрасывает, а не отдаёт дальше
+        _pool.putconn(conn, close=close)
+    finally:
+        _slots.release()
+
+
+def hold_conn():
+    """
+    Соединение надолго (audit-writer) — вместе со слотом _slots, как и в get_conn:
+    иначе при занятых слотах пул превысил бы maxconn. Вернуть через release_conn().
+    """
+    init_db_pool()
+    return _getconn()
+
+
+def release_conn(conn, close: bool = False) -> None:
+    _putconn(conn, close=close)
+
+
 @contextmanager
-def get_conn():
+def request_scope():
+    """
+    Один запрос клиента — одно соединение и один commit в конце.
+    Соединение берётся из пула лениво, при первом get_conn() внутри scope;
+    исключение из scope — rollback.
+    """
+    # [соединение, действия после commit (см. after_commit)]
+    slot = [None, []]
+    token = _scope_conn.set(slot)
+    try:
+        yield
+        if slot[0] is not None:
+            slot[0].commit()
+    except Exception:
+        if slot[0] is not None:
+            slot[0].rollback()
+        raise
+    finally:
+        _scope_conn.reset(token)
+        if slot[0] is not None:
+            _putconn(slot[0])
+    for fn in slot[1]:
+        # запрос уже закоммичен: сбой уборки не должен превращать его в ошибку
+        try:
+            fn()
+        except Exception:
+            pass
+
+
+def after_commit(fn: Callable[[], Any]) -> None:
+    """
+    fn — после commit текущего request_scope (при rollback не вызывается):
+    например, удалить с диска файл, на который строка уже не ссылается.
+    Вне scope get_conn() коммитит сам на выходе из блока — fn вызывается сразу.
+    """
+    slot = _scope_conn.get()
+    if slot is None:
+        fn()
+    else:
+        slot[1].append(fn)
+
+
+@contextmanager
+def _autocommit_if_idle(conn):
+    """
+    Чтение без BEGIN/COMMIT: если на соединении нет открытой транзакции,
+    на время блока включаем autocommit (флаг клиентский — без round-trip).
+    Открытая транзакция (запись в том же request_scope) — читаем в ней,
+    чтобы видеть свои изменения.
+    """
+    if conn.autocommit or conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+        yield
+        return
+    conn.autocommit = True
+    try:
+        yield
+    finally:
+        conn.autocommit = False
+
+
+@contextmanager
+def get_conn(own: bool = False, readonly: bool = False):
+    """
+    own=True — отдельное соединение со своим commit даже внутри request_scope.
+    readonly=True — только SELECT-ы: выполняются без BEGIN/COMMIT, если
+    транзакция ещё не открыта (server-side курсорам нужна транзакция — не для них).
+    """
     if _pool is None:
         init_db_pool()
 
-    conn = _pool.getconn()
+    slot = None if own else _scope_conn.get()
+    if slot is not None:
+        # внутри request_scope: общее соединение, commit делает scope
+        if slot[0] is None:
+            slot[0] = _getconn()
+        conn = slot[0]
+        try:
+            if readonly:
+                with _autocommit_if_idle(conn):
+                    yield conn
+            else:
+                yield conn
+        except Exception:
+            # транзакция после ошибки всё равно не годится — откатываем сразу,
+            # чтобы следующие запросы в том же scope могли работать
+            conn.rollback()
+            raise
+        return
+
+    conn = _getconn()
     try:
-        yield conn
+        if readonly:
+            with _autocommit_if_idle(conn):
+                yield conn
+        else:
+            yield conn
         conn.commit()
     except Exception:
         conn.rollback()
         raise
     finally:
-        _pool.putconn(conn)
+        _putconn(conn)
+
+
+# PREPARE живёт в сессии Postgres: помним, какие имена уже подготовлены на каждом
+# соединении пула (ключ слабый — закрытое соединение уходит вместе со своим набором)
+_conn_prepared: "weakref.WeakKeyDictionary[Any, set]" = weakref.WeakKeyDictionary()
+# нет такого statement / уже есть — набор разошёлся с сессией
+_PREPARE_RETRY_CODES = frozenset((
+    errorcodes.INVALID_SQL_STATEMENT_NAME,
+    errorcodes.DUPLICATE_PREPARED_STATEMENT,
+))
+# FEATURE_NOT_SUPPORTED повторяем только для этой ошибки (план устарел после restore/DDL)
+_STALE_PLAN_MSG = "cached plan must not change result type"
+
+
+def _retryable(e: psycopg2.Error) -> bool:
+    if e.pgcode in _PREPARE_RETRY_CODES:
+        return True
+    return e.pgcode == errorcodes.FEATURE_NOT_SUPPORTED and _STALE_PLAN_MSG in str(e)
+
+
+@lru_cache(maxsize=1024)
+def _stmt_name(sql: str) -> str:
+    return "stmt_" + hashlib.blake2s(sql.encode("utf-8"), digest_size=8).hexdigest()
+
+
+_DOLLAR_PARAM = re.compile(r"\$(\d+)")
+
+
+@lru_cache(maxsize=1024)
+def _to_pyformat(sql: str) -> tuple[str, tuple[int, ...]]:
+    # $n -> %s и порядок параметров для обычного cur.execute (без PREPARE)
+    order = tuple(int(m) - 1 for m in _DOLLAR_PARAM.findall(sql))
+    return _DOLLAR_PARAM.sub("%s", sql.replace("%", "%%")), order
+
+
+def execute_prepared(conn, cur, sql: str, params: list) -> None:
+    """
+    sql — с плейсхолдерами $1..$n (идентификаторы уже проверены).
+    Первый вызов на соединении делает PREPARE, дальше только EXECUTE —
+    без повторного разбора и планирования. С DB_PREPARE=0 — обычный execute.
+    """
+    if not DB_PREPARE:
+        plain_sql, order = _to_pyformat(sql)
+        cur.execute(plain_sql, [params[i] for i in order])
+        return
+
+    name = _stmt_name(sql)
+    args = f" ({', '.join(['%s'] * len(params))})" if params else ""
+    execute_sql = f"EXECUTE {name}{args}"
+    for attempt in range(2):
+        done = _conn_prepared.setdefault(conn, set())
+        # в открытой транзакции (уже были запросы этого request_scope) откатить
+        # можно только свой шаг — под SAVEPOINT; он идёт тем же round-trip
+        in_tx = not conn.autocommit and conn.info.transaction_status == TRANSACTION_STATUS_INTRANS
+        guard = "SAVEPOINT stmt_retry; " if in_tx and not attempt else ""
+        try:
+            if name not in done:
+                # PREPARE без параметров: % в sql не экранируем
+                cur.execute(f"{guard}PREPARE {name} AS {sql}")
+                done.add(name)
+                cur.execute(execute_sql, params)
+            else:
+                cur.execute(guard + execute_sql, params)
+        except psycopg2.Error as e:
+            if attempt or not _retryable(e):
+                raise
+            if guard:
+                with conn.cursor() as c:
+                    c.execute("ROLLBACK TO SAVEPOINT stmt_retry; RELEASE SAVEPOINT stmt_retry")
+            else:
+                # транзакция начата этим же вызовом — ничего чужого в ней нет
+                conn.rollback()
+            # схема поменялась или набор разошёлся с сессией — готовим заново
+            with conn.cursor() as c:
+                c.execute("DEALLOCATE ALL")
+            done.clear()
+            continue
+        if guard:
+            # отдельный курсор: результат EXECUTE в cur должен остаться
+            with conn.cursor() as c:
+                c.execute("RELEASE SAVEPOINT stmt_retry")
+        return
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
-import json
 from typing import Any, Dict, List, Tuple
 
+import orjson
+from psycopg2.extras import execute_values
+
+from app.crud_dynamic import invalidate_label_cache
 from app.db import get_conn
+from app.schema_introspect import invalidate_schema_cache
 
 ALLOWED_TYPES = {
     "integer": "INTEGER",
@@ -76,7 +80,7 @@ def create_table(payload: Dict[str, Any], schema: str = "public") -> Dict[str, A
                 "mode": storage_mode,
                 "required": required,
             }
-            comment_sqls.append((data_col, json.dumps(meta, ensure_ascii=False)))
+            comment_sqls.append((data_col, orjson.dumps(meta).decode()))
 
             file_columns.append({
                 "base": base,
@@ -146,7 +150,9 @@ def create_table(payload: Dict[str, Any], schema: str = "public") -> Dict[str, A
         + "\n);"
     )
 
-    with get_conn() as conn, conn.cursor() as cur:
+    # своё соединение и commit (не общий request_scope): кэш схемы сбрасывается
+    # уже после commit, иначе параллельный запрос успеет закэшировать старую
+    with get_conn(own=True) as conn, conn.cursor() as cur:
         cur.execute(create_sql)
 
         # Attach COMMENT metadata for inline file columns
@@ -155,6 +161,26 @@ def create_table(payload: Dict[str, Any], schema: str = "public") -> Dict[str, A
                 f'COMMENT ON COLUMN "{schema}"."{table}"."{col_name}" IS %s;',
                 (comment,),
             )
+        # и сразу разобранную копию — table_meta читает file-колонки оттуда
+        if file_columns:
+            execute_values(
+                cur,
+                """
+                INSERT INTO app_file_columns
+                    (schema_name, table_name, base, name_column, data_column, storage_mode, required)
+                VALUES %s
+                ON CONFLICT (schema_name, table_name, data_column) DO UPDATE
+                SET base = EXCLUDED.base, name_column = EXCLUDED.name_column,
+                    storage_mode = EXCLUDED.storage_mode, required = EXCLUDED.required;
+                """,
+                [
+                    (schema, table, fc["base"], fc["name_column"], fc["data_column"], fc["storage_mode"], fc["required"])
+                    for fc in file_columns
+                ],
+            )
+    invalidate_schema_cache(schema, table)
+    # угадывание подписи для fk_options могло запомнить прежнее состояние таблицы
+    invalidate_label_cache()
 
     return {
         "created": True,
@@ -1,30 +1,62 @@
 # server/app/files_service.py
 from __future__ import annotations
 
-import base64
+import binascii
+import itertools
+import mmap
+import os
+import threading
 import uuid
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
 
-from app.db import get_conn
-from app.schema_introspect import table_meta
+from app.db import after_commit, get_conn
+from app.schema_introspect import cached_table_meta
 
 STORAGE_DIR = Path(__file__).resolve().parent / "storage" / "files_fs"
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
 
+@lru_cache(maxsize=1024)
 def _ident(name: str) -> str:
     if not name or not name.replace("_", "").isalnum():
         raise ValueError(f"Bad identifier: {name}")
     return name
 
 
+# Индекс file-колонок по base — отдельно от meta: meta из cached_table_meta
+# общий для потоков и не изменяется. Запись годна, пока кэш отдаёт тот же
+# объект meta; индексируются только существующие таблицы, не больше FILE_INDEX_MAX.
+FILE_INDEX_MAX = 1024
+_FILE_INDEX: Dict[Tuple[str, str], Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]] = {}
+_file_index_lock = threading.Lock()
+
+
+def _file_columns_by_base(meta: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    key = (str(meta.get("schema")), str(meta.get("table")))
+    with _file_index_lock:
+        hit = _FILE_INDEX.get(key)
+    if hit is not None and hit[0] is meta:
+        return hit[1]
+
+    by_base = {str(fc.get("base", "")): fc for fc in meta.get("file_columns", []) or []}
+    if meta.get("columns"):
+        with _file_index_lock:
+            _FILE_INDEX.pop(key, None)
+            if len(_FILE_INDEX) >= FILE_INDEX_MAX:
+                # самые старые записи — первые в dict
+                for k in list(itertools.islice(_FILE_INDEX, FILE_INDEX_MAX // 10)):
+                    del _FILE_INDEX[k]
+            _FILE_INDEX[key] = (meta, by_base)
+    return by_base
+
+
 def _find_file_def(meta: Dict[str, Any], base: str) -> Dict[str, Any]:
-    base = base.strip()
-    for fc in meta.get("file_columns", []) or []:
-        if str(fc.get("base", "")) == base:
-            return fc
-    raise ValueError("File column is not configured")
+    fc = _file_columns_by_base(meta).get(base.strip())
+    if fc is None:
+        raise ValueError("File column is not configured")
+    return fc
 
 
 def _build_where_pk(pk: Dict[str, Any]) -> Tuple[str, list[Any]]:
@@ -63,7 +95,7 @@ def prepare_inline_file_value(
     created_path: Optional[str] = None
 
     if mode == "base64":
-        stored_value: Any = base64.b64encode(content_bytes).decode("ascii")
+        stored_value: Any = binascii.b2a_base64(content_bytes, newline=False).decode("ascii")
     elif mode == "blob":
         stored_value = content_bytes
     elif mode == "fs":
@@ -79,6 +111,45 @@ def prepare_inline_file_value(
     return name_col, data_col, stored_value, created_path
 
 
+def stored_fs_paths(meta: Dict[str, Any], table: str, pk: Dict[str, Any], bases: list[str], schema: str = "public") -> list[str]:
+    """
+    Текущие пути файлов (storage_mode=fs) для bases в строке pk —
+    чтобы удалить их с диска после успешной замены.
+    """
+    table = _ident(table)
+    data_cols = [
+        _ident(fc["data_column"])
+        for fc in (_find_file_def(meta, _ident(b)) for b in bases)
+        if fc["storage_mode"] == "fs"
+    ]
+    if not data_cols:
+        return []
+
+    where_sql, where_params = _build_where_pk(pk)
+    cols_sql = ", ".join(f'"{c}"' for c in data_cols)
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            f'SELECT {cols_sql} FROM "{schema}"."{table}" WHERE {where_sql} LIMIT 1;',
+            tuple(where_params),
+        )
+        r = cur.fetchone()
+    return [str(v) for v in (r or ()) if v]
+
+
+def _update_returning_old(schema: str, table: str, data_col: str, set_sql: str, where_sql: str) -> str:
+    """
+    UPDATE, который одним запросом возвращает прежнее значение data_col
+    (RETURNING видит уже новое). Параметры: set, where, where.
+    """
+    return (
+        f'UPDATE "{schema}"."{table}" SET {set_sql} '
+        f'FROM (SELECT "{data_col}" AS old_d FROM "{schema}"."{table}" '
+        f'WHERE {where_sql} LIMIT 1 FOR UPDATE) o '
+        f'WHERE {where_sql} '
+        f'RETURNING o.old_d;'
+    )
+
+
 def file_attach(
     table: str,
     pk: Dict[str, Any],
@@ -94,7 +165,7 @@ def file_attach(
     table = _ident(table)
     base = _ident(base)
 
-    meta = table_meta(table, schema=schema)
+    meta = cached_table_meta(table, schema=schema)
     name_col, data_col, new_data, new_path = prepare_inline_file_value(
         meta=meta,
         base=base,
@@ -102,39 +173,40 @@ def file_attach(
         mime_type=mime_type,
         content_bytes=content_bytes,
     )
-    mode = _find_file_def(meta, base)["storage_mode"]
-    required = bool(_find_file_def(meta, base).get("required", False))
+    fc = _find_file_def(meta, base)
+    mode = fc["storage_mode"]
+    required = bool(fc.get("required", False))
 
     where_sql, where_params = _build_where_pk(pk)
 
     old_path: Optional[str] = None
-    if mode == "fs":
-        with get_conn() as conn, conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
+        if mode == "fs":
             cur.execute(
-                f'SELECT "{data_col}" FROM "{schema}"."{table}" WHERE {where_sql} LIMIT 1;',
-                tuple(where_params),
+                _update_returning_old(schema, table, data_col, f'"{name_col}"=%s, "{data_col}"=%s', where_sql),
+                tuple([original_name, new_data] + where_params + where_params),
+            )
+        else:
+            cur.execute(
+                f'UPDATE "{schema}"."{table}" '
+                f'SET "{name_col}"=%s, "{data_col}"=%s '
+                f'WHERE {where_sql} '
+                f'RETURNING "{name_col}", "{data_col}";',
+                tuple([original_name, new_data] + where_params),
             )
-            r = cur.fetchone()
-            if r and r[0]:
-                old_path = str(r[0])
-
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            f'UPDATE "{schema}"."{table}" '
-            f'SET "{name_col}"=%s, "{data_col}"=%s '
-            f'WHERE {where_sql} '
-            f'RETURNING "{name_col}", "{data_col}";',
-            tuple([original_name, new_data] + where_params),
-        )
         updated = cur.fetchone()
 
+    if updated and mode == "fs" and updated[0]:
+        old_path = str(updated[0])
+
     if not updated:
         if mode == "fs" and new_path:
             Path(str(new_path)).unlink(missing_ok=True)
         raise ValueError("row not found")
 
     if mode == "fs" and old_path and new_path and old_path != new_path:
-        Path(old_path).unlink(missing_ok=True)
+        # внутри request_scope строка ещё не закоммичена — старый файл удаляем после
+        after_commit(lambda p=old_path: Path(p).unlink(missing_ok=True))
 
     return {
         "ok": True,
@@ -149,19 +221,64 @@ def file_attach(
     }
 
 
+def _iter_open_file(f: BinaryIO, chunk_size: int) -> Iterator[memoryview]:
+    """
+    Куски файла через один и тот же буфер (readinto, без bytes на кусок):
+    кусок действителен только до следующего next() — потребитель
+    (send_encrypted_stream) шифрует его сразу.
+    """
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with f:
+        if hasattr(os, "posix_fadvise"):
+            # читаем строго последовательно — пусть ядро читает вперёд агрессивнее
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(view)
+            if not n:
+                return
+            yield view[:n]
+
+
+def _map_file(path: str) -> memoryview | bytes:
+    with open(path, "rb", buffering=0) as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""  # пустой файл mmap не отображает
+        # отображение живёт, пока жив view; дескриптор ему не нужен
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _b64_streamable(stored: Any) -> bool:
+    # наш b2a_base64(newline=False): без переводов строк, длина кратна 4
+    return isinstance(stored, str) and len(stored) % 4 == 0 and "\n" not in stored
+
+
+def _iter_b64_decode(stored: str, chunk_size: int) -> Iterator[bytes]:
+    # декодируем кусками по мере отправки — целиком файл в памяти не собирается
+    step = max(chunk_size // 3, 1) * 4
+    for i in range(0, len(stored), step):
+        yield binascii.a2b_base64(stored[i:i + step])
+
+
 def file_get(
     table: str,
     pk: Dict[str, Any],
     base: str,
     schema: str = "public",
+    chunk_size: int = 0,
 ) -> Dict[str, Any]:
+    """
+    chunk_size=0: {"meta", "bytes"} — файл целиком.
+    chunk_size>0: {"meta", "size", "chunks"} — итератор кусков; fs-файл
+    читается с диска по мере отправки, а не целиком в память.
+    """
     if schema != "public":
         raise ValueError("Only public schema allowed")
 
     table = _ident(table)
     base = _ident(base)
 
-    meta = table_meta(table, schema=schema)
+    meta = cached_table_meta(table, schema=schema)
     fc = _find_file_def(meta, base)
     mode = fc["storage_mode"]
     name_col = _ident(fc["name_column"])
@@ -183,21 +300,41 @@ def file_get(
     if stored is None:
         raise ValueError("file not set")
 
+    meta = {
+        "original_name": original_name or f"{base}.bin",
+        "mime_type": None,
+        "storage_mode": mode,
+    }
+
+    if chunk_size and mode == "fs":
+        # открываем сразу: ошибка (нет файла) должна случиться до отправки заголовка
+        # без буферизации Python: readinto читает прямо в наш буфер
+        f = open(str(stored), "rb", buffering=0)
+        size = os.fstat(f.fileno()).st_size
+        return {"meta": meta, "size": size, "chunks": _iter_open_file(f, chunk_size)}
+
+    if chunk_size and mode == "base64" and _b64_streamable(stored):
+        pad = 2 if stored.endswith("==") else 1 if stored.endswith("=") else 0
+        size = len(stored) // 4 * 3 - pad
+        return {"meta": meta, "size": size, "chunks": _iter_b64_decode(stored, chunk_size)}
+
     if mode == "base64":
-        data = base64.b64decode(stored)
+        # a2b_base64 берёт ASCII-str напрямую, без промежуточного bytes
+        data = binascii.a2b_base64(stored)
     elif mode == "blob":
         data = stored
     else:
-        data = Path(str(stored)).read_bytes()
+        # fs сюда доходит только для bin-ответа целиком: страницы файла
+        # отображаются, а не копируются в bytes — send_session_bin шифрует
+        # их блоками прямо из page cache
+        data = _map_file(str(stored))
 
-    return {
-        "meta": {
-            "original_name": original_name or f"{base}.bin",
-            "mime_type": None,
-            "storage_mode": mode,
-        },
-        "bytes": data,
-    }
+    if chunk_size:
+        view = memoryview(data)
+        chunks = (view[i:i + chunk_size] for i in range(0, len(view), chunk_size))
+        return {"meta": meta, "size": len(view), "chunks": chunks}
+
+    return {"meta": meta, "bytes": data}
 
 
 def file_delete(
@@ -212,7 +349,7 @@ def file_delete(
     table = _ident(table)
     base = _ident(base)
 
-    meta = table_meta(table, schema=schema)
+    meta = cached_table_meta(table, schema=schema)
     fc = _find_file_def(meta, base)
     required = bool(fc.get("required", False))
     mode = fc["storage_mode"]
@@ -225,26 +362,26 @@ def file_delete(
     where_sql, where_params = _build_where_pk(pk)
 
     old_path: Optional[str] = None
-    if mode == "fs":
-        with get_conn() as conn, conn.cursor() as cur:
+    with get_conn() as conn, conn.cursor() as cur:
+        if mode == "fs":
             cur.execute(
-                f'SELECT "{data_col}" FROM "{schema}"."{table}" WHERE {where_sql} LIMIT 1;',
-                tuple(where_params),
+                _update_returning_old(schema, table, data_col, f'"{name_col}"=NULL, "{data_col}"=NULL', where_sql),
+                tuple(where_params + where_params),
             )
             r = cur.fetchone()
+            deleted = r is not None
             if r and r[0]:
                 old_path = str(r[0])
-
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            f'UPDATE "{schema}"."{table}" '
-            f'SET "{name_col}"=NULL, "{data_col}"=NULL '
-            f'WHERE {where_sql};',
-            tuple(where_params),
-        )
-        deleted = cur.rowcount > 0
+        else:
+            cur.execute(
+                f'UPDATE "{schema}"."{table}" '
+                f'SET "{name_col}"=NULL, "{data_col}"=NULL '
+                f'WHERE {where_sql};',
+                tuple(where_params),
+            )
+            deleted = cur.rowcount > 0
 
     if deleted and mode == "fs" and old_path:
-        Path(old_path).unlink(missing_ok=True)
+        after_commit(lambda p=old_path: Path(p).unlink(missing_ok=True))
 
     return {"deleted": bool(deleted)}
@@ -1,12 +1,25 @@
 # server/app/main.py
 from __future__ import annotations
 
+import os
+import selectors
 import socket
 import struct
-from typing import Any, Dict, List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
 
+from app.config import MAX_UPLOAD_SIZE
+from app.db import init_db_pool, request_scope
 from app.protocol import recv_msg, send_msg
-from app.schema_introspect import list_tables, table_meta
+from app.schema_introspect import (
+    cached_list_tables,
+    cached_table_meta,
+    cached_tables_meta,
+    ensure_file_columns_table,
+    invalidate_schema_cache,
+)
 from app.crud_dynamic import (
     select_rows,
     insert_row,
@@ -14,91 +27,517 @@ from app.crud_dynamic import (
     delete_row_by_pk,
     search_rows,
     fk_options,
+    invalidate_label_cache,
 )
 from app.ddl import create_table
-from app.auth_service import authenticate, issue_token, verify_token, create_user
+from app.auth_service import AuthUser, authenticate, issue_token, verify_token, create_user, create_users_bulk, USERS_BULK_MAX
 from app.audit_service import audit_log
 from app.backup_service import create_backup, list_backups, restore_backup
 from app.scheduler import start_scheduler, apply_backup_schedule, load_and_apply_backup_schedule
 from app.crypto_ctx import init_crypto, pub_to_json, pub_from_json
 from app.secure_protocol import (
-    recv_encrypted,
-    send_encrypted,
-    recv_encrypted_bin,
-    send_encrypted_bin,
+    new_session_key,
+    send_session_key,
+    send_session,
+    send_session_bin,
+    recv_session,
+    recv_stream_body,
+    send_encrypted_stream,
+    decode_session_frame,
+    session_frame_len,
+    SESSION_HEADER_LEN,
+    MAX_FRAME,
+    STREAM_CHUNK,
 )
-from app.settings_service import get_backup_schedule, set_backup_schedule
+from app.settings_service import get_backup_schedule, invalidate_settings_cache, set_backup_schedule
 
 # INLINE FILE API (no files table)
-from app.files_service import file_attach, file_get, file_delete, prepare_inline_file_value
+from app.files_service import (
+    file_attach,
+    file_delete,
+    file_get,
+    prepare_inline_file_value,
+    stored_fs_paths,
+)
 
 HOST = "0.0.0.0"
 PORT = 9090
 UPLOAD_PORT = 9091
-
-MAINTENANCE = False
+SOCK_BUF = 4 << 20  # SO_SNDBUF/SO_RCVBUF: потоки файлов в обе стороны
+# upload-соединения короткие (один поток данных и ответ): обслуживаем пулом,
+# accept-цикл только раздаёт сокеты; сверх лимита новые ждут в очереди пула
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "32"))
+_UPLOAD_POOL = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+# accept ждёт свободного воркера: лишние соединения копятся в backlog ядра,
+# а не в очереди пула
+_UPLOAD_SLOTS = threading.BoundedSemaphore(UPLOAD_WORKERS)
+# тело upload: каждое чтение (и ответ) ждёт клиента не дольше UPLOAD_IO_TIMEOUT
+UPLOAD_IO_TIMEOUT = 60.0
+# persistent-соединения: handshake и обработка запросов (см. _Reactor);
+# клиент без hello не держит воркер дольше HANDSHAKE_TIMEOUT
+REQUEST_WORKERS = int(os.getenv("REQUEST_WORKERS", "32"))
+HANDSHAKE_TIMEOUT = 30.0
+# ответ клиенту, который не читает сокет, держит воркер не дольше SEND_TIMEOUT
+SEND_TIMEOUT = 60.0
+_REQUEST_POOL = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix="request")
+_RECV_FLAGS = getattr(socket, "MSG_DONTWAIT", 0)
+
+# число идущих restore: 0 — обычный режим. Читается в каждом запросе без
+# блокировки (int под GIL), меняется только под _MAINT_LOCK в _maintenance()
+MAINTENANCE = 0
+_MAINT_LOCK = threading.Lock()
+_MAINT_ALLOWED = frozenset({"backup_restore", "backup_list"})
 CRYPTO = init_crypto()
+_U32 = struct.Struct(">I")
+
+
+def _apply_inline_files(
+    meta: Dict[str, Any],
+    files: List[Dict[str, Any]],
+    blobs: List[memoryview],
+    values: Dict[str, Any],
+    created_paths: List[str],
+) -> None:
+    """
+    Кладёт файлы в values (<base>_name / <base>_data) по storage_mode колонки.
+    Созданные на диске файлы дописываются в created_paths — для отката.
+    """
+    for desc, b in zip(files, blobs):
+        base = str(desc.get("base") or "")
+        original_name = str(desc.get("original_name") or "")
+        mime_type = desc.get("mime_type")
+        if not base or not original_name:
+            raise ValueError("bad file descriptor")
+
+        name_col, data_col, stored_value, created_path = prepare_inline_file_value(
+            meta=meta,
+            base=base,
+            original_name=original_name,
+            mime_type=mime_type,
+            content_bytes=b,
+        )
+        values[name_col] = original_name
+        values[data_col] = stored_value
+        if created_path:
+            created_paths.append(created_path)
 
 
-def _unpack_multi_files(blob: bytes) -> List[bytes]:
+def _unpack_multi_files(blob: bytes | bytearray) -> List[memoryview]:
     """
     Custom framing for multiple files:
       [count:4]
       repeat count times:
         [len:4][bytes...]
+    Файлы — view на blob, без копий: prepare_inline_file_value и psycopg2
+    принимают memoryview как есть.
     """
-    off = 0
-    if len(blob) < 4:
+    mv = memoryview(blob)
+    if len(mv) < 4:
         raise ValueError("bad files blob")
-    (count,) = struct.unpack(">I", blob[off:off + 4])
-    off += 4
-    out: List[bytes] = []
+    (count,) = _U32.unpack_from(mv, 0)
+    off = 4
+    out: List[memoryview] = []
     for _ in range(count):
-        if off + 4 > len(blob):
+        if off + 4 > len(mv):
             raise ValueError("bad files blob")
-        (n,) = struct.unpack(">I", blob[off:off + 4])
+        (n,) = _U32.unpack_from(mv, off)
         off += 4
-        if off + n > len(blob):
+        if off + n > len(mv):
             raise ValueError("bad files blob")
-        out.append(blob[off:off + n])
+        out.append(mv[off:off + n])
         off += n
     return out
 
 
+@contextmanager
+def _maintenance() -> Iterator[None]:
+    # счётчик, а не флаг: первый закончившийся restore не снимает режим,
+    # пока идёт второй
+    global MAINTENANCE
+    with _MAINT_LOCK:
+        MAINTENANCE += 1
+    try:
+        yield
+    finally:
+        with _MAINT_LOCK:
+            MAINTENANCE -= 1
+
+
+def _handle_ping(req: Dict[str, Any]) -> Dict[str, Any]:
+    return {"ok": True, "type": "pong"}
+
+
+# ===== Auth: login only without token =====
+
+def _handle_login(req: Dict[str, Any]) -> Dict[str, Any]:
+    login = req.get("login", "")
+    password = req.get("password", "")
+    u = authenticate(login, password)
+    if not u:
+        return {"ok": False, "error": "bad credentials"}
+
+    token = issue_token(u)
+    audit_log("INFO", "login", u.login, u.role, None, {"login": u.login})
+    return {
+        "ok": True,
+        "token": token,
+        "user": {"id": u.id, "login": u.login, "full_name": u.full_name, "role": u.role},
+    }
+
+
+# ===== Schema =====
+
+def _handle_list_tables(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    tables = cached_list_tables()
+    return {"ok": True, "tables": tables}
+
+
+def _handle_table_meta(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    table = req.get("table")
+    if not table:
+        return {"ok": False, "error": "table is required"}
+    return {"ok": True, "meta": cached_table_meta(str(table))}
+
+
+# больше таблиц за один tables_meta не принимаем (клиент режет список на пачки)
+TABLES_META_MAX = 1000
+
+
+def _handle_tables_meta(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    # meta пачки таблиц одним запросом — клиенту не нужен table_meta на каждую
+    tables = req.get("tables")
+    if not isinstance(tables, list) or not tables:
+        return {"ok": False, "error": "tables must be a non-empty list"}
+    if len(tables) > TABLES_META_MAX:
+        return {"ok": False, "error": f"too many tables (max {TABLES_META_MAX})"}
+    return {"ok": True, "meta": cached_tables_meta([str(t) for t in tables])}
+
+
+# ===== Read =====
+
+def _handle_select(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    table = req.get("table")
+    if not table:
+        return {"ok": False, "error": "table is required"}
+    limit = int(req.get("limit", 200))
+    offset = int(req.get("offset", 0))
+    data = select_rows(table, limit=limit, offset=offset)
+    return {"ok": True, "data": data}
+
+
+# ===== Write =====
+
+def _handle_insert(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    table = req.get("table")
+    values = req.get("values")
+    if not table or not isinstance(values, dict):
+        return {"ok": False, "error": "table and dict values are required"}
+
+    out = insert_row(table, values)
+
+    audit_log(
+        "INFO",
+        "insert",
+        auth_user.login,
+        auth_user.role,
+        table,
+        {"values": values, "row": out.get("row")},
+    )
+    return {"ok": True, "data": out}
+
+
+def _handle_update(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    table = req.get("table")
+    pk = req.get("pk")
+    values = req.get("values")
+    if not table or not isinstance(pk, dict) or not isinstance(values, dict):
+        return {"ok": False, "error": "table, dict pk and dict values are required"}
+
+    out = update_row_by_pk(table, pk, values)
+
+    audit_log(
+        "INFO",
+        "update",
+        auth_user.login,
+        auth_user.role,
+        table,
+        {"pk": pk, "values": values, "row": out.get("row")},
+    )
+    return {"ok": True, "data": out}
+
+
+def _handle_delete(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    table = req.get("table")
+    pk = req.get("pk")
+    if not table or not isinstance(pk, dict):
+        return {"ok": False, "error": "table and dict pk are required"}
+
+    out = delete_row_by_pk(table, pk)
+
+    audit_log(
+        "INFO",
+        "delete",
+        auth_user.login,
+        auth_user.role,
+        table,
+        {"pk": pk, "row": out.get("row")},
+    )
+    return {"ok": True, "data": out}
+
+
+# ===== Search / FK helpers =====
+
+def _handle_search(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    table = req.get("table")
+    query = req.get("query")
+    column = req.get("column")
+    if not table or not isinstance(query, str):
+        return {"ok": False, "error": "table and query are required"}
+    limit = int(req.get("limit", 200))
+    offset = int(req.get("offset", 0))
+    out = search_rows(table, query, column=column, limit=limit, offset=offset)
+    return {"ok": True, "data": out}
+
+
+def _handle_fk_options(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    ref_table = req.get("ref_table")
+    id_column = req.get("id_column", "id")
+    label_column = req.get("label_column")
+    if not ref_table:
+        return {"ok": False, "error": "ref_table is required"}
+    limit = int(req.get("limit", 200))
+    offset = int(req.get("offset", 0))
+    out = fk_options(ref_table, id_column=id_column, label_column=label_column, limit=limit, offset=offset)
+    return {"ok": True, "data": out}
+
+
+# ===== DDL =====
+
+def _handle_create_table(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    payload = req.get("payload")
+    if not isinstance(payload, dict):
+        return {"ok": False, "error": "payload dict is required"}
+    out = create_table(payload)
+    return {"ok": True, "data": out}
+
+
+# ===== Admin: users =====
+
+def _handle_user_create(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    if auth_user.role != "admin":
+        return {"ok": False, "error": "admin only"}
+    login = req.get("login", "")
+    password = req.get("password", "")
+    full_name = req.get("full_name", "")
+    role = req.get("role", "user")
+    out = create_user(login, password, full_name, role)
+    audit_log(
+        "INFO",
+        "user_create",
+        auth_user.login,
+        auth_user.role,
+        "users",
+        {"created_login": login, "created_role": role, "created_full_name": full_name},
+    )
+    return {"ok": True, "data": out}
+
+
+def _handle_user_create_bulk(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    if auth_user.role != "admin":
+        return {"ok": False, "error": "admin only"}
+    users = req.get("users")
+    if not isinstance(users, list) or not all(isinstance(u, dict) for u in users):
+        return {"ok": False, "error": "users list is required"}
+    if not users:
+        return {"ok": True, "data": {"users": []}}
+    if len(users) > USERS_BULK_MAX:
+        return {"ok": False, "error": f"too many users (max {USERS_BULK_MAX})"}
+    out = create_users_bulk(users)
+    audit_log(
+        "INFO",
+        "user_create_bulk",
+        auth_user.login,
+        auth_user.role,
+        "users",
+        {"created": [{"login": u["login"], "role": u["role"]} for u in out["users"]]},
+    )
+    return {"ok": True, "data": out}
+
+
+# ===== Backups =====
+
+def _handle_backup_create(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    if auth_user.role != "admin":
+        return {"ok": False, "error": "admin only"}
+    out = create_backup(auth_user.login, auth_user.role)
+    return {"ok": True, "data": out}
+
+
+def _handle_backup_list(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    if auth_user.role != "admin":
+        return {"ok": False, "error": "admin only"}
+    out = list_backups()
+    return {"ok": True, "data": out}
+
+
+def _handle_backup_restore(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    if auth_user.role != "admin":
+        return {"ok": False, "error": "admin only"}
+    name = req.get("name")
+    if not name:
+        return {"ok": False, "error": "name is required"}
+
+    with _maintenance():
+        try:
+            out = restore_backup(name, auth_user.login, auth_user.role)
+        finally:
+            invalidate_schema_cache()
+            invalidate_label_cache()
+            invalidate_settings_cache()
+
+    return {"ok": True, "data": out}
+
+
+def _handle_backup_schedule_get(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    # admin-only
+    if auth_user.role != "admin":
+        return {"ok": False, "error": "forbidden"}
+
+    schedule = get_backup_schedule()
+    # можно сразу вернуть расчёт next_run_time, чтобы UI видел эффект
+    applied = apply_backup_schedule(schedule) if schedule.get("enabled") else {"enabled": False}
+    # Важно: apply_backup_schedule переставит job на месте; это ок, но можно и без этого.
+    return {"ok": True, "schedule": {**schedule, **({"next_run_time": applied.get("next_run_time")} if schedule.get("enabled") else {})}}
+
+
+def _handle_backup_schedule_set(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    # admin-only
+    if auth_user.role != "admin":
+        return {"ok": False, "error": "forbidden"}
+
+    enabled = bool(req.get("enabled", True))
+    hour = int(req.get("hour", 2))
+    minute = int(req.get("minute", 0))
+    timezone = str(req.get("timezone", "UTC"))
+
+    if hour < 0 or hour > 23 or minute < 0 or minute > 59:
+        return {"ok": False, "error": "invalid time"}
+
+    # сохраняем в БД
+    schedule = set_backup_schedule(enabled, hour, minute, timezone)
+
+    # применяем сразу в scheduler
+    applied = apply_backup_schedule(schedule) if enabled else {"enabled": False, "next_run_time": None}
+
+    # аудит (если у тебя audit_log подключён)
+    # audit_log("INFO", "backup_schedule_set", user.login, user.role, None, {"enabled": enabled, "hour": hour, "minute": minute, "timezone": timezone})
+
+    return {"ok": True, "schedule": {**schedule, "next_run_time": applied.get("next_run_time")}}
+
+
+# ===== Files (INLINE MODEL) =====
+
+def _handle_file_get(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    t = req.get("type")
+    table = req.get("table")
+    pk = req.get("pk")
+    base = req.get("base")
+    if not table or not isinstance(pk, dict) or not base:
+        return {"ok": False, "error": "table, dict pk and base are required"}
+
+    chunk_size = STREAM_CHUNK if t == "file_get_stream" else 0
+    out = file_get(table=str(table), pk=pk, base=str(base), chunk_size=chunk_size)
+
+    audit_log(
+        "INFO",
+        "file_get",
+        auth_user.login,
+        auth_user.role,
+        str(table),
+        {"table": str(table), "pk": pk, "base": str(base), "original_name": out["meta"].get("original_name")},
+    )
+
+    if t == "file_get_stream":
+        # тело уходит кадрами по STREAM_CHUNK — клиент пишет их на диск по мере прихода
+        header = {"ok": True, "meta": out["meta"], "size": out["size"]}
+        return {"__stream__": True, "header": header, "chunks": out["chunks"]}
+
+    return {"__bin__": True, "header": {"ok": True, "meta": out["meta"]}, "bin": out["bytes"]}
+
+
+def _handle_file_delete(req: Dict[str, Any], auth_user: AuthUser) -> Dict[str, Any]:
+    table = req.get("table")
+    pk = req.get("pk")
+    base = req.get("base")
+    if not table or not isinstance(pk, dict) or not base:
+        return {"ok": False, "error": "table, dict pk and base are required"}
+
+    out = file_delete(table=str(table), pk=pk, base=str(base))
+
+    audit_log(
+        "INFO",
+        "file_delete",
+        auth_user.login,
+        auth_user.role,
+        str(table),
+        {"table": str(table), "pk": pk, "base": str(base), "deleted": out.get("deleted")},
+    )
+
+    return {"ok": True, "data": out}
+
+
+# type -> обработчик; таблицы строятся один раз при импорте
+PUBLIC_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    "ping": _handle_ping,
+    "login": _handle_login,
+}
+
+HANDLERS: Dict[str, Callable[[Dict[str, Any], AuthUser], Dict[str, Any]]] = {
+    "list_tables": _handle_list_tables,
+    "table_meta": _handle_table_meta,
+    "tables_meta": _handle_tables_meta,
+    "select": _handle_select,
+    "insert": _handle_insert,
+    "update": _handle_update,
+    "delete": _handle_delete,
+    "search": _handle_search,
+    "fk_options": _handle_fk_options,
+    "create_table": _handle_create_table,
+    "user_create": _handle_user_create,
+    "user_create_bulk": _handle_user_create_bulk,
+    "backup_create": _handle_backup_create,
+    "backup_list": _handle_backup_list,
+    "backup_restore": _handle_backup_restore,
+    "backup_schedule_get": _handle_backup_schedule_get,
+    "backup_schedule_set": _handle_backup_schedule_set,
+    "file_get": _handle_file_get,
+    "file_get_stream": _handle_file_get,
+    "file_delete": _handle_file_delete,
+}
+
+# эти пишут свой аудит (с результатом), базовый для них не нужен
+_OWN_AUDIT = frozenset({"insert", "update", "delete", "file_get", "file_get_stream", "file_delete"})
+
+
 def handle(req: Dict[str, Any]) -> Dict[str, Any]:
-    global MAINTENANCE 
     t = req.get("type")
+    if not isinstance(t, str):
+        t = None  # не ключ таблиц — дойдёт до "unknown type" после проверки токена
 
-    if t == "ping":
-        return {"ok": True, "type": "pong"}
-
-    # ===== Auth: login only without token =====
-    if t == "login":
-        login = req.get("login", "")
-        password = req.get("password", "")
-        u = authenticate(login, password)
-        if not u:
-            return {"ok": False, "error": "bad credentials"}
-
-        token = issue_token(u)
-        audit_log("INFO", "login", u.login, u.role, None, {"login": u.login})
-        return {
-            "ok": True,
-            "token": token,
-            "user": {"id": u.id, "login": u.login, "full_name": u.full_name, "role": u.role},
-        }
+    public = PUBLIC_HANDLERS.get(t)
+    if public is not None:
+        return public(req)
 
     # ===== All other calls require token =====
     token = req.get("token")
     try:
         auth_user = verify_token(token)
 
-        global MAINTENANCE
-        if MAINTENANCE and t not in ("backup_restore", "backup_list"):
+        if MAINTENANCE and t not in _MAINT_ALLOWED:
             return {"ok": False, "error": "server in maintenance mode"}
 
         # base audit for most ops
-        if t not in ("insert", "update", "delete", "file_get", "file_delete"):
+        if t not in _OWN_AUDIT:
             audit_log(
                 "INFO",
                 t or "unknown",
@@ -110,282 +549,429 @@ def handle(req: Dict[str, Any]) -> Dict[str, Any]:
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
-    # ===== Schema =====
-    if t == "list_tables":
-        tables = list_tables()
-        return {"ok": True, "tables": tables}
-
-    if t == "table_meta":
-        table = req.get("table")
-        if not table:
-            return {"ok": False, "error": "table is required"}
-        meta = table_meta(table)
-        return {"ok": True, "meta": meta}
-
-    # ===== Read =====
-    if t == "select":
-        table = req.get("table")
-        if not table:
-            return {"ok": False, "error": "table is required"}
-        limit = int(req.get("limit", 200))
-        offset = int(req.get("offset", 0))
-        data = select_rows(table, limit=limit, offset=offset)
-        return {"ok": True, "data": data}
-
-    # ===== Write =====
-    if t == "insert":
-        table = req.get("table")
-        values = req.get("values")
-        if not table or not isinstance(values, dict):
-            return {"ok": False, "error": "table and dict values are required"}
-
-        out = insert_row(table, values)
-
-        audit_log(
-            "INFO",
-            "insert",
-            auth_user.login,
-            auth_user.role,
-            table,
-            {"values": values, "row": out.get("row")},
-        )
-        return {"ok": True, "data": out}
-
-    if t == "update":
-        table = req.get("table")
-        pk = req.get("pk")
-        values = req.get("values")
-        if not table or not isinstance(pk, dict) or not isinstance(values, dict):
-            return {"ok": False, "error": "table, dict pk and dict values are required"}
-
-        out = update_row_by_pk(table, pk, values)
-
-        audit_log(
-            "INFO",
-            "update",
-            auth_user.login,
-            auth_user.role,
-            table,
-            {"pk": pk, "values": values, "row": out.get("row")},
-        )
-        return {"ok": True, "data": out}
-
-    if t == "delete":
-        table = req.get("table")
-        pk = req.get("pk")
-        if not table or not isinstance(pk, dict):
-            return {"ok": False, "error": "table and dict pk are required"}
-
-        out = delete_row_by_pk(table, pk)
-
-        audit_log(
-            "INFO",
-            "delete",
-            auth_user.login,
-            auth_user.role,
-            table,
-            {"pk": pk, "row": out.get("row")},
-        )
-        return {"ok": True, "data": out}
-
-    # ===== Search / FK helpers =====
-    if t == "search":
-        table = req.get("table")
-        query = req.get("query")
-        column = req.get("column")
-        if not table or not isinstance(query, str):
-            return {"ok": False, "error": "table and query are required"}
-        limit = int(req.get("limit", 200))
-        offset = int(req.get("offset", 0))
-        out = search_rows(table, query, column=column, limit=limit, offset=offset)
-        return {"ok": True, "data": out}
-
-    if t == "fk_options":
-        ref_table = req.get("ref_table")
-        id_column = req.get("id_column", "id")
-        label_column = req.get("label_column")
-        if not ref_table:
-            return {"ok": False, "error": "ref_table is required"}
-        limit = int(req.get("limit", 200))
-        offset = int(req.get("offset", 0))
-        out = fk_options(ref_table, id_column=id_column, label_column=label_column, limit=limit, offset=offset)
-        return {"ok": True, "data": out}
-
-    # ===== DDL =====
-    if t == "create_table":
-        payload = req.get("payload")
-        if not isinstance(payload, dict):
-            return {"ok": False, "error": "payload dict is required"}
-        out = create_table(payload)
-        return {"ok": True, "data": out}
-
-    # ===== Admin: users =====
-    if t == "user_create":
-        if auth_user.role != "admin":
-            return {"ok": False, "error": "admin only"}
-        login = req.get("login", "")
-        password = req.get("password", "")
-        full_name = req.get("full_name", "")
-        role = req.get("role", "user")
-        out = create_user(login, password, full_name, role)
-        audit_log(
-            "INFO",
-            "user_create",
-            auth_user.login,
-            auth_user.role,
-            "users",
-            {"created_login": login, "created_role": role, "created_full_name": full_name},
-        )
-        return {"ok": True, "data": out}
-
-    # ===== Backups =====
-    if t == "backup_create":
-        if auth_user.role != "admin":
-            return {"ok": False, "error": "admin only"}
-        out = create_backup(auth_user.login, auth_user.role)
-        return {"ok": True, "data": out}
-
-    if t == "backup_list":
-        if auth_user.role != "admin":
-            return {"ok": False, "error": "admin only"}
-        out = list_backups()
-        return {"ok": True, "data": out}
-
-    if t == "backup_restore":
-        if auth_user.role != "admin":
-            return {"ok": False, "error": "admin only"}
-        name = req.get("name")
-        if not name:
-            return {"ok": False, "error": "name is required"}
-
-        MAINTENANCE = True
-        try:
-            out = restore_backup(name, auth_user.login, auth_user.role)
-        finally:
-            MAINTENANCE = False
+    fn = HANDLERS.get(t)
+    if fn is None:
+        return {"ok": False, "error": f"unknown type: {t}"}
+    return fn(req, auth_user)
 
-        return {"ok": True, "data": out}
 
-    if t == "backup_schedule_get":
-        # admin-only
-        if auth_user.role != "admin":
-            return {"ok": False, "error": "forbidden"}
+def _open_session_channel(conn: socket.socket) -> bytes | None:
+    """
+    hello -> hello_ack -> сессионный AES ключ (RSA ключом клиента).
+    Возвращает session key или None, если клиент прислал не hello.
+    """
+    hello = recv_msg(conn)
+    if hello.get("type") != "hello":
+        send_msg(conn, {"ok": False, "error": "expected hello"})
+        return None
 
-        schedule = get_backup_schedule()
-        # можно сразу вернуть расчёт next_run_time, чтобы UI видел эффект
-        applied = apply_backup_schedule(schedule) if schedule.get("enabled") else {"enabled": False}
-        # Важно: apply_backup_schedule удалит/создаст job; это ок, но можно и без этого.
-        return {"ok": True, "schedule": {**schedule, **({"next_run_time": applied.get("next_run_time")} if schedule.get("enabled") else {})}}
+    client_pub = pub_from_json(hello["pub"])
+    send_msg(conn, {"ok": True, "type": "hello_ack", "pub": pub_to_json(CRYPTO.pub)})
 
-    if t == "backup_schedule_set":
-        # admin-only
-        if auth_user.role != "admin":
-            return {"ok": False, "error": "forbidden"}
+    session_key = new_session_key()
+    send_session_key(conn, session_key, client_pub, mode=CRYPTO.mode)
+    return session_key
 
-        enabled = bool(req.get("enabled", True))
-        hour = int(req.get("hour", 2))
-        minute = int(req.get("minute", 0))
-        timezone = str(req.get("timezone", "UTC"))
 
-        if hour < 0 or hour > 23 or minute < 0 or minute > 59:
-            return {"ok": False, "error": "invalid time"}
+def _respond(conn: socket.socket, req: Dict[str, Any], session_key: bytes) -> None:
+    """Один запрос persistent-сессии: handle() и ответ в нужном клиенту виде."""
+    try:
+        # все get_conn() внутри handle — на одном соединении, один commit
+        with request_scope():
+            resp = handle(req)
+    except Exception as e:
+        resp = {"ok": False, "error": str(e)}
 
-        # сохраняем в БД
-        schedule = set_backup_schedule(enabled, hour, minute, timezone)
+    # file_get клиент читает как bin-пакет — ошибку тоже заворачиваем в bin
+    if req.get("type") == "file_get" and not resp.get("__bin__"):
+        resp = {"__bin__": True, "header": resp, "bin": b""}
 
-        # применяем сразу в scheduler
-        applied = apply_backup_schedule(schedule) if enabled else {"enabled": False, "next_run_time": None}
+    if isinstance(resp, dict) and resp.get("__bin__"):
+        send_session_bin(conn, resp["header"], resp["bin"], session_key)
+    elif isinstance(resp, dict) and resp.get("__stream__"):
+        send_encrypted_stream(conn, resp["header"], resp["chunks"], session_key)
+    else:
+        send_session(conn, resp, session_key)
 
-        # аудит (если у тебя audit_log подключён)
-        # audit_log("INFO", "backup_schedule_set", user.login, user.role, None, {"enabled": enabled, "hour": hour, "minute": minute, "timezone": timezone})
 
-        return {"ok": True, "schedule": {**schedule, "next_run_time": applied.get("next_run_time")}}
+def _fail_conn(conn: socket.socket, e: Exception, session_key: bytes | None) -> None:
+    err = {"ok": False, "error": str(e)}
+    try:
+        if session_key is not None:
+            send_session(conn, err, session_key)
+        else:
+            send_msg(conn, err)
+    except Exception:
+        pass
+    conn.close()
 
 
+class _Session:
+    """Persistent-соединение в reactor: куда дочитывается текущий кадр."""
 
-    # ===== Files (INLINE MODEL) =====
-    if t == "file_get":
-        table = req.get("table")
-        pk = req.get("pk")
-        base = req.get("base")
-        if not table or not isinstance(pk, dict) or not base:
-            return {"ok": False, "error": "table, dict pk and base are required"}
+    __slots__ = ("conn", "key", "header", "buf", "pos", "in_body")
 
-        out = file_get(table=str(table), pk=pk, base=str(base))
+    def __init__(self, conn: socket.socket, key: bytes) -> None:
+        self.conn = conn
+        self.key = key
+        self.header = bytearray(SESSION_HEADER_LEN)
+        self.expect_header()
 
-        audit_log(
-            "INFO",
-            "file_get",
-            auth_user.login,
-            auth_user.role,
-            str(table),
-            {"table": str(table), "pk": pk, "base": str(base), "original_name": out["meta"].get("original_name")},
-        )
+    def expect_header(self) -> None:
+        self.buf = self.header
+        self.pos = 0
+        self.in_body = False
 
-        return {"__bin__": True, "header": {"ok": True, "meta": out["meta"]}, "bin": out["bytes"]}
 
-    if t == "file_delete":
-        table = req.get("table")
-        pk = req.get("pk")
-        base = req.get("base")
-        if not table or not isinstance(pk, dict) or not base:
-            return {"ok": False, "error": "table, dict pk and base are required"}
+class _Reactor:
+    """
+    Один поток ждёт все persistent-соединения на selectors (epoll на Linux)
+    и дочитывает кадры [len:4][nonce:12][ct] без блокировок; готовый кадр
+    уходит в _REQUEST_POOL. Пока запрос обрабатывается, сокет снят с учёта:
+    ответ пишет воркер (blocking send/sendfile), затем возвращает сессию
+    через add() — порядок запрос/ответ в соединении сохраняется.
+    """
 
-        out = file_delete(table=str(table), pk=pk, base=str(base))
+    def __init__(self) -> None:
+        self.sel = selectors.DefaultSelector()
+        self._pending: List[_Session] = []
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.sel.register(self._wake_r, selectors.EVENT_READ)
+
+    def add(self, s: _Session) -> None:
+        # из любого потока: регистрирует сам reactor, воркер только будит его
+        with self._lock:
+            self._pending.append(s)
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            pass  # reactor и так проснётся — байты уже в канале
+
+    def _drain_pending(self) -> None:
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for s in pending:
+            self.sel.register(s.conn, selectors.EVENT_READ, s)
+
+    def _accept(self, server: socket.socket) -> None:
+        try:
+            conn, _addr = server.accept()
+        except (BlockingIOError, InterruptedError):
+            return  # соединение забрал другой процесс на том же порту (reuse_port)
+        conn.setblocking(True)
+        _tune_conn(conn)
+        # handshake (RSA) — в пуле, reactor не ждёт медленного клиента
+        _REQUEST_POOL.submit(self._handshake, conn)
+
+    def _handshake(self, conn: socket.socket) -> None:
+        try:
+            conn.settimeout(HANDSHAKE_TIMEOUT)
+            session_key = _open_session_channel(conn)
+            conn.settimeout(None)
+        except Exception as e:
+            _fail_conn(conn, e, None)
+            return
+        if session_key is None:
+            conn.close()
+            return
+        self.add(_Session(conn, session_key))
+
+    def _read(self, s: _Session) -> None:
+        try:
+            n = s.conn.recv_into(memoryview(s.buf)[s.pos:], 0, _RECV_FLAGS)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            n = 0
+        if n == 0:
+            self.sel.unregister(s.conn)
+            s.conn.close()
+            return
+
+        s.pos += n
+        if s.pos < len(s.buf):
+            return
+        if not s.in_body:
+            try:
+                length = session_frame_len(s.header, MAX_FRAME)
+            except ValueError:
+                # буфер под заявленную длину не выделяем: пир ещё ничем не подтверждён
+                self.sel.unregister(s.conn)
+                s.conn.close()
+                return
+            s.buf = bytearray(length)
+            s.pos = 0
+            s.in_body = True
+            if s.buf:
+                return
+
+        self.sel.unregister(s.conn)
+        _REQUEST_POOL.submit(self._serve_frame, s, bytes(s.header), s.buf)
+
+    def _serve_frame(self, s: _Session, header: bytes, ct: bytearray) -> None:
+        try:
+            # ответ пишется blocking send — но не дольше SEND_TIMEOUT
+            s.conn.settimeout(SEND_TIMEOUT)
+            req = decode_session_frame(header, ct, s.key)
+            _respond(s.conn, req, s.key)
+            # reactor читает с MSG_DONTWAIT: с таймаутом Python ждал бы данных в poll
+            s.conn.settimeout(None)
+        except Exception as e:
+            _fail_conn(s.conn, e, s.key)
+            return
+        s.expect_header()
+        self.add(s)
+
+    def run(self, server: socket.socket) -> None:
+        server.setblocking(False)
+        self.sel.register(server, selectors.EVENT_READ)
+        while True:
+            for key, _events in self.sel.select():
+                if key.fileobj is server:
+                    self._accept(server)
+                elif key.fileobj is self._wake_r:
+                    self._drain_pending()
+                else:
+                    self._read(key.data)
 
-        audit_log(
-            "INFO",
-            "file_delete",
-            auth_user.login,
-            auth_user.role,
-            str(table),
-            {"table": str(table), "pk": pk, "base": str(base), "deleted": out.get("deleted")},
-        )
 
-        return {"ok": True, "data": out}
+def _listen(port: int) -> socket.socket:
+    server = socket.create_server((HOST, port), reuse_port=True)
+    # принятые соединения наследуют буферы слушающего сокета (и window scale из SYN)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCK_BUF)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCK_BUF)
+    return server
 
-    return {"ok": False, "error": f"unknown type: {t}"}
 
+def _tune_conn(conn: socket.socket, quickack: bool = False) -> None:
+    # мелкие запрос/ответ (ping, select) не ждут Nagle/delayed ACK
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if quickack and hasattr(socket, "TCP_QUICKACK"):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
 
 
 def serve() -> None:
-    with socket.create_server((HOST, PORT), reuse_port=True) as server:
+    with _listen(PORT) as server:
         print(f"Secure socket server listening on {HOST}:{PORT} mode={CRYPTO.mode}")
-        while True:
-            conn, _addr = server.accept()
-            with conn:
-                client_pub = None
-                try:
-                    hello = recv_msg(conn)
-                    if hello.get("type") != "hello":
-                        send_msg(conn, {"ok": False, "error": "expected hello"})
-                        continue
+        # соединения долгоживущие: ждут все в одном reactor, поток занят только запросом
+        _Reactor().run(server)
 
-                    client_pub = pub_from_json(hello["pub"])
-                    send_msg(conn, {"ok": True, "type": "hello_ack", "pub": pub_to_json(CRYPTO.pub)})
 
-                    req = recv_encrypted(conn, CRYPTO.priv, mode=CRYPTO.mode)
-                    resp = handle(req)
+def _serve_upload_conn(conn: socket.socket) -> None:
+    """Одно upload-соединение: handshake, поток, ответ (см. serve_upload)."""
+    with conn:
+        session_key = None
+        try:
+            # клиент без hello/заголовка не держит воркер дольше HANDSHAKE_TIMEOUT
+            conn.settimeout(HANDSHAKE_TIMEOUT)
+            session_key = _open_session_channel(conn)
+            if session_key is None:
+                return
+
+            # сначала заголовок: токен и заявленный размер проверяем до чтения тела
+            header = recv_session(conn, session_key, MAX_FRAME)
+            htype = header.get("type")
+
+            token = header.get("token")
+            auth_user = verify_token(token)
+
+            size = header.get("size")
+            if not isinstance(size, int) or size < 0 or size > MAX_UPLOAD_SIZE:
+                send_session(conn, {"ok": False, "error": f"size must be 0..{MAX_UPLOAD_SIZE}"}, session_key)
+                return
+            conn.settimeout(UPLOAD_IO_TIMEOUT)
+            data = recv_stream_body(conn, session_key, size)
+
+            # ===== Existing-row attach/replace =====
+            if htype == "file_attach":
+                table = header.get("table")
+                pk = header.get("pk")
+                base = header.get("base")
+                original_name = header.get("original_name")
+                mime_type = header.get("mime_type")
+
+                if not table or not isinstance(pk, dict) or not base or not original_name:
+                    send_session(
+                        conn,
+                        {"ok": False, "error": "table, dict pk, base and original_name are required"},
+                        session_key,
+                    )
+                    return
+
+                audit_log(
+                    "INFO",
+                    "file_attach",
+                    auth_user.login,
+                    auth_user.role,
+                    str(table),
+                    {
+                        "table": str(table),
+                        "pk": pk,
+                        "base": str(base),
+                        "original_name": str(original_name),
+                        "mime_type": mime_type,
+                        "size_bytes": len(data),
+                    },
+                )
+
+                file_attach(
+                    table=str(table),
+                    pk=pk,
+                    base=str(base),
+                    original_name=str(original_name),
+                    mime_type=mime_type,
+                    content_bytes=data,
+                )
+
+                send_session(conn, {"ok": True}, session_key)
+                return
+
+            # ===== New-row insert with required files =====
+            if htype == "insert_with_files":
+                table = header.get("table")
+                values = header.get("values")
+                files = header.get("files")  # list[{base, original_name, mime_type}]
+                if not table or not isinstance(values, dict) or not isinstance(files, list):
+                    send_session(
+                        conn,
+                        {"ok": False, "error": "table, dict values and list files are required"},
+                        session_key,
+                    )
+                    return
+
+                blobs = _unpack_multi_files(data)
+                if len(blobs) != len(files):
+                    send_session(
+                        conn,
+                        {"ok": False, "error": "files count mismatch"},
+                        session_key,
+                    )
+                    return
+
+                # prepare inline values for each file (write FS / base64 / bytes)
+                created_paths: List[str] = []
+                try:
+                    meta = cached_table_meta(str(table))
+                    _apply_inline_files(meta, files, blobs, values, created_paths)
+
+                    out = insert_row(str(table), values)
+
+                    audit_log(
+                        "INFO",
+                        "insert_with_files",
+                        auth_user.login,
+                        auth_user.role,
+                        str(table),
+                        {
+                            "table": str(table),
+                            "values_keys": sorted(list(values.keys())),
+                            "files": [{"base": f.get("base"), "original_name": f.get("original_name")} for f in files],
+                            "row": out.get("row"),
+                        },
+                    )
+
+                    send_session(conn, {"ok": True, "data": out}, session_key)
 
-                    if isinstance(resp, dict) and resp.get("__bin__"):
-                        send_encrypted_bin(conn, resp["header"], resp["bin"], client_pub, mode=CRYPTO.mode)
-                    else:
-                        send_encrypted(conn, resp, client_pub, mode=CRYPTO.mode)
+                except Exception as e:
+                    # cleanup created fs files if insert failed
+                    from pathlib import Path
+                    for p in created_paths:
+                        Path(p).unlink(missing_ok=True)
+                    send_session(conn, {"ok": False, "error": str(e)}, session_key)
+
+                return
+
+            # ===== Existing-row update + file replace in one request =====
+            if htype == "update_with_files":
+                table = header.get("table")
+                pk = header.get("pk")
+                values = header.get("values")
+                files = header.get("files")  # list[{base, original_name, mime_type}]
+                if not table or not isinstance(pk, dict) or not isinstance(values, dict) or not isinstance(files, list):
+                    send_session(
+                        conn,
+                        {"ok": False, "error": "table, dict pk, dict values and list files are required"},
+                        session_key,
+                    )
+                    return
+
+                blobs = _unpack_multi_files(data)
+                if len(blobs) != len(files):
+                    send_session(
+                        conn,
+                        {"ok": False, "error": "files count mismatch"},
+                        session_key,
+                    )
+                    return
+
+                created_paths = []
+                try:
+                    meta = cached_table_meta(str(table))
+                    with request_scope():
+                        old_paths = stored_fs_paths(meta, str(table), pk, [str(f.get("base") or "") for f in files])
+                        _apply_inline_files(meta, files, blobs, values, created_paths)
+
+                        # поля и файлы — одним UPDATE (одна транзакция)
+                        out = update_row_by_pk(str(table), pk, values)
+                        if not out.get("row"):
+                            raise ValueError("row not found")
+
+                    audit_log(
+                        "INFO",
+                        "update_with_files",
+                        auth_user.login,
+                        auth_user.role,
+                        str(table),
+                        {
+                            "table": str(table),
+                            "pk": pk,
+                            "values_keys": sorted(list(values.keys())),
+                            "files": [{"base": f.get("base"), "original_name": f.get("original_name")} for f in files],
+                        },
+                    )
+
+                    # старые fs-файлы больше не нужны
+                    from pathlib import Path
+                    for p in old_paths:
+                        if p not in created_paths:
+                            Path(p).unlink(missing_ok=True)
+
+                    send_session(conn, {"ok": True, "data": out}, session_key)
 
                 except Exception as e:
-                    err = {"ok": False, "error": str(e)}
-                    try:
-                        if client_pub is not None:
-                            send_encrypted(conn, err, client_pub, mode=CRYPTO.mode)
-                        else:
-                            send_msg(conn, err)
-                    except Exception:
-                        pass
+                    from pathlib import Path
+                    for p in created_paths:
+                        Path(p).unlink(missing_ok=True)
+                    send_session(conn, {"ok": False, "error": str(e)}, session_key)
+
+                return
+
+            send_session(conn, {"ok": False, "error": f"unknown upload type: {htype}"}, session_key)
+
+        except socket.timeout:
+            return  # клиент молчит — отвечать некому
+        except Exception as e:
+            err = {"ok": False, "error": str(e)}
+            try:
+                if session_key is not None:
+                    send_session(conn, err, session_key)
+                else:
+                    send_msg(conn, err)
+            except Exception:
+                pass
 
 
 def serve_upload() -> None:
     """
-    Upload server принимает encrypted bin request:
+    Upload server: hello -> session key -> encrypted stream (header + тело кусками).
     1) file_attach (existing row):
        header: {type:"file_attach", table, pk:{...}, base:"...", original_name, mime_type, token}
        data: bytes
@@ -394,163 +980,33 @@ def serve_upload() -> None:
        header: {type:"insert_with_files", table, values:{...}, files:[{base, original_name, mime_type}], token}
        data: multi-files framed blob (see _unpack_multi_files)
 
+    3) update_with_files (existing row: fields + file replace in one UPDATE):
+       header: {type:"update_with_files", table, pk:{...}, values:{...}, files:[...], token}
+       data: multi-files framed blob (see _unpack_multi_files)
+
+    В header клиент кладёт "size" — общий размер тела (не больше MAX_UPLOAD_SIZE);
+    токен и size проверяются до чтения тела.
+
     Ответ: {ok:true, data:{...}}
     """
-    with socket.create_server((HOST, UPLOAD_PORT), reuse_port=True) as server:
+    with _listen(UPLOAD_PORT) as server:
         print(f"Secure upload server listening on {HOST}:{UPLOAD_PORT} mode={CRYPTO.mode}")
         while True:
-            conn, _addr = server.accept()
-            with conn:
-                client_pub = None
-                try:
-                    hello = recv_msg(conn)
-                    if hello.get("type") != "hello":
-                        send_msg(conn, {"ok": False, "error": "expected hello"})
-                        continue
-
-                    client_pub = pub_from_json(hello["pub"])
-                    send_msg(conn, {"ok": True, "type": "hello_ack", "pub": pub_to_json(CRYPTO.pub)})
-
-                    header, data = recv_encrypted_bin(conn, CRYPTO.priv, mode=CRYPTO.mode)
-                    htype = header.get("type")
-
-                    token = header.get("token")
-                    auth_user = verify_token(token)
-
-                    # ===== Existing-row attach/replace =====
-                    if htype == "file_attach":
-                        table = header.get("table")
-                        pk = header.get("pk")
-                        base = header.get("base")
-                        original_name = header.get("original_name")
-                        mime_type = header.get("mime_type")
-
-                        if not table or not isinstance(pk, dict) or not base or not original_name:
-                            send_encrypted(
-                                conn,
-                                {"ok": False, "error": "table, dict pk, base and original_name are required"},
-                                client_pub,
-                                mode=CRYPTO.mode,
-                            )
-                            continue
-
-                        audit_log(
-                            "INFO",
-                            "file_attach",
-                            auth_user.login,
-                            auth_user.role,
-                            str(table),
-                            {
-                                "table": str(table),
-                                "pk": pk,
-                                "base": str(base),
-                                "original_name": str(original_name),
-                                "mime_type": mime_type,
-                                "size_bytes": len(data),
-                            },
-                        )
-
-                        file_attach(
-                            table=str(table),
-                            pk=pk,
-                            base=str(base),
-                            original_name=str(original_name),
-                            mime_type=mime_type,
-                            content_bytes=data,
-                        )
-
-                        send_encrypted(conn, {"ok": True}, client_pub, mode=CRYPTO.mode)
-                        continue
-
-                    # ===== New-row insert with required files =====
-                    if htype == "insert_with_files":
-                        table = header.get("table")
-                        values = header.get("values")
-                        files = header.get("files")  # list[{base, original_name, mime_type}]
-                        if not table or not isinstance(values, dict) or not isinstance(files, list):
-                            send_encrypted(
-                                conn,
-                                {"ok": False, "error": "table, dict values and list files are required"},
-                                client_pub,
-                                mode=CRYPTO.mode,
-                            )
-                            continue
-
-                        blobs = _unpack_multi_files(data)
-                        if len(blobs) != len(files):
-                            send_encrypted(
-                                conn,
-                                {"ok": False, "error": "files count mismatch"},
-                                client_pub,
-                                mode=CRYPTO.mode,
-                            )
-                            continue
-
-                        # prepare inline values for each file (write FS / base64 / bytes)
-                        created_paths: List[str] = []
-                        try:
-                            meta = table_meta(str(table))
-                            for desc, b in zip(files, blobs):
-                                base = str(desc.get("base") or "")
-                                original_name = str(desc.get("original_name") or "")
-                                mime_type = desc.get("mime_type")
-                                if not base or not original_name:
-                                    raise ValueError("bad file descriptor")
-
-                                name_col, data_col, stored_value, created_path = prepare_inline_file_value(
-                                    meta=meta,
-                                    base=base,
-                                    original_name=original_name,
-                                    mime_type=mime_type,
-                                    content_bytes=b,
-                                )
-                                values[name_col] = original_name
-                                values[data_col] = stored_value
-                                if created_path:
-                                    created_paths.append(created_path)
-
-                            out = insert_row(str(table), values)
-
-                            audit_log(
-                                "INFO",
-                                "insert_with_files",
-                                auth_user.login,
-                                auth_user.role,
-                                str(table),
-                                {
-                                    "table": str(table),
-                                    "values_keys": sorted(list(values.keys())),
-                                    "files": [{"base": f.get("base"), "original_name": f.get("original_name")} for f in files],
-                                    "row": out.get("row"),
-                                },
-                            )
-
-                            send_encrypted(conn, {"ok": True, "data": out}, client_pub, mode=CRYPTO.mode)
-
-                        except Exception as e:
-                            # cleanup created fs files if insert failed
-                            from pathlib import Path
-                            for p in created_paths:
-                                Path(p).unlink(missing_ok=True)
-                            send_encrypted(conn, {"ok": False, "error": str(e)}, client_pub, mode=CRYPTO.mode)
-
-                        continue
-
-                    send_encrypted(conn, {"ok": False, "error": f"unknown upload type: {htype}"}, client_pub, mode=CRYPTO.mode)
-
-                except Exception as e:
-                    err = {"ok": False, "error": str(e)}
-                    try:
-                        if client_pub is not None:
-                            send_encrypted(conn, err, client_pub, mode=CRYPTO.mode)
-                        else:
-                            send_msg(conn, err)
-                    except Exception:
-                        pass
+            _UPLOAD_SLOTS.acquire()
+            try:
+                conn, _addr = server.accept()
+                _tune_conn(conn, quickack=True)
+                _UPLOAD_POOL.submit(_serve_upload_conn, conn).add_done_callback(
+                    lambda _f: _UPLOAD_SLOTS.release()
+                )
+            except BaseException:
+                _UPLOAD_SLOTS.release()
+                raise
 
 
 if __name__ == "__main__":
-    import threading
+    init_db_pool()  # прогрев пула до первого клиента
+    ensure_file_columns_table()
 
     t = threading.Thread(target=serve_upload, daemon=True)
     t.start()
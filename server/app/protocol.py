@@ -1,28 +1,82 @@
+import io
 import socket
 import struct
-from typing import Any, Dict
+from typing import Any, BinaryIO, Dict, List, Union
 
-import orjson
+import msgspec
+
+# hello/hello_ack и ошибки до сессии — тем же msgpack, что и сессионные кадры
+_ENC = msgspec.msgpack.Encoder()
+_DEC = msgspec.msgpack.Decoder()
+
+
+_HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+
+def send_parts(conn: socket.socket, parts: List[Any]) -> None:
+    """
+    Отправка кадра из нескольких буферов одним sendmsg (writev) —
+    без склейки header + ct в новый bytes (для больших файлов это лишняя копия).
+    """
+    if not _HAS_SENDMSG:
+        for p in parts:
+            conn.sendall(memoryview(p))
+        return
+
+    views = [memoryview(p) for p in parts if len(p)]
+    while views:
+        sent = conn.sendmsg(views)
+        # sendmsg может отправить не всё — сдвигаемся по буферам
+        while sent:
+            n = views[0].nbytes
+            if sent >= n:
+                sent -= n
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
 
 
 def send_msg(conn: socket.socket, obj: Dict[str, Any]) -> None:
-    payload = orjson.dumps(obj)
+    payload = _ENC.encode(obj)
     header = struct.pack(">I", len(payload))  # 4 bytes big-endian length
-    conn.sendall(header + payload)
+    send_parts(conn, [header, payload])
 
 
-def recv_exact(conn: socket.socket, n: int) -> bytes:
-    data = b""
-    while len(data) < n:
-        chunk = conn.recv(n - len(data))
-        if not chunk:
-            raise ConnectionError("socket closed")
-        data += chunk
+def recv_exact_buffered(rf: BinaryIO, n: int) -> bytes:
+    # BufferedReader сам добирает до n байт, один recv покрывает несколько мелких read
+    data = rf.read(n)
+    if len(data) != n:
+        raise ConnectionError("socket closed")
     return data
 
 
-def recv_msg(conn: socket.socket) -> Dict[str, Any]:
+def recv_exact(conn: Union[socket.socket, BinaryIO], n: int) -> Union[bytes, bytearray]:
+    if isinstance(conn, io.BufferedIOBase):
+        return recv_exact_buffered(conn, n)
+
+    # обычно всё приходит одним recv — тогда это и есть результат
+    first = conn.recv(n)
+    if len(first) == n:
+        return first
+    if not first:
+        raise ConnectionError("socket closed")
+
+    # остальное — recv_into в заранее выделенный буфер, без склеек bytes
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = len(first)
+    view[:pos] = first
+    while pos < n:
+        got = conn.recv_into(view[pos:])
+        if not got:
+            raise ConnectionError("socket closed")
+        pos += got
+    return buf
+
+
+def recv_msg(conn: Union[socket.socket, BinaryIO]) -> Dict[str, Any]:
     header = recv_exact(conn, 4)
     (length,) = struct.unpack(">I", header)
     payload = recv_exact(conn, length)
-    return orjson.loads(payload)
\ No newline at end of file
+    return _DEC.decode(payload)
\ No newline at end of file
@@ -1,33 +1,58 @@
 from __future__ import annotations
 
+import functools
 import secrets
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import gmpy2  # GMP mpz_powm: заметно быстрее pow() на 512–2048 бит
+except ImportError:  # без GMP — обычный pow(), результат тот же
+    gmpy2 = None
 
 # ===== Math utils =====
 
-def egcd(a: int, b: int) -> Tuple[int, int, int]:
-    if b == 0:
-        return a, 1, 0
-    g, x, y = egcd(b, a % b)
-    return g, y, x - (a // b) * y
+def _mpz(x: int) -> Any:
+    return gmpy2.mpz(x) if gmpy2 is not None else x
 
-def modinv(a: int, m: int) -> int:
-    g, x, _ = egcd(a, m)
-    if g != 1:
-        raise ValueError("No modular inverse")
-    return x % m
+def _powmod(b: int, e: Any, m: Any) -> int:
+    if gmpy2 is not None:
+        return int(gmpy2.powmod(b, e, m))
+    return pow(b, e, m)
 
-def is_probable_prime(n: int, k: int = 20) -> bool:
-    if n < 2:
-        return False
-    small_primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37]
-    for p in small_primes:
-        if n == p:
-            return True
-        if n % p == 0:
-            return False
+def egcd(a: int, b: int) -> Tuple[int, int, int]:
+    x0, x1, y0, y1 = 1, 0, 0, 1
+    while b:
+        q, a, b = a // b, b, a % b
+        x0, x1 = x1, x0 - q * x1
+        y0, y1 = y1, y0 - q * y1
+    return a, x0, y0
 
+def modinv(a: int, m: int) -> int:
+    # pow(a, -1, m) — тот же расширенный Евклид, но целиком в C
+    try:
+        return pow(a, -1, m)
+    except ValueError:
+        raise ValueError("No modular inverse") from None
+
+def _sieve(limit: int) -> List[int]:
+    flags = bytearray([1]) * limit
+    flags[0:2] = b"\x00\x00"
+    for i in range(2, int(limit ** 0.5) + 1):
+        if flags[i]:
+            flags[i * i::i] = bytes(len(range(i * i, limit, i)))
+    return [i for i in range(limit) if flags[i]]
+
+# пробное деление перед Миллером–Рабином: простые < 2000 отсеивают
+# большую часть составных кандидатов без единого pow()
+_SMALL_PRIMES = _sieve(2000)
+_ODD_PRIMES = _SMALL_PRIMES[1:]
+# сколько нечётных кандидатов подряд просеиваем от одной случайной точки
+_SIEVE_SPAN = 1 << 12
+
+def _miller_rabin(n: int, k: int) -> bool:
+    if gmpy2 is not None:
+        return bool(gmpy2.is_prime(n, k))
     d = n - 1
     s = 0
     while d % 2 == 0:
@@ -50,25 +75,79 @@ def is_probable_prime(n: int, k: int = 20) -> bool:
             return False
     return True
 
+def is_probable_prime(n: int, k: int = 20) -> bool:
+    if n < 2:
+        return False
+    for p in _SMALL_PRIMES:
+        if n == p:
+            return True
+        if n % p == 0:
+            return False
+    return _miller_rabin(n, k)
+
 def gen_prime(bits: int) -> int:
     if bits < 16:
         raise ValueError("bits too small")
+    top = 1 << bits
     while True:
         x = secrets.randbits(bits) | (1 << (bits - 1)) | 1
-        if is_probable_prime(x):
-            return x
+        # остатки x по малым простым считаем один раз; для x + delta
+        # остаток — (r + delta) % p на маленьких int, без деления большого числа
+        residues = [x % p for p in _ODD_PRIMES]
+        for delta in range(0, _SIEVE_SPAN, 2):
+            n = x + delta
+            if n >= top:
+                break
+            for r, p in zip(residues, _ODD_PRIMES):
+                if (r + delta) % p == 0:
+                    break
+            else:
+                if _miller_rabin(n, 20):
+                    return n
 
 # ===== RSA keys =====
 
+# На ключе кэшируем то, что иначе пересчитывается на каждый encrypt/decrypt:
+# размер блока k в байтах и (экспонента, модуль) уже в виде mpz для GMP.
+
 @dataclass(frozen=True)
 class PublicKey:
     n: int
     e: int
 
+    @functools.cached_property
+    def size(self) -> int:
+        return _mod_bytes(self.n)
+
+    @functools.cached_property
+    def powmod_args(self) -> Tuple[Any, Any]:
+        return _mpz(self.e), _mpz(self.n)
+
 @dataclass(frozen=True)
 class PrivateKey:
     n: int
     d: int
+    # множители n для CRT; 0 — неизвестны (старый кэш ключа), расшифровка через d mod n
+    p: int = 0
+    q: int = 0
+
+    @functools.cached_property
+    def size(self) -> int:
+        return _mod_bytes(self.n)
+
+    @functools.cached_property
+    def powmod_args(self) -> Tuple[Any, Any]:
+        return _mpz(self.d), _mpz(self.n)
+
+    @functools.cached_property
+    def crt(self) -> Optional[Tuple[Any, Any, Any, Any, Any]]:
+        """(p, q, dp, dq, qinv) — две полуразмерные экспоненты вместо одной полной."""
+        p, q = self.p, self.q
+        if not p or not q or p * q != self.n:
+            return None
+        dp = self.d % (p - 1)
+        dq = self.d % (q - 1)
+        return _mpz(p), _mpz(q), _mpz(dp), _mpz(dq), modinv(q, p)
 
 def generate_keypair(bits: int = 512, e: int = 65537) -> Tuple[PublicKey, PrivateKey]:
     half = bits // 2
@@ -82,17 +161,25 @@ def generate_keypair(bits: int = 512, e: int = 65537) -> Tuple[PublicKey, Privat
         if phi % e == 0:
             continue
         d = modinv(e, phi)
-        return PublicKey(n=n, e=e), PrivateKey(n=n, d=d)
+        return PublicKey(n=n, e=e), PrivateKey(n=n, d=d, p=p, q=q)
 
 def rsa_encrypt_int(m: int, pub: PublicKey) -> int:
     if m < 0 or m >= pub.n:
         raise ValueError("m out of range")
-    return pow(m, pub.e, pub.n)
+    return _powmod(m, *pub.powmod_args)
 
 def rsa_decrypt_int(c: int, priv: PrivateKey) -> int:
     if c < 0 or c >= priv.n:
         raise ValueError("c out of range")
-    return pow(c, priv.d, priv.n)
+    crt = priv.crt
+    if crt is None:
+        return _powmod(c, *priv.powmod_args)
+    # RSA-CRT: modexp ~ куб длины, две половинные ~ в 4 раза дешевле одной полной
+    p, q, dp, dq, qinv = crt
+    m1 = _powmod(c, dp, p)
+    m2 = _powmod(c, dq, q)
+    h = (qinv * (m1 - m2)) % p
+    return int(m2 + h * q)
 
 # ===== Block modes (4 variants) =====
 # Мы делаем plaintext-блоки фиксированной длины (k-1) и кодируем длину внутри блока.
@@ -102,7 +189,7 @@ def _mod_bytes(n: int) -> int:
     return (n.bit_length() + 7) // 8
 
 def encrypt_bytes(data: bytes, pub: PublicKey, mode: str = "rand_len") -> bytes:
-    k = _mod_bytes(pub.n)      # cipher block size (bytes)
+    k = pub.size               # cipher block size (bytes)
     plain_block = k - 1        # plaintext block size in bytes (strictly < n)
 
     if plain_block < 8:
@@ -110,95 +197,114 @@ def encrypt_bytes(data: bytes, pub: PublicKey, mode: str = "rand_len") -> bytes:
 
     if mode in ("raw_fixed", "raw_len"):
         # layout: [len:2][payload...(plain_block-2)][pad...]
-        payload_cap = plain_block - 2
+        hdr = 2
         rand = False
     elif mode in ("rand_fixed", "rand_len"):
         # layout: [len:2][rand:1][payload...(plain_block-3)][pad...]
-        payload_cap = plain_block - 3
+        hdr = 3
         rand = True
     else:
         raise ValueError("bad mode")
+    payload_cap = plain_block - hdr
 
-    out = bytearray()
-    i = 0
-    while i < len(data):
-        chunk = data[i:i + payload_cap]
-        i += len(chunk)
+    fixed = mode in ("raw_fixed", "rand_fixed")
 
+    # 1) plaintext-блоки -> int; вход режем через memoryview, блок — один буфер
+    src = memoryview(data)
+    block = bytearray(plain_block)
+    ms: List[int] = []
+    for i in range(0, len(src), payload_cap):
+        chunk = src[i:i + payload_cap]
         L = len(chunk)
-        if L > payload_cap:
-            raise ValueError("internal chunk overflow")
 
+        block[0:2] = L.to_bytes(2, "big")
         if rand:
-            r = secrets.randbelow(255) + 1  # 1..255 (не 0!)
-            block = L.to_bytes(2, "big") + bytes([r]) + chunk
-        else:
-            block = L.to_bytes(2, "big") + chunk
-
-        # pad to full plaintext block size
-        if len(block) < plain_block:
-            block += b"\x00" * (plain_block - len(block))
-
-        m = int.from_bytes(block, "big")
-        c = rsa_encrypt_int(m, pub)
-        # минимальное количество байт для хранения c
-        clen = max(1, (c.bit_length() + 7) // 8)
-        cbytes = c.to_bytes(clen, "big")
-
-        if mode in ("raw_fixed", "rand_fixed"):
+            block[2] = secrets.randbelow(255) + 1  # 1..255 (не 0!)
+        block[hdr:hdr + L] = chunk
+        if L < payload_cap:
+            # pad to full plaintext block size (только последний блок)
+            block[hdr + L:] = bytes(payload_cap - L)
+
+        # m < n гарантировано: блок на байт короче модуля
+        ms.append(int.from_bytes(block, "big"))
+
+    # 2) modexp
+    e, n = pub.powmod_args
+    cs = [_powmod(m, e, n) for m in ms]
+
+    # 3) выход сразу итогового (для *_len — максимального) размера
+    out = bytearray(len(ms) * (k if fixed else k + 2))
+    pos = 0
+    for c in cs:
+        if fixed:
             # fixed требует k байт
-            out += c.to_bytes(k, "big")
+            out[pos:pos + k] = c.to_bytes(k, "big")
+            pos += k
         else:
-            out += len(cbytes).to_bytes(2, "big") + cbytes
+            # минимальное количество байт для хранения c
+            clen = max(1, (c.bit_length() + 7) // 8)
+            out[pos:pos + 2] = clen.to_bytes(2, "big")
+            out[pos + 2:pos + 2 + clen] = c.to_bytes(clen, "big")
+            pos += 2 + clen
 
+    del out[pos:]
     return bytes(out)
 
+def _iter_len_blocks(src: memoryview) -> Iterator[int]:
+    # layout *_len: [len(c):2][c] ...
+    pos = 0
+    while pos < len(src):
+        if pos + 2 > len(src):
+            raise ValueError("bad cipher format")
+        blen = int.from_bytes(src[pos:pos + 2], "big")
+        pos += 2
+        if pos + blen > len(src):
+            raise ValueError("bad cipher format")
+        yield int.from_bytes(src[pos:pos + blen], "big")
+        pos += blen
+
 def decrypt_bytes(data: bytes, priv: PrivateKey, mode: str = "rand_len") -> bytes:
-    k = _mod_bytes(priv.n)
+    k = priv.size
     plain_block = k - 1
 
+    if mode in ("rand_fixed", "rand_len"):
+        # p[2] — случайный байт, игнорируем
+        start = 3
+    elif mode in ("raw_fixed", "raw_len"):
+        start = 2
+    else:
+        raise ValueError("bad mode")
+    cap = plain_block - start
+
+    # блоки шифротекста -> int прямо по смещениям в memoryview: ни копий
+    # блоков, ни промежуточного списка — int рождается, когда до него дошёл modexp
+    src = memoryview(data)
     if mode in ("raw_fixed", "rand_fixed"):
-        if len(data) % k != 0:
+        if len(src) % k != 0:
             raise ValueError("cipher length not aligned")
-        blocks = [data[i:i + k] for i in range(0, len(data), k)]
-    elif mode in ("raw_len", "rand_len"):
-        blocks = []
-        pos = 0
-        while pos < len(data):
-            if pos + 2 > len(data):
-                raise ValueError("bad cipher format")
-            blen = int.from_bytes(data[pos:pos + 2], "big")
-            pos += 2
-            if pos + blen > len(data):
-                raise ValueError("bad cipher format")
-            blocks.append(data[pos:pos + blen])
-            pos += blen
+        count = len(src) // k
+        cs: Iterable[int] = (int.from_bytes(src[i:i + k], "big") for i in range(0, len(src), k))
     else:
-        raise ValueError("bad mode")
+        # блоки *_len не длиннее k (+2 байта длины) — оценка снизу
+        count = len(src) // (k + 2)
+        cs = _iter_len_blocks(src)
 
-    out = bytearray()
+    # под оценку; если блоков больше — срез за концом просто дописывает
+    out = bytearray(count * cap)
+    o = 0
 
-    for b in blocks:
-        c = int.from_bytes(b, "big")
+    for c in cs:
         m = rsa_decrypt_int(c, priv)
-
         # ВАЖНО: восстанавливаем plaintext блок фиксированной длины (plain_block),
         # чтобы не терять ведущие нули
         p = m.to_bytes(plain_block, "big")
 
         L = int.from_bytes(p[0:2], "big")
-
-        if mode in ("rand_fixed", "rand_len"):
-            # p[2] — случайный байт, игнорируем
-            start = 3
-            cap = plain_block - 3
-        else:
-            start = 2
-            cap = plain_block - 2
-
         if L < 0 or L > cap:
             raise ValueError("bad plaintext length")
 
-        out += p[start:start + L]
+        out[o:o + L] = memoryview(p)[start:start + L]
+        o += L
 
+    del out[o:]
     return bytes(out)
@@ -26,6 +26,11 @@ def start_scheduler() -> BackgroundScheduler:
     return sched
 
 
+def _backup_job() -> None:
+    # Будет видно в аудите как system/admin
+    create_backup(user_login="system", user_role="admin")
+
+
 def apply_backup_schedule(schedule: dict) -> dict:
     """
     schedule:
@@ -36,18 +41,15 @@ def apply_backup_schedule(schedule: dict) -> dict:
         "timezone": "UTC" / "Europe/Helsinki" / ...
       }
 
-    Пересоздаёт job daily_backup под новое расписание.
+    Переставляет job daily_backup на новое расписание (создаёт, если её ещё нет).
     """
     sched = start_scheduler()
-
-    # Удаляем старую job, если была
-    try:
-        sched.remove_job(JOB_ID)
-    except Exception:
-        pass
+    job = sched.get_job(JOB_ID)
 
     enabled = bool(schedule.get("enabled", True))
     if not enabled:
+        if job is not None:
+            sched.remove_job(JOB_ID)
         return {"enabled": False, "next_run_time": None}
 
     hour = int(schedule.get("hour", 2))
@@ -60,13 +62,11 @@ def apply_backup_schedule(schedule: dict) -> dict:
 
     trigger = CronTrigger(hour=hour, minute=minute, timezone=tz)
 
-    def _job():
-        # Будет видно в аудите как system/admin
-        create_backup(user_login="system", user_role="admin")
-
-    sched.add_job(_job, trigger=trigger, id=JOB_ID, replace_existing=True)
-
-    job = sched.get_job(JOB_ID)
+    # job меняем на месте: без окна между remove и add, в которое она могла сработать
+    if job is not None:
+        job = sched.reschedule_job(JOB_ID, trigger=trigger)
+    else:
+        job = sched.add_job(_backup_job, trigger=trigger, id=JOB_ID, replace_existing=True)
     return {
         "enabled": True,
         "hour": hour,
@@ -1,8 +1,15 @@
 # server/app/schema_introspect.py
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, List, Optional, Set
+import itertools
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+from psycopg2.extras import execute_values
+
 from app.db import get_conn
 
 # Таблицы, которые считаем служебными для приложения и не показываем в UI
@@ -10,130 +17,381 @@ DEFAULT_EXCLUDE: Set[str] = {
     "users",
     "audit_log",
     "app_settings",
+    "app_file_columns",
 }
 
+# Схема меняется редко (create_table, restore) — метаданные кэшируются на
+# META_TTL секунд; эти пути сбрасывают кэш сами (invalidate_schema_cache),
+# TTL — страховка от DDL в обход сервера.
+META_TTL = 60.0
+# tables_meta на столько таблиц и больше читается server-side курсором
+# пачками по META_ITERSIZE строк (тысячи таблиц — сотни тысяч строк)
+META_STREAM_TABLES = 200
+META_ITERSIZE = 2000
+# имена таблиц приходят от клиента: кэшируются только существующие,
+# и не больше META_CACHE_MAX записей
+META_CACHE_MAX = 1024
+_META_CACHE: Dict[Tuple[str, str], Tuple[Dict[str, Any], float]] = {}
+_TABLES_CACHE: Dict[Tuple[str, frozenset], Tuple[List[str], float]] = {}
+_CACHE_LOCK = threading.Lock()
+# растёт при каждом сбросе: загрузка, начатая до сброса, в кэш не попадает
+_cache_gen = 0
+
+
+# Разобранные file-метаданные колонок (источник — COMMENT на <base>_data).
+# Тот же DDL, что в docker/init.sql: тома, созданные до появления таблицы,
+# получают её при старте сервера.
+_FILE_COLUMNS_DDL = """
+    CREATE TABLE IF NOT EXISTS app_file_columns (
+        schema_name  TEXT    NOT NULL,
+        table_name   TEXT    NOT NULL,
+        base         TEXT    NOT NULL,
+        name_column  TEXT    NOT NULL,
+        data_column  TEXT    NOT NULL,
+        storage_mode TEXT    NOT NULL,
+        required     BOOLEAN NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (schema_name, table_name, data_column)
+    );
+"""
+
+
+def ensure_file_columns_table() -> None:
+    with get_conn(own=True) as conn, conn.cursor() as cur:
+        cur.execute(_FILE_COLUMNS_DDL)
+
+
 def list_tables(schema: str = "public", exclude: Optional[Set[str]] = None) -> List[str]:
     ex = set(DEFAULT_EXCLUDE)
     if exclude:
         ex |= set(exclude)
 
+    # одна строка с готовым text[] — psycopg2 отдаёт его списком, без цикла по строкам;
+    # "служебные" таблицы приложения отсекаются там же.
+    # Прямо по pg_catalog, как и table_meta: BASE TABLE — relkind r/p, видимость —
+    # то же условие прав, что у information_schema.tables (но без её слоёв view)
     sql = """
-        SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema = %s
-          AND table_type = 'BASE TABLE'
-        ORDER BY table_name;
+        SELECT coalesce(array_agg(c.relname::text ORDER BY c.relname), '{}')
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s
+          AND c.relkind IN ('r', 'p')
+          AND c.relname::text <> ALL(%s::text[])
+          AND (
+              pg_catalog.pg_has_role(c.relowner, 'USAGE')
+              OR pg_catalog.has_table_privilege(c.oid, 'SELECT, INSERT, UPDATE, DELETE, TRUNCATE, REFERENCES, TRIGGER')
+              OR pg_catalog.has_any_column_privilege(c.oid, 'SELECT, INSERT, UPDATE, REFERENCES')
+          );
     """
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, (schema,))
-        tables = [r[0] for r in cur.fetchall()]
+    with get_conn(readonly=True) as conn, conn.cursor() as cur:
+        cur.execute(sql, (schema, sorted(ex)))
+        return cur.fetchone()[0]
 
-    # Фильтруем "служебные" таблицы приложения
-    return [t for t in tables if t not in ex]
 
+# Всё для tables_meta — один запрос на любое число таблиц (relname = ANY):
+# колонки, PK, FK и комментарии колонок идут строками с дискриминатором kind,
+# поля приведены к text, чтобы UNION ALL свёлся к общему виду (tbl, kind, ord, a, b, c, d, e).
+# file-колонки берутся уже разобранными из app_file_columns; JSON-комментарий
+# разбирается в Python, только пока колонки там нет (см. _fill_file_columns).
+# Прямо по pg_catalog: information_schema — слои view поверх тех же таблиц;
+# data_type / is_nullable считаются так же, как в information_schema.columns.
+_TABLE_META_SQL = """
+    WITH rel AS (
+        SELECT c.oid, c.relname::text AS tbl
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %(schema)s AND c.relname = ANY(%(tables)s)
+    ),
+    att AS (
+        SELECT rel.tbl, a.attrelid, a.attnum, a.attname::text AS name, a.atttypid, a.attnotnull
+        FROM pg_catalog.pg_attribute a
+        JOIN rel ON a.attrelid = rel.oid
+        WHERE a.attnum > 0 AND NOT a.attisdropped
+    ),
+    cols AS (
+        SELECT att.tbl, att.name,
+               CASE
+                   WHEN t.typtype = 'd' THEN
+                       CASE
+                           WHEN bt.typelem <> 0 AND bt.typlen = -1 THEN 'ARRAY'
+                           WHEN bn.nspname = 'pg_catalog' THEN pg_catalog.format_type(t.typbasetype, NULL)
+                           ELSE 'USER-DEFINED'
+                       END
+                   WHEN t.typelem <> 0 AND t.typlen = -1 THEN 'ARRAY'
+                   WHEN tn.nspname = 'pg_catalog' THEN pg_catalog.format_type(att.atttypid, NULL)
+                   ELSE 'USER-DEFINED'
+               END AS data_type,
+               CASE
+                   WHEN att.attnotnull OR (t.typtype = 'd' AND t.typnotnull) THEN 'NO'
+                   ELSE 'YES'
+               END AS is_nullable,
+               pg_catalog.pg_get_expr(ad.adbin, ad.adrelid) AS column_default,
+               att.attnum::int AS ord
+        FROM att
+        JOIN pg_catalog.pg_type t ON t.oid = att.atttypid
+        JOIN pg_catalog.pg_namespace tn ON tn.oid = t.typnamespace
+        LEFT JOIN pg_catalog.pg_type bt ON t.typtype = 'd' AND bt.oid = t.typbasetype
+        LEFT JOIN pg_catalog.pg_namespace bn ON bn.oid = bt.typnamespace
+        LEFT JOIN pg_catalog.pg_attrdef ad ON ad.adrelid = att.attrelid AND ad.adnum = att.attnum
+    ),
+    pk AS (
+        SELECT att.tbl, att.name, k.ord::int AS ord
+        FROM pg_catalog.pg_constraint con
+        JOIN rel ON con.conrelid = rel.oid
+        CROSS JOIN LATERAL unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+        JOIN att ON att.attrelid = con.conrelid AND att.attnum = k.attnum
+        WHERE con.contype = 'p'
+    ),
+    fk AS (
+        -- conkey/confkey попарно: составной FK не размножается перекрёстным join
+        SELECT att.tbl, att.name,
+               rc.relname::text AS ref_table,
+               ra.attname::text AS ref_column,
+               k.ord::int AS ord
+        FROM pg_catalog.pg_constraint con
+        JOIN rel ON con.conrelid = rel.oid
+        CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, ref_attnum, ord)
+        JOIN att ON att.attrelid = con.conrelid AND att.attnum = k.attnum
+        JOIN pg_catalog.pg_class rc ON rc.oid = con.confrelid
+        JOIN pg_catalog.pg_attribute ra ON ra.attrelid = con.confrelid AND ra.attnum = k.ref_attnum
+        WHERE con.contype = 'f'
+    )
+    SELECT tbl, 'col' AS kind, ord,
+           name AS a, data_type AS b, is_nullable AS c, column_default AS d, NULL::text AS e
+    FROM cols
+    UNION ALL
+    SELECT tbl, 'pk', ord, name, NULL, NULL, NULL, NULL FROM pk
+    UNION ALL
+    SELECT tbl, 'fk', ord, name, ref_table, ref_column, NULL, NULL FROM fk
+    UNION ALL
+    SELECT att.tbl, 'file', att.attnum::int, att.name, f.base, f.name_column, f.storage_mode, f.required::text
+    FROM att
+    JOIN app_file_columns f
+      ON f.schema_name = %(schema)s AND f.table_name = att.tbl AND f.data_column = att.name
+    UNION ALL
+    -- ещё не материализованные: только комментарии, похожие на file-метаданные.
+    -- Inner join с pg_description вместо col_description() на каждую колонку:
+    -- колонки без комментария (почти все) отсекаются индексом, а не вызовом функции
+    SELECT att.tbl, 'comment', att.attnum::int, att.name, ds.description, NULL, NULL, NULL
+    FROM att
+    JOIN pg_catalog.pg_description ds
+      ON ds.objoid = att.attrelid
+     AND ds.classoid = 'pg_catalog.pg_class'::regclass
+     AND ds.objsubid = att.attnum
+    WHERE ds.description LIKE '%%"file"%%'
+      AND NOT EXISTS (
+          SELECT 1 FROM app_file_columns f
+          WHERE f.schema_name = %(schema)s AND f.table_name = att.tbl AND f.data_column = att.name
+      )
+    ORDER BY tbl, kind, ord;
+"""
 
-def table_meta(table: str, schema: str = "public") -> Dict[str, Any]:
-    with get_conn() as conn, conn.cursor() as cur:
-        # columns
-        cur.execute("""
-            SELECT column_name, data_type, is_nullable, column_default
-            FROM information_schema.columns
-            WHERE table_schema = %s AND table_name = %s
-            ORDER BY ordinal_position;
-        """, (schema, table))
-        columns = cur.fetchall()
-
-        # pk
-        cur.execute("""
-            SELECT kcu.column_name
-            FROM information_schema.table_constraints tc
-            JOIN information_schema.key_column_usage kcu
-              ON tc.constraint_name = kcu.constraint_name
-            WHERE tc.table_schema = %s
-              AND tc.table_name = %s
-              AND tc.constraint_type = 'PRIMARY KEY'
-            ORDER BY kcu.ordinal_position;
-        """, (schema, table))
-        pk = [r[0] for r in cur.fetchall()]
-
-        # fk
-        cur.execute("""
-            SELECT
-              kcu.column_name,
-              ccu.table_name,
-              ccu.column_name
-            FROM information_schema.table_constraints tc
-            JOIN information_schema.key_column_usage kcu
-              ON tc.constraint_name = kcu.constraint_name
-            JOIN information_schema.constraint_column_usage ccu
-              ON ccu.constraint_name = tc.constraint_name
-            WHERE tc.table_schema = %s
-              AND tc.table_name = %s
-              AND tc.constraint_type = 'FOREIGN KEY';
-        """, (schema, table))
-        fks = cur.fetchall()
-
-        # column comments (used for inline file metadata)
-        cur.execute(
-            """
-            SELECT a.attname,
-                   pg_catalog.col_description(c.oid, a.attnum) AS comment
-            FROM pg_catalog.pg_attribute a
-            JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
-            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
-            WHERE n.nspname = %s
-              AND c.relname = %s
-              AND a.attnum > 0
-              AND NOT a.attisdropped;
-            """,
-            (schema, table),
-        )
-        col_comments = cur.fetchall()
-
-    # Parse inline file metadata from comments.
-    # We attach comment JSON on <base>_data column.
-    file_columns: List[Dict[str, Any]] = []
-    for col_name, comment in col_comments:
-        if not comment:
-            continue
-        try:
-            meta = json.loads(comment)
-        except Exception:
-            continue
-        if not isinstance(meta, dict) or not meta.get("file"):
-            continue
-        base = str(meta.get("base") or "").strip()
-        name_col = str(meta.get("name_col") or "").strip()
-        mode = str(meta.get("mode") or "").strip()
-        required = bool(meta.get("required", False))
-        if not base or not name_col or mode not in ("base64", "blob", "fs"):
-            continue
-
-        file_columns.append(
-            {
-                "base": base,
-                "name_column": name_col,
-                "data_column": col_name,
-                "storage_mode": mode,
-                "required": required,
-            }
-        )
 
+def _parse_file_column(col_name: str, comment: str) -> Optional[Dict[str, Any]]:
+    # Inline file metadata: comment JSON is attached to the <base>_data column.
+    try:
+        meta = orjson.loads(comment)
+    except Exception:
+        return None
+    if not isinstance(meta, dict) or not meta.get("file"):
+        return None
+    base = str(meta.get("base") or "").strip()
+    name_col = str(meta.get("name_col") or "").strip()
+    mode = str(meta.get("mode") or "").strip()
+    if not base or not name_col or mode not in ("base64", "blob", "fs"):
+        return None
+    return {
+        "base": base,
+        "name_column": name_col,
+        "data_column": col_name,
+        "storage_mode": mode,
+        "required": bool(meta.get("required", False)),
+    }
+
+
+def _empty_meta(table: str, schema: str) -> Dict[str, Any]:
     return {
         "schema": schema,
         "table": table,
-        "columns": [
-            {
-                "name": c[0],
-                "type": c[1],
-                "nullable": (c[2] == "YES"),
-                "default": c[3],
-            } for c in columns
-        ],
-        "primary_key": pk,
-        "foreign_keys": [
-            {"column": r[0], "ref_table": r[1], "ref_column": r[2]}
-            for r in fks
-        ],
-        "file_columns": file_columns,
+        "columns": [],
+        "primary_key": [],
+        "foreign_keys": [],
+        "file_columns": [],
     }
+
+
+def _fill_meta(out: Dict[str, Dict[str, Any]], rows: Iterable[tuple]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Строки сразу в итоговый вид, за один проход — без промежуточных списков кортежей.
+    Возвращает file-колонки, разобранные из комментариев, — их ещё нет в app_file_columns.
+    """
+    parsed: List[Tuple[str, Dict[str, Any]]] = []
+    for tbl, kind, _ord, a, b, c, d, e in rows:
+        m = out[tbl]
+        if kind == "col":
+            m["columns"].append({"name": a, "type": b, "nullable": c == "YES", "default": d})
+        elif kind == "pk":
+            m["primary_key"].append(a)
+        elif kind == "fk":
+            m["foreign_keys"].append({"column": a, "ref_table": b, "ref_column": c})
+        elif kind == "file":
+            m["file_columns"].append({
+                "base": b,
+                "name_column": c,
+                "data_column": a,
+                "storage_mode": d,
+                "required": e == "true",
+            })
+        else:
+            fc = _parse_file_column(a, b)
+            if fc is not None:
+                m["file_columns"].append(fc)
+                parsed.append((tbl, fc))
+    return parsed
+
+
+def _fill_file_columns(schema: str, parsed: List[Tuple[str, Dict[str, Any]]]) -> None:
+    # ленивое заполнение: следующий table_meta возьмёт эти колонки без разбора JSON
+    with get_conn(own=True) as conn, conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            INSERT INTO app_file_columns
+                (schema_name, table_name, base, name_column, data_column, storage_mode, required)
+            VALUES %s
+            ON CONFLICT DO NOTHING;
+            """,
+            [
+                (schema, tbl, fc["base"], fc["name_column"], fc["data_column"], fc["storage_mode"], fc["required"])
+                for tbl, fc in parsed
+            ],
+        )
+
+
+def tables_meta(tables: List[str], schema: str = "public") -> Dict[str, Dict[str, Any]]:
+    """
+    table_meta сразу для пачки таблиц — один запрос вместо N.
+    Несуществующая таблица получает пустой meta, как и в table_meta.
+    """
+    out: Dict[str, Dict[str, Any]] = {t: _empty_meta(t, schema) for t in tables}
+    if not out:
+        return out
+    params = {"schema": schema, "tables": list(out)}
+    stream = len(out) >= META_STREAM_TABLES
+    with get_conn(readonly=not stream) as conn:
+        if stream:
+            # большая схема: строки приходят FETCH-пачками и сразу раскладываются,
+            # вся выборка в клиентском буфере не собирается
+            with conn.cursor(name=f"meta_{uuid.uuid4().hex}") as cur:
+                cur.itersize = META_ITERSIZE
+                cur.execute(_TABLE_META_SQL, params)
+                parsed = _fill_meta(out, cur)
+        else:
+            with conn.cursor() as cur:
+                cur.execute(_TABLE_META_SQL, params)
+                parsed = _fill_meta(out, cur.fetchall())
+    if parsed:
+        _fill_file_columns(schema, parsed)
+    return out
+
+
+def table_meta(table: str, schema: str = "public") -> Dict[str, Any]:
+    return tables_meta([table], schema=schema)[table]
+
+
+def _meta_cache_put(key: Tuple[str, str], meta: Dict[str, Any], now: float) -> None:
+    # вызывается под _CACHE_LOCK; пустой meta — таблицы нет, не кэшируем
+    if not meta["columns"]:
+        return
+    _META_CACHE.pop(key, None)
+    if len(_META_CACHE) >= META_CACHE_MAX:
+        # самые старые записи — первые в dict
+        for k in list(itertools.islice(_META_CACHE, META_CACHE_MAX // 10)):
+            del _META_CACHE[k]
+    _META_CACHE[key] = (meta, now)
+
+
+def cached_list_tables(schema: str = "public", exclude: Optional[Set[str]] = None) -> List[str]:
+    """list_tables с кэшем на META_TTL секунд. Результат не изменять."""
+    key = (schema, frozenset(exclude or ()))
+    now = time.monotonic()
+    with _CACHE_LOCK:
+        hit = _TABLES_CACHE.get(key)
+        gen = _cache_gen
+    if hit is not None and now - hit[1] < META_TTL:
+        return hit[0]
+
+    tables = list_tables(schema=schema, exclude=exclude)
+    with _CACHE_LOCK:
+        # пока читали, кэш сбросили — прочитанное могло устареть, не кладём
+        if gen == _cache_gen:
+            _TABLES_CACHE[key] = (tables, now)
+    return tables
+
+
+def cached_table_meta(table: str, schema: str = "public") -> Dict[str, Any]:
+    """
+    table_meta с кэшем на META_TTL секунд.
+    Результат общий для потоков — не изменять.
+    """
+    key = (schema, table)
+    now = time.monotonic()
+    with _CACHE_LOCK:
+        hit = _META_CACHE.get(key)
+        gen = _cache_gen
+    if hit is not None and now - hit[1] < META_TTL:
+        return hit[0]
+
+    meta = table_meta(table, schema=schema)
+    with _CACHE_LOCK:
+        if gen == _cache_gen:
+            _meta_cache_put(key, meta, now)
+    return meta
+
+
+def cached_tables_meta(tables: List[str], schema: str = "public") -> Dict[str, Dict[str, Any]]:
+    """
+    cached_table_meta для пачки: попадания — из кэша, промахи — одним
+    запросом tables_meta. Результат общий для потоков — не изменять.
+    """
+    now = time.monotonic()
+    out: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    with _CACHE_LOCK:
+        gen = _cache_gen
+        for t in tables:
+            hit = _META_CACHE.get((schema, t))
+            if hit is not None and now - hit[1] < META_TTL:
+                out[t] = hit[0]
+            else:
+                missing.append(t)
+    if not missing:
+        return out
+
+    loaded = tables_meta(missing, schema=schema)
+    with _CACHE_LOCK:
+        if gen == _cache_gen:
+            for t, meta in loaded.items():
+                _meta_cache_put((schema, t), meta, now)
+    out.update(loaded)
+    return out
+
+
+def invalidate_schema_cache(schema: Optional[str] = None, table: Optional[str] = None) -> None:
+    """
+    Сбросить кэш после DDL/restore. Без аргументов — всё; с table — meta
+    этой таблицы и списки таблиц её схемы (таблица могла появиться/исчезнуть).
+    """
+    global _cache_gen
+    with _CACHE_LOCK:
+        _cache_gen += 1
+        if schema is None:
+            _META_CACHE.clear()
+            _TABLES_CACHE.clear()
+            return
+        if table is None:
+            for k in [k for k in _META_CACHE if k[0] == schema]:
+                del _META_CACHE[k]
+        else:
+            _META_CACHE.pop((schema, table), None)
+        for k in [k for k in _TABLES_CACHE if k[0] == schema]:
+            del _TABLES_CACHE[k]
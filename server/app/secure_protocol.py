@@ -1,62 +1,379 @@
 from __future__ import annotations
 
+import functools
+import os
 import socket
 import struct
-import pickle
-from typing import Any, Tuple
+import tempfile
+from typing import Any, Iterable, Iterator, List, Tuple
+
+import msgspec
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 from app.rsa_block import PublicKey, PrivateKey, encrypt_bytes, decrypt_bytes
-from app.protocol import recv_exact
+from app.protocol import recv_exact, send_parts as _send_parts
+
+# Гибридная схема: RSA шифрует только случайный AES-256 ключ,
+# само тело сообщения шифруется AES-GCM.
+# layout: [len(wrapped):4][len(ct):4][wrapped][nonce:12][ct]
+AES_KEY_LEN = 32
+NONCE_LEN = 12
+TAG_LEN = 16
+# bin-ответ от SEAL_BLOCKS_MIN шифруется и отправляется блоками (см. _send_session_blocks)
+SEAL_BLOCK = 1 << 16
+SEAL_BLOCKS_MIN = 1 << 20
+
+_U32 = struct.Struct(">I")
+_U32X2 = struct.Struct(">II")
+
+# msgpack вместо pickle: быстрее на dict-ответах и не исполняет код при loads
+_ENC = msgspec.msgpack.Encoder()
+_DEC = msgspec.msgpack.Decoder()
+
+
+class Response(msgspec.Struct, kw_only=True):
+    """
+    Envelope ответа сервера. Поля декодируются сразу в слоты (без dict),
+    неизвестные ключи (например "type": "pong") игнорируются.
+    """
+    ok: bool = False
+    error: str | None = None
+    data: dict | None = None
+    token: str | None = None
+    user: dict | None = None
+    tables: list | None = None
+    meta: dict | None = None
+    schedule: dict | None = None
+
+
+_TYPED_DEC: dict[type, msgspec.msgpack.Decoder] = {Response: msgspec.msgpack.Decoder(Response)}
+
+
+def _encrypt_gather(key: bytes, nonce: bytes, parts: List[bytes]) -> List[bytes]:
+    # потоковый GCM: тот же ct||tag, что и AESGCM.encrypt(b"".join(parts)), но без склейки
+    enc = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
+    out = [enc.update(p) for p in parts]
+    enc.finalize()
+    out.append(enc.tag)
+    return out
+
+
+def _encrypt(key: bytes, nonce: bytes, plain: Any) -> List[bytes]:
+    # plain — bytes или gather-список (см. pack_header_body)
+    if isinstance(plain, list):
+        return _encrypt_gather(key, nonce, plain)
+    return [AESGCM(key).encrypt(nonce, plain, None)]
+
+
+def _seal(plain: Any, peer_pub: PublicKey, mode: str) -> List[bytes]:
+    key = os.urandom(AES_KEY_LEN)
+    nonce = os.urandom(NONCE_LEN)
+    cts = _encrypt(key, nonce, plain)
+    wrapped = encrypt_bytes(key, peer_pub, mode=mode)
+    return [_U32X2.pack(len(wrapped), sum(len(c) for c in cts)), wrapped, nonce, *cts]
+
+
+def _open(conn: socket.socket, my_priv: PrivateKey, mode: str) -> bytes:
+    header = recv_exact(conn, 8)
+    wlen, clen = _U32X2.unpack(header)
+    wrapped = recv_exact(conn, wlen)
+    nonce = recv_exact(conn, NONCE_LEN)
+    ct = recv_exact(conn, clen)
+    key = decrypt_bytes(wrapped, my_priv, mode=mode)
+    if len(key) != AES_KEY_LEN:
+        raise ValueError("bad session key")
+    return AESGCM(key).decrypt(nonce, ct, None)
+
 
 def send_encrypted(conn: socket.socket, obj: Any, peer_pub: PublicKey, mode: str) -> None:
-    plain = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
-    enc = encrypt_bytes(plain, peer_pub, mode=mode)
-    conn.sendall(struct.pack(">I", len(enc)) + enc)
+    plain = _ENC.encode(obj)
+    _send_parts(conn, _seal(plain, peer_pub, mode))
 
 
 def recv_encrypted(conn: socket.socket, my_priv: PrivateKey, mode: str) -> Any:
-    header = recv_exact(conn, 4)
-    (length,) = struct.unpack(">I", header)
-    enc = recv_exact(conn, length)
-    plain = decrypt_bytes(enc, my_priv, mode=mode)
-    return pickle.loads(plain)
+    plain = _open(conn, my_priv, mode)
+    return _DEC.decode(plain)
 
 
 # ===== BIN PACKETS =====
 
-def pack_pickle_bin(header_obj: Any, bin_data: bytes) -> bytes:
-    h = pickle.dumps(header_obj, protocol=pickle.HIGHEST_PROTOCOL)
-    return struct.pack(">I", len(h)) + h + struct.pack(">I", len(bin_data)) + bin_data
+# Сериализуется только header; тело (файл) — out-of-band буфер, который
+# сериализатор никогда не видит: оно идёт в шифрование/sendmsg как есть.
+
+def pack_header_body(header_obj: Any, body: bytes | bytearray | memoryview) -> List[bytes]:
+    """[len(h):4][h][len(body):4][body] — gather-список, без склейки с body."""
+    if not isinstance(body, (bytes, bytearray, memoryview)):
+        raise TypeError("body must be bytes-like, not serialized")
+    h = _ENC.encode(header_obj)
+    return [_U32.pack(len(h)), h, _U32.pack(len(body)), body]
 
 
-def unpack_pickle_bin(packet: bytes) -> Tuple[Any, bytes]:
-    off = 0
-    (hlen,) = struct.unpack(">I", packet[off:off+4]); off += 4
-    header = pickle.loads(packet[off:off+hlen]); off += hlen
-    (blen,) = struct.unpack(">I", packet[off:off+4]); off += 4
-    b = packet[off:off+blen]
-    return header, b
+def unpack_header_body(packet: bytes) -> Tuple[Any, memoryview]:
+    # тело возвращаем view на packet — без копии (файлы могут быть большими)
+    mv = memoryview(packet)
+    (hlen,) = _U32.unpack_from(mv, 0)
+    header = _DEC.decode(mv[4:4 + hlen])
+    (blen,) = _U32.unpack_from(mv, 4 + hlen)
+    body = mv[8 + hlen:8 + hlen + blen]
+    return header, body
 
 
 def send_encrypted_bin(
     conn: socket.socket,
     header_obj: Any,
-    bin_data: bytes,
+    bin_data: bytes | memoryview,
     peer_pub: PublicKey,
     mode: str
 ) -> None:
-    packet = pack_pickle_bin(header_obj, bin_data)
-    enc = encrypt_bytes(packet, peer_pub, mode=mode)
-    conn.sendall(struct.pack(">I", len(enc)) + enc)
+    packet = pack_header_body(header_obj, bin_data)
+    _send_parts(conn, _seal(packet, peer_pub, mode))
 
 
 def recv_encrypted_bin(
     conn: socket.socket,
     my_priv: PrivateKey,
     mode: str
-) -> Tuple[Any, bytes]:
+) -> Tuple[Any, memoryview]:
+    packet = _open(conn, my_priv, mode)
+    return unpack_header_body(packet)
+
+
+# ===== SESSION (persistent connection) =====
+# После hello сервер выдаёт сессионный AES ключ (зашифрован RSA ключом клиента),
+# дальше все сообщения в этом соединении идут только через AES-GCM.
+# layout: [len(ct):4][nonce:12][ct]
+
+class SessionKey(bytes):
+    """
+    Сессионный ключ вместе со своим AESGCM — один на соединение, а не на каждое
+    сообщение (расписание ключа AES считается при создании). Контекст живёт,
+    пока сессия держит ключ, и уходит вместе с ней — без глобального кэша.
+    """
+
+    @functools.cached_property
+    def aead(self) -> AESGCM:
+        return AESGCM(self)
+
+
+def new_session_key() -> SessionKey:
+    return SessionKey(os.urandom(AES_KEY_LEN))
+
+
+def _session_aead(key: bytes) -> AESGCM:
+    # гибридные _seal/_open сюда не ходят: у них ключ одноразовый
+    return key.aead if isinstance(key, SessionKey) else AESGCM(key)
+
+
+def send_session_key(conn: socket.socket, key: bytes, peer_pub: PublicKey, mode: str) -> None:
+    wrapped = encrypt_bytes(key, peer_pub, mode=mode)
+    _send_parts(conn, [_U32.pack(len(wrapped)), wrapped])
+
+
+def recv_session_key(conn: socket.socket, my_priv: PrivateKey, mode: str) -> SessionKey:
     header = recv_exact(conn, 4)
-    (length,) = struct.unpack(">I", header)
-    enc = recv_exact(conn, length)
-    packet = decrypt_bytes(enc, my_priv, mode=mode)
-    return unpack_pickle_bin(packet)
+    (length,) = _U32.unpack(header)
+    key = decrypt_bytes(recv_exact(conn, length), my_priv, mode=mode)
+    if len(key) != AES_KEY_LEN:
+        raise ValueError("bad session key")
+    return SessionKey(key)
+
+
+def _seal_session(plain: Any, key: bytes) -> List[bytes]:
+    nonce = os.urandom(NONCE_LEN)
+    if isinstance(plain, list):
+        cts = _encrypt_gather(key, nonce, plain)
+    else:
+        cts = [_session_aead(key).encrypt(nonce, plain, None)]
+    return [_U32.pack(sum(len(c) for c in cts)), nonce, *cts]
+
+
+# длина и nonce читаются одним куском (4 + 12 байт)
+SESSION_HEADER_LEN = 4 + NONCE_LEN
+# предел кадра запроса: длину присылает ещё не проверенный пир, а буфер под
+# кадр выделяется по ней (ответы сервера клиент читает без предела)
+MAX_FRAME = 64 * 1024 * 1024
+
+
+def session_frame_len(header: bytes | bytearray, max_len: int = 0) -> int:
+    """Длина ct по заголовку кадра [len:4][nonce:12]; max_len>0 — не больше max_len."""
+    n = _U32.unpack_from(header)[0]
+    if max_len and n > max_len:
+        raise ValueError("frame too large")
+    return n
+
+
+def open_session_frame(header: bytes | bytearray, ct: bytes | bytearray, key: bytes) -> bytes:
+    # кадр уже прочитан целиком (в т.ч. не из recv_exact — см. reactor в server main)
+    return _session_aead(key).decrypt(bytes(header[4:SESSION_HEADER_LEN]), ct, None)
+
+
+def _open_session(conn: socket.socket, key: bytes, max_len: int = 0) -> bytes:
+    header = recv_exact(conn, SESSION_HEADER_LEN)
+    ct = recv_exact(conn, session_frame_len(header, max_len))
+    return open_session_frame(header, ct, key)
+
+
+def encode_msg(obj: Any) -> bytes:
+    return _ENC.encode(obj)
+
+
+def send_session_encoded(conn: socket.socket, plain: bytes, key: bytes) -> None:
+    # plain — уже сериализованное сообщение (см. encode_msg)
+    _send_parts(conn, _seal_session(plain, key))
+
+
+def send_session(conn: socket.socket, obj: Any, key: bytes) -> None:
+    send_session_encoded(conn, _ENC.encode(obj), key)
+
+
+def recv_session(conn: socket.socket, key: bytes, max_len: int = 0) -> Any:
+    return _DEC.decode(_open_session(conn, key, max_len))
+
+
+def decode_session_frame(header: bytes | bytearray, ct: bytes | bytearray, key: bytes) -> Any:
+    return _DEC.decode(open_session_frame(header, ct, key))
+
+
+def recv_session_typed(conn: socket.socket, key: bytes, kind: type = Response) -> Any:
+    dec = _TYPED_DEC.get(kind)
+    if dec is None:
+        dec = _TYPED_DEC[kind] = msgspec.msgpack.Decoder(kind)
+    return dec.decode(_open_session(conn, key))
+
+
+def _send_session_blocks(conn: socket.socket, parts: List[Any], key: bytes) -> None:
+    """
+    Тот же кадр, что _seal_session(parts), но длина ct известна заранее
+    (открытый текст + тег) — большие буферы шифруются блоками по SEAL_BLOCK
+    в один переиспользуемый буфер и сразу уходят в сокет: копии ct размером
+    с файл в памяти нет.
+    """
+    nonce = os.urandom(NONCE_LEN)
+    enc = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
+    # GCM update_into требует запас в block_size - 1 байт
+    buf = bytearray(SEAL_BLOCK + 15)
+    out = memoryview(buf)
+
+    pending: List[Any] = [_U32.pack(sum(len(p) for p in parts) + TAG_LEN), nonce]
+    for p in parts:
+        mv = memoryview(p)
+        if len(mv) < SEAL_BLOCK:
+            pending.append(enc.update(mv))
+            continue
+        for i in range(0, len(mv), SEAL_BLOCK):
+            n = enc.update_into(mv[i:i + SEAL_BLOCK], buf)
+            pending.append(out[:n])
+            _send_parts(conn, pending)
+            pending = []
+    enc.finalize()
+    pending.append(enc.tag)
+    _send_parts(conn, pending)
+
+
+def send_session_bin(conn: socket.socket, header_obj: Any, bin_data: bytes | memoryview, key: bytes) -> None:
+    packet = pack_header_body(header_obj, bin_data)
+    if len(bin_data) >= SEAL_BLOCKS_MIN:
+        _send_session_blocks(conn, packet, key)
+        return
+    _send_parts(conn, _seal_session(packet, key))
+
+
+def recv_session_bin(conn: socket.socket, key: bytes) -> Tuple[Any, memoryview]:
+    return unpack_header_body(_open_session(conn, key))
+
+
+# ===== STREAM (uploads) =====
+# Заголовок идёт обычным session-сообщением (в нём "size" — общий размер тела),
+# затем тело кусками по STREAM_CHUNK, каждый кусок — отдельный AES-GCM кадр:
+#   [len(ct):4][nonce:12][ct] ... [0:4]   (нулевая длина = конец потока)
+# nonce = [counter:4][random:8] — уникален в пределах сессии, порядок кадров проверяется.
+
+STREAM_CHUNK = 1 << 20
+# Большие тела сначала шифруются во временный файл и уходят через sendfile(2)
+SENDFILE_THRESHOLD = 8 << 20
+
+
+def _iter_stream_frames(chunks: Iterable[Any], key: bytes) -> Iterator[List[bytes]]:
+    """
+    chunk — bytes или список буферов (gather): список шифруется в один кадр,
+    буферы уходят в sendmsg по отдельности.
+    """
+    aes = _session_aead(key)
+    prefix = os.urandom(NONCE_LEN - 4)
+    counter = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        nonce = _U32.pack(counter) + prefix
+        if isinstance(chunk, list):
+            cts = _encrypt_gather(key, nonce, chunk)
+            yield [_U32.pack(sum(len(c) for c in cts)), nonce, *cts]
+        else:
+            ct = aes.encrypt(nonce, chunk, None)
+            yield [_U32.pack(len(ct)), nonce, ct]
+        counter += 1
+    yield [_U32.pack(0)]
+
+
+def send_encrypted_stream(conn: socket.socket, header_obj: Any, chunks: Iterable[Any], key: bytes) -> None:
+    send_session(conn, header_obj, key)
+
+    frames = _iter_stream_frames(chunks, key)
+    if int(header_obj.get("size", 0)) < SENDFILE_THRESHOLD or not hasattr(conn, "sendfile"):
+        for parts in frames:
+            _send_parts(conn, parts)
+        return
+
+    with tempfile.TemporaryFile() as spool:
+        for parts in frames:
+            spool.writelines(parts)
+        spool.flush()
+        spool.seek(0)
+        conn.sendfile(spool)
+
+
+def iter_stream_body(conn: socket.socket, key: bytes, size: int) -> Iterator[bytes]:
+    """
+    Кадры потока после заголовка — по одному расшифрованному куску,
+    без сборки всего тела в памяти.
+    """
+    aes = _session_aead(key)
+    pos = 0
+    counter = 0
+    while True:
+        (length,) = _U32.unpack(recv_exact(conn, 4))
+        if length == 0:
+            break
+        nonce = recv_exact(conn, NONCE_LEN)
+        if _U32.unpack_from(nonce)[0] != counter:
+            raise ValueError("stream frame out of order")
+        chunk = aes.decrypt(nonce, recv_exact(conn, length), None)
+        if pos + len(chunk) > size:
+            raise ValueError("stream larger than declared size")
+        pos += len(chunk)
+        counter += 1
+        yield chunk
+
+    if pos != size:
+        raise ValueError("stream truncated")
+
+
+def recv_stream_body(conn: socket.socket, key: bytes, size: int) -> bytearray:
+    """
+    Тело потока целиком. Буфер растёт по мере прихода кадров, а не выделяется
+    заранее по size из заголовка: заявленный размер ещё ничем не подтверждён.
+    Проверить size (и токен) — дело вызывающего, до вызова.
+    """
+    out = bytearray()
+    for chunk in iter_stream_body(conn, key, size):
+        out += chunk
+    return out
+
+
+def recv_encrypted_stream(conn: socket.socket, key: bytes, max_size: int) -> Tuple[Any, bytearray]:
+    header = recv_session(conn, key, MAX_FRAME)
+    size = int(header.get("size", 0))
+    if size < 0 or size > max_size:
+        raise ValueError("stream too large")
+    return header, recv_stream_body(conn, key, size)
@@ -1,8 +1,12 @@
 # server/app/settings_service.py
-import json
-from typing import Any, Dict, Optional
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
 
-from app.db import get_conn
+import orjson
+from psycopg2.extras import Json
+
+from app.db import execute_prepared, get_conn
 
 DEFAULT_BACKUP_SCHEDULE: Dict[str, Any] = {
     "enabled": True,
@@ -13,53 +17,85 @@ DEFAULT_BACKUP_SCHEDULE: Dict[str, Any] = {
 
 
 def get_setting_json(key: str) -> Optional[Dict[str, Any]]:
-    with get_conn() as conn:
+    with get_conn(readonly=True) as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT value FROM app_settings WHERE key=%s", (key,))
+            execute_prepared(conn, cur, "SELECT value FROM app_settings WHERE key=$1", [key])
             row = cur.fetchone()
             if not row:
                 return None
             # psycopg2 обычно отдаёт jsonb как dict уже, но на всякий случай:
             val = row[0]
             if isinstance(val, str):
-                return json.loads(val)
+                return orjson.loads(val)
             return val
 
 
+def _dumps(value: Any) -> str:
+    # для адаптера Json: orjson вместо json.dumps; str, не bytes — bytes ушли бы как bytea
+    return orjson.dumps(value).decode()
+
+
 def set_setting_json(key: str, value: Dict[str, Any]) -> None:
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(
+            execute_prepared(
+                conn,
+                cur,
                 """
                 INSERT INTO app_settings (key, value)
-                VALUES (%s, %s::jsonb)
+                VALUES ($1, $2)
                 ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value
                 """,
-                (key, json.dumps(value)),
+                # тип $2 PREPARE выводит из колонки (jsonb) — cast не нужен
+                [key, Json(value, dumps=_dumps)],
             )
 
 
+# нормализованное расписание и время загрузки. set_backup_schedule кладёт
+# записанное сразу; TTL — для соседних процессов (reuse_port), которые
+# меняют настройку в обход этого кэша
+SCHEDULE_TTL = 60.0
+_schedule_cache: Optional[Tuple[Dict[str, Any], float]] = None
+_schedule_lock = threading.Lock()
+
+
+def invalidate_settings_cache() -> None:
+    """Сбросить кэш (после restore app_settings могли поменяться)."""
+    global _schedule_cache
+    with _schedule_lock:
+        _schedule_cache = None
+
+
 def get_backup_schedule() -> Dict[str, Any]:
-    s = get_setting_json("backup_schedule")
-    if not s:
-        return DEFAULT_BACKUP_SCHEDULE.copy()
+    with _schedule_lock:
+        hit = _schedule_cache
+    if hit is not None and time.monotonic() - hit[1] < SCHEDULE_TTL:
+        return dict(hit[0])
+
+    out = _load_backup_schedule()
+    _store_schedule(out)
+    return dict(out)
+
 
-    # нормализация
-    out = DEFAULT_BACKUP_SCHEDULE.copy()
-    out.update(s)
+def _store_schedule(schedule: Dict[str, Any]) -> None:
+    global _schedule_cache
+    with _schedule_lock:
+        _schedule_cache = (dict(schedule), time.monotonic())
 
-    out["enabled"] = bool(out.get("enabled", True))
-    out["hour"] = int(out.get("hour", 2))
-    out["minute"] = int(out.get("minute", 0))
-    out["timezone"] = str(out.get("timezone", "UTC"))
 
-    # clamp на всякий случай
-    if out["hour"] < 0: out["hour"] = 0
-    if out["hour"] > 23: out["hour"] = 23
-    if out["minute"] < 0: out["minute"] = 0
-    if out["minute"] > 59: out["minute"] = 59
+def _load_backup_schedule() -> Dict[str, Any]:
+    s = get_setting_json("backup_schedule")
+    if not s:
+        return DEFAULT_BACKUP_SCHEDULE.copy()
 
-    return out
+    # нормализация + clamp на всякий случай; собираем сразу итоговый dict
+    d = DEFAULT_BACKUP_SCHEDULE
+    return {
+        "enabled": bool(s.get("enabled", d["enabled"])),
+        "hour": max(0, min(23, int(s.get("hour", d["hour"])))),
+        "minute": max(0, min(59, int(s.get("minute", d["minute"])))),
+        "timezone": str(s.get("timezone", d["timezone"])),
+    }
 
 
 def set_backup_schedule(enabled: bool, hour: int, minute: int, timezone: str) -> Dict[str, Any]:
@@ -70,4 +106,5 @@ def set_backup_schedule(enabled: bool, hour: int, minute: int, timezone: str) ->
         "timezone": str(timezone),
     }
     set_setting_json("backup_schedule", schedule)
+    _store_schedule(schedule)
     return schedule
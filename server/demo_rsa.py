@@ -1,55 +1,76 @@
 # demo_rsa04.py
 import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 from app.crypto_ctx import init_crypto
 from app.rsa_block import encrypt_bytes, decrypt_bytes
 
-def demo_modes(ctx, plaintext: bytes):
-    k = (ctx.pub.n.bit_length() + 7) // 8
-    print(f"\nRSA_BITS={os.getenv('RSA_BITS','?')}  k(mod bytes)={k}")
-    print(f"PLAINTEXT len={len(plaintext)} bytes, first20={plaintext[:20]!r}")
+# mode -> нужно ли второе шифрование: raw_* детерминированы по построению
+# (c2 == c1 без проверки), повтор имеет смысл только для rand_*
+MODES = {
+    "raw_fixed": False,
+    "raw_len": False,
+    "rand_fixed": True,
+    "rand_len": True,
+}
+# fixed-режимы: шифртекст кратен k (без префиксов длины)
+_MODE_IS_FIXED = {m: m.endswith("fixed") for m in MODES}
+
+def run_mode(args):
+    # в отдельном процессе: приходит только plaintext, наружу — готовые строки.
+    # Ключ воркер берёт сам (init_crypto — из дискового кэша родителя),
+    # приватный ключ между процессами не передаётся
+    mode, needs_two, plaintext = args
+    ctx = init_crypto()
+    pub, priv, k = ctx.pub, ctx.priv, ctx.pub.size
+    c1 = encrypt_bytes(plaintext, pub, mode=mode)
+    c2 = encrypt_bytes(plaintext, pub, mode=mode) if needs_two else c1
+    p1 = decrypt_bytes(c1, priv, mode=mode)
 
-    for mode in ["raw_fixed", "raw_len", "rand_fixed", "rand_len"]:
-        c1 = encrypt_bytes(plaintext, ctx.pub, mode=mode)
-        c2 = encrypt_bytes(plaintext, ctx.pub, mode=mode)
-        p1 = decrypt_bytes(c1, ctx.priv, mode=mode)
+    # форматность
+    if _MODE_IS_FIXED[mode]:
+        aligned = (len(c1) % k == 0)
+        fmt = f"len(cipher)={len(c1)} mod k={len(c1)%k} aligned={aligned}"
+    else:
+        # у len режимов каждый блок имеет +2 байта префикс длины (в нашем коде cbytes всё равно размера k)
+        fmt = f"len(cipher)={len(c1)} (has per-block 2-byte length prefixes)"
 
-        same_cipher = (c1 == c2)
-        ok = (p1 == plaintext)
+    return {"mode": mode, "ok": p1 == plaintext, "same_cipher": c1 == c2, "fmt": fmt}
 
-        # форматность
-        if mode.endswith("fixed"):
-            aligned = (len(c1) % k == 0)
-            fmt = f"len(cipher)={len(c1)} mod k={len(c1)%k} aligned={aligned}"
-        else:
-            # у len режимов каждый блок имеет +2 байта префикс длины (в нашем коде cbytes всё равно размера k)
-            fmt = f"len(cipher)={len(c1)} (has per-block 2-byte length prefixes)"
+def demo_modes(ctx, plaintext: bytes, ex: ProcessPoolExecutor):
+    k = ctx.pub.size  # (n.bit_length() + 7) // 8, посчитан один раз на ключ
+    print(f"\nRSA_BITS={os.getenv('RSA_BITS','?')}  k(mod bytes)={k}")
+    print(f"PLAINTEXT len={len(plaintext)} bytes, first20={plaintext[:20]!r}")
 
-        print(f"\nMODE={mode}")
-        print("  decrypt_ok:", ok)
-        print("  same_cipher_on_repeat:", same_cipher, "(raw_* обычно True, rand_* обычно False)")
-        print("  format:", fmt)
+    # режимы независимы и упираются в CPU (modexp) — считаем параллельно, печатаем по порядку
+    jobs = [(mode, needs_two, plaintext) for mode, needs_two in MODES.items()]
+    for r in ex.map(run_mode, jobs):
+        print(f"\nMODE={r['mode']}")
+        print("  decrypt_ok:", r["ok"])
+        print("  same_cipher_on_repeat:", r["same_cipher"], "(raw_* True по построению, rand_* обычно False)")
+        print("  format:", r["fmt"])
 
-def demo_a_string_no_pickle(ctx):
+def demo_a_string_no_pickle(ctx, ex):
     print("\n=== a) STRING без pickle ===")
     s = "Привет RSA блоки"
     plaintext = s.encode("utf-8")      # <-- без pickle
-    demo_modes(ctx, plaintext)
+    demo_modes(ctx, plaintext, ex)
 
-def demo_b_file_no_pickle(ctx):
+def demo_b_file_no_pickle(ctx, ex):
     print("\n=== b) FILE bytes без pickle ===")
     # имитация файла
     file_bytes = b"%PDF-FAKE%\n" + b"A"*200 + b"\n%%EOF"
-    demo_modes(ctx, file_bytes)
+    demo_modes(ctx, file_bytes, ex)
 
-def demo_c_object_with_pickle(ctx):
+def demo_c_object_with_pickle(ctx, ex):
     print("\n=== c) OBJECT через pickle ===")
     obj = {"id": 1, "roles": ["admin", "user"], "flags": {"a": True, "b": False}}
     plaintext = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)  # <-- pickle
-    demo_modes(ctx, plaintext)
+    demo_modes(ctx, plaintext, ex)
 
 if __name__ == "__main__":
     ctx = init_crypto()
-    demo_a_string_no_pickle(ctx)
-    demo_b_file_no_pickle(ctx)
-    demo_c_object_with_pickle(ctx)
+    with ProcessPoolExecutor(max_workers=min(len(MODES), os.cpu_count() or 1), initializer=init_crypto) as ex:
+        demo_a_string_no_pickle(ctx, ex)
+        demo_b_file_no_pickle(ctx, ex)
+        demo_c_object_with_pickle(ctx, ex)